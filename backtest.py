@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Backtest กฎซื้อขายจาก compute_signals
+- โหลดราคา (stock_price_history) + สัญญาณ (stock_signal หรือคำนวณสดจาก signal_rules) ทุก symbol เป็น numpy array [วัน, symbol]
+- จำลองซื้อ/ขายทีละวัน แต่ทุกวันคำนวณพร้อมกันทั้ง [กฎ, symbol] (vectorized) → 10 ปี 800 ตัวใช้เวลาหลักวินาที
+- entry: สัญญาณวันนี้ → ซื้อที่ราคาเปิดวันถัดไป, exit: สัญญาณขาย / ถือครบ max_hold วัน / stop loss / take profit → ขายที่ราคาเปิดวันถัดไป
+- ค่าธรรมเนียมต่อขา = commission * (1 + vat) ใช้ค่าจาก portfolio_stock (updatePort) ถ้ามี
+- ผลต่อกฎ: จำนวนเทรด, win rate, ผลตอบแทนเฉลี่ย/รวม, max drawdown ของพอร์ตถือเท่ากันทุกตัว
+- sweep mode: ลองหลายชุดพารามิเตอร์กระจายไป process pool
+
+ตัวอย่าง:
+    python backtest.py --start 2015-01-01 --max-hold 20 --stop-loss 0.08
+    python backtest.py --source rules --ruleset extended --sweep "max_hold=10,20,40;stop_loss=0,0.05,0.1"
+"""
+
+import os
+import argparse
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, timedelta
+import numpy as np
+import pandas as pd
+import psycopg2
+import db
+from dotenv import load_dotenv
+
+load_dotenv()
+
+START_DATE_STR = os.getenv("BT_START")                        # เช่น '2015-01-01'; ถ้าไม่ตั้ง ย้อนหลัง BT_YEARS ปี
+BT_YEARS       = int(os.getenv("BT_YEARS", "10"))
+ENTRY_TYPES    = tuple(os.getenv("BT_ENTRY_TYPES", "BUY").split(","))   # signal_type ที่นับเป็นจุดซื้อ (แยกผลตาม reason)
+EXIT_TYPES     = tuple(os.getenv("BT_EXIT_TYPES", "SELL").split(","))   # signal_type ที่สั่งขาย
+DEFAULT_COMMISSION = 0.00157  # 0.157% ต่อขา (ค่าทั่วไปของบัญชี internet)
+DEFAULT_VAT        = 0.07
+SWEEP_WORKERS  = int(os.getenv("BT_WORKERS", str(max(1, (os.cpu_count() or 2) - 1))))
+
+# ------------------------------------------------
+def resolve_start_date():
+    if START_DATE_STR:
+        return datetime.strptime(START_DATE_STR, "%Y-%m-%d").date()
+    return date.today() - timedelta(days=365 * BT_YEARS)
+
+def fetch_prices(start):
+    q = """
+        SELECT symbol, date AS trade_date, open, close
+        FROM stock_price_history
+        WHERE date >= %s
+        ORDER BY symbol, trade_date;
+    """
+    return db.read_frame(q, (start,))  # server-side cursor (ประวัติหลายปี)
+
+def fetch_signals(start):
+    q = """
+        SELECT symbol, trade_date, signal_type, reason
+        FROM stock_signal
+        WHERE trade_date >= %s
+        ORDER BY symbol, trade_date;
+    """
+    return db.read_frame(q, (start,))  # server-side cursor (ประวัติหลายปี)
+
+def normalize_rate(x, pct_above):
+    """settrade อาจส่งเป็นเปอร์เซ็นต์ (0.157, 7) หรือสัดส่วน (0.00157, 0.07) → แปลงเป็นสัดส่วนเสมอ"""
+    x = float(x)
+    return x / 100 if x > pct_above else x
+
+def load_fee():
+    """ค่าธรรมเนียมต่อขา = commission * (1 + vat); env BT_COMMISSION/BT_VAT > portfolio_stock > ค่า default"""
+    commission, vat = DEFAULT_COMMISSION, DEFAULT_VAT
+    try:
+        with db.connect() as conn, conn.cursor() as cur:
+            cur.execute("""
+                SELECT commission_rate, vat_rate FROM portfolio_stock
+                WHERE commission_rate IS NOT NULL
+                ORDER BY imported_at DESC LIMIT 1;
+            """)
+            row = cur.fetchone()
+            if row:
+                commission = normalize_rate(row[0], 0.05)
+                if row[1] is not None:
+                    vat = normalize_rate(row[1], 1)
+    except psycopg2.Error as e:
+        print(f"⚠️ ใช้ค่าธรรมเนียม default (อ่าน portfolio_stock ไม่ได้: {e.pgerror or e})")
+    commission = float(os.getenv("BT_COMMISSION", commission))
+    vat = float(os.getenv("BT_VAT", vat))
+    return commission * (1 + vat)
+
+# ------------------------------------------------
+def signal_events(signals, entry_types=ENTRY_TYPES, exit_types=EXIT_TYPES):
+    """stock_signal → (entries[symbol, trade_date, rule], exits[symbol, trade_date]); rule = 'signal_type | reason'"""
+    ent = signals[signals["signal_type"].isin(entry_types)]
+    entries = ent[["symbol", "trade_date"]].assign(rule=ent["signal_type"] + " | " + ent["reason"])
+    exits = signals.loc[signals["signal_type"].isin(exit_types), ["symbol", "trade_date"]]
+    return entries, exits
+
+def rule_events(ind, rules, entry_types=ENTRY_TYPES, exit_types=EXIT_TYPES):
+    """คำนวณสัญญาณสดจาก indicator ด้วย signal_rules (เทสกฎที่ยังไม่ได้เขียนลง stock_signal ได้)
+    entry แยกตามกฎแต่ละข้อ (ไม่โดน priority ของกฎอื่นบัง), exit ใช้สัญญาณที่ชนะตาม priority เหมือนใน stock_signal"""
+    d, m = rules.masks(ind)
+    ok = ~d[rules.required].isna().any(axis=1).to_numpy() if rules.required else np.ones(len(d), dtype=bool)
+    parts = []
+    for j, r in enumerate(rules.rules):
+        if r["signal"] in entry_types:
+            hit = m[:, j] & ok
+            parts.append(d.loc[hit, ["symbol", "trade_date"]].assign(rule=f'{r["signal"]} | {r["reason"]}'))
+    entries = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(columns=["symbol", "trade_date", "rule"])
+    sig = rules.evaluate(ind)
+    exits = sig.loc[sig["signal_type"].isin(exit_types), ["symbol", "trade_date"]]
+    return entries, exits
+
+def to_panel(price, entries, exits):
+    """จัดข้อมูลเป็น array [วัน, symbol]: open (NaN = วันที่ไม่มีเทรด), close (ffill), entries {rule: bool}, exits bool"""
+    s_codes, symbols = pd.factorize(price["symbol"])
+    d_codes, dates = pd.factorize(price["trade_date"], sort=True)
+    T, N = len(dates), len(symbols)
+
+    def to_mat(v):
+        out = np.full((T, N), np.nan)
+        out[d_codes, s_codes] = pd.to_numeric(v, errors="coerce").to_numpy(dtype=float)
+        return out
+
+    o = to_mat(price["open"])
+    c = pd.DataFrame(to_mat(price["close"])).ffill().to_numpy()
+
+    def to_mask(ev):
+        mask = np.zeros((T, N), dtype=bool)
+        ti = dates.get_indexer(ev["trade_date"])
+        si = symbols.get_indexer(ev["symbol"])
+        keep = (ti >= 0) & (si >= 0)
+        mask[ti[keep], si[keep]] = True
+        return mask
+
+    return {
+        "dates": dates, "symbols": symbols, "open": o, "close": c,
+        "entries": {rule: to_mask(ev) for rule, ev in entries.groupby("rule")},
+        "exits": to_mask(exits),
+    }
+
+# ------------------------------------------------
+def simulate(panel, fee, max_hold=0, stop_loss=0.0, take_profit=0.0):
+    """จำลองทุกกฎพร้อมกัน ถือได้ครั้งละ 1 position ต่อ (กฎ, symbol)
+    คืน (trades DataFrame, equity array [กฎ, วัน]) โดย equity = พอร์ตถือเท่ากันทุก position ที่เปิดอยู่ (ไม่มี position = ถือเงินสด)"""
+    rules = list(panel["entries"])
+    o, c, X = panel["open"], panel["close"], panel["exits"]
+    T, N = c.shape
+    R = len(rules)
+    E = np.stack([panel["entries"][r] for r in rules]) if R else np.zeros((0, T, N), dtype=bool)
+
+    in_pos = np.zeros((R, N), dtype=bool)
+    entry_px = np.full((R, N), np.nan)
+    entry_t = np.zeros((R, N), dtype=np.int64)
+    equity = np.ones((R, T))
+    trades = []
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for t in range(1, T):
+            ot, ct, cp = o[t], c[t], c[t - 1]
+            can = in_pos & ~np.isnan(ot)  # มีราคาเปิดวันนี้ถึงจะขายได้
+            ex = can & X[t - 1]
+            if max_hold:
+                ex |= can & (t - entry_t >= max_hold)
+            if stop_loss:
+                ex |= can & (cp <= entry_px * (1 - stop_loss))
+            if take_profit:
+                ex |= can & (cp >= entry_px * (1 + take_profit))
+            held = in_pos & ~ex
+            en = ~in_pos & E[:, t - 1] & ~np.isnan(ot)
+
+            # ผลตอบแทนรายวันของแต่ละ position (รวมค่าธรรมเนียมในวันซื้อ/ขาย)
+            r = np.where(held, ct / cp - 1, 0.0)
+            r = np.where(ex, ot * (1 - fee) / cp - 1, r)
+            r = np.where(en, ct / (ot * (1 + fee)) - 1, r)
+            active = held | ex | en
+            cnt = active.sum(axis=1)
+            day = np.where(cnt > 0, np.where(active, r, 0.0).sum(axis=1) / np.maximum(cnt, 1), 0.0)
+            equity[:, t] = equity[:, t - 1] * (1 + day)
+
+            if ex.any():
+                ri, si = np.nonzero(ex)
+                trades.append((ri, si, entry_t[ri, si], np.full(len(ri), t),
+                               ot[si] * (1 - fee) / (entry_px[ri, si] * (1 + fee)) - 1, np.ones(len(ri), dtype=bool)))
+            in_pos &= ~ex
+            in_pos |= en
+            entry_px = np.where(en, ot, entry_px)
+            entry_t = np.where(en, t, entry_t)
+
+    # position ที่ยังเปิดอยู่ mark-to-market ด้วยราคาปิดวันสุดท้าย (closed = False)
+    if in_pos.any():
+        ri, si = np.nonzero(in_pos)
+        trades.append((ri, si, entry_t[ri, si], np.full(len(ri), T - 1),
+                       c[-1, si] * (1 - fee) / (entry_px[ri, si] * (1 + fee)) - 1, np.zeros(len(ri), dtype=bool)))
+
+    cols = ["rule", "symbol", "entry_date", "exit_date", "ret", "closed"]
+    if not trades:
+        return pd.DataFrame(columns=cols + ["hold_days"]), equity
+    ri, si, t0, t1, ret, closed = (np.concatenate(x) for x in zip(*trades))
+    df = pd.DataFrame({
+        "rule": np.asarray(rules, dtype=object)[ri], "symbol": panel["symbols"][si],
+        "entry_date": panel["dates"][t0], "exit_date": panel["dates"][t1], "ret": ret, "closed": closed,
+    })
+    df["hold_days"] = t1 - t0
+    return df, equity
+
+def summarize(panel, trades, equity):
+    """สรุปผลต่อกฎ: trades, win_rate, avg_return, total_return, max_drawdown, avg_hold_days"""
+    rules = list(panel["entries"])
+    peak = np.maximum.accumulate(equity, axis=1) if equity.size else equity
+    mdd = (equity / peak - 1).min(axis=1) if equity.size else np.zeros(len(rules))
+    g = trades.groupby("rule")
+    out = pd.DataFrame({
+        "rule": rules,
+        "total_return": equity[:, -1] - 1 if equity.size else np.zeros(len(rules)),
+        "max_drawdown": mdd,
+    }).set_index("rule")
+    out["trades"] = g.size().reindex(out.index).fillna(0).astype(int)
+    out["win_rate"] = g["ret"].apply(lambda r: (r > 0).mean()).reindex(out.index)
+    out["avg_return"] = g["ret"].mean().reindex(out.index)
+    out["avg_hold_days"] = g["hold_days"].mean().reindex(out.index)
+    cols = ["trades", "win_rate", "avg_return", "total_return", "max_drawdown", "avg_hold_days"]
+    return out[cols].reset_index()
+
+def run(panel, fee, **params):
+    trades, equity = simulate(panel, fee, **params)
+    return summarize(panel, trades, equity), trades
+
+# ------------------------------------------------
+# sweep: panel ส่งไปแต่ละ worker ครั้งเดียวผ่าน initializer
+_PANEL, _FEE = None, None
+
+def _init_worker(panel, fee):
+    global _PANEL, _FEE
+    _PANEL, _FEE = panel, fee
+
+def _run_params(params):
+    summary, _ = run(_PANEL, _FEE, **params)
+    return summary.assign(**params)
+
+def parse_grid(text):
+    """'max_hold=10,20;stop_loss=0,0.05' → [{'max_hold': 10, 'stop_loss': 0.0}, ...]"""
+    keys, values = [], []
+    for part in filter(None, (p.strip() for p in text.split(";"))):
+        k, v = part.split("=", 1)
+        conv = int if k.strip() == "max_hold" else float
+        keys.append(k.strip())
+        values.append([conv(x) for x in v.split(",")])
+    return [dict(zip(keys, combo)) for combo in itertools.product(*values)]
+
+def sweep(panel, fee, grid, workers=SWEEP_WORKERS):
+    """รันทุกชุดพารามิเตอร์ใน grid กระจายไป process pool คืนผลต่อ (กฎ, ชุดพารามิเตอร์)"""
+    if workers <= 1 or len(grid) <= 1:
+        _init_worker(panel, fee)
+        return pd.concat([_run_params(p) for p in grid], ignore_index=True)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(panel, fee)) as ex:
+        return pd.concat(list(ex.map(_run_params, grid)), ignore_index=True)
+
+# ------------------------------------------------
+def load_panel(start, source="signal", ruleset="base"):
+    price = fetch_prices(start)
+    if source == "rules":
+        import compute_signals as cs
+        import signal_rules
+        ind = cs.fetch_recent_indicators((date.today() - start).days)
+        entries, exits = rule_events(ind, signal_rules.load_ruleset(ruleset))
+    else:
+        entries, exits = signal_events(fetch_signals(start))
+    return to_panel(price, entries, exits)
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Backtest กฎสัญญาณซื้อขาย")
+    ap.add_argument("--start", help="YYYY-MM-DD (default: ย้อนหลัง BT_YEARS ปี)")
+    ap.add_argument("--source", choices=["signal", "rules"], default="signal", help="signal = stock_signal, rules = คำนวณสดจาก indicator")
+    ap.add_argument("--ruleset", default="base", help="ชุดกฎใน signal_rules.RULESETS (ใช้กับ --source rules)")
+    ap.add_argument("--max-hold", type=int, default=0, help="ขายเมื่อถือครบ N วันทำการ (0 = ไม่จำกัด)")
+    ap.add_argument("--stop-loss", type=float, default=0.0, help="เช่น 0.08 = ตัดขาดทุน 8%%")
+    ap.add_argument("--take-profit", type=float, default=0.0)
+    ap.add_argument("--sweep", help='grid เช่น "max_hold=10,20,40;stop_loss=0,0.05"')
+    ap.add_argument("--workers", type=int, default=SWEEP_WORKERS)
+    ap.add_argument("--out", help="บันทึกผลสรุปเป็น CSV")
+    args = ap.parse_args(argv)
+
+    start = datetime.strptime(args.start, "%Y-%m-%d").date() if args.start else resolve_start_date()
+    t0 = datetime.now()
+    panel = load_panel(start, args.source, args.ruleset)
+    fee = load_fee()
+    T, N = panel["close"].shape
+    print(f"📦 {N:,} symbols x {T:,} days, {len(panel['entries'])} rules, fee/side = {fee:.5f} (load {(datetime.now() - t0).total_seconds():.1f}s)")
+    if not panel["entries"]:
+        print("❌ No entry signals.")
+        return
+
+    t0 = datetime.now()
+    if args.sweep:
+        result = sweep(panel, fee, parse_grid(args.sweep), args.workers)
+    else:
+        result, _ = run(panel, fee, max_hold=args.max_hold, stop_loss=args.stop_loss, take_profit=args.take_profit)
+    print(f"⏱️ simulate {(datetime.now() - t0).total_seconds():.2f}s")
+
+    with pd.option_context("display.max_rows", 200, "display.width", 200):
+        print(result.sort_values("total_return", ascending=False).to_string(index=False))
+    if args.out:
+        result.to_csv(args.out, index=False)
+        print(f"💾 saved {args.out}")
+
+    print("✅ Done backtest.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Chrome (Selenium) ที่ใช้ร่วมกันระหว่าง scraper (updateStockList, updateStockInfo_siamChart)
+- pool ขนาด BROWSER_POOL_SIZE (ค่าเริ่มต้น 1) สร้างครั้งแรกเมื่อถูกใช้ แล้ว reuse ข้ามหน้า/ข้าม scraper จนกว่าจะ close()
+  (taskUpdate รันสอง scraper ติดกันวันที่ 5 → cold start Chrome ครั้งเดียว)
+- บล็อกรูป (pref) และรูป/ฟอนต์/วิดีโอ (CDP Network.setBlockedURLs) ลดข้อมูลที่โหลด
+- wait helpers แทน time.sleep คงที่: wait_ready / wait_clickable / wait_rows / scroll_into_view
+- page(url) จับเวลาโหลดต่อหน้าเก็บใน TIMINGS, print_timings() สรุป
+
+ตัวอย่าง:
+    import browser_session as bs
+    with bs.page("http://siamchart.com/stock/") as driver:
+        html = bs.table_html(driver, '//*[@id="table_data"]/table')
+"""
+
+import os
+import time
+import queue
+import atexit
+import threading
+from contextlib import contextmanager
+
+from selenium import webdriver
+from selenium.common.exceptions import WebDriverException
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.webdriver.support import expected_conditions as EC
+
+BROWSER_POOL_SIZE = int(os.getenv("BROWSER_POOL_SIZE", "1"))
+BROWSER_TIMEOUT   = int(os.getenv("BROWSER_TIMEOUT", "20"))
+BROWSER_HEADLESS  = os.getenv("BROWSER_HEADLESS", "1") == "1"
+BROWSER_BLOCK     = ["*.png", "*.jpg", "*.jpeg", "*.gif", "*.webp", "*.svg", "*.ico",
+                     "*.woff", "*.woff2", "*.ttf", "*.otf", "*.mp4", "*.webm"]
+
+TIMINGS = []   # (url, วินาทีถึง document ready, วินาทีรวมจนจบ block)
+
+_pool = queue.LifoQueue()
+_created = 0
+_lock = threading.Lock()
+
+# ------------------------------------------------
+def _new_driver():
+    options = webdriver.ChromeOptions()
+    if BROWSER_HEADLESS:
+        options.add_argument("--headless=new")
+    options.add_argument("--window-size=1920,1080")
+    options.add_argument("--disable-dev-shm-usage")
+    options.add_argument("--no-sandbox")
+    options.add_argument("--disable-gpu")
+    options.add_argument("--remote-allow-origins=*")
+    # Chrome มี pref บล็อกรูปเท่านั้น (ไม่มี pref สำหรับฟอนต์) ฟอนต์/วิดีโอบล็อกผ่าน CDP ด้วย BROWSER_BLOCK
+    options.add_experimental_option("prefs", {"profile.managed_default_content_settings.images": 2})
+    t0 = time.time()
+    driver = webdriver.Chrome(options=options)
+    try:
+        driver.execute_cdp_cmd("Network.enable", {})
+        driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": BROWSER_BLOCK})
+    except WebDriverException:
+        pass  # driver ที่ไม่รองรับ CDP บล็อกได้แค่รูป (pref)
+    print(f"🌐 Chrome started in {time.time() - t0:.1f}s")
+    return driver
+
+def _quit(driver):
+    try:
+        driver.quit()
+    except Exception:
+        pass  # session ตายไปแล้ว quit อาจ error แต่ยังปิด chromedriver process ให้
+
+def _alive(driver):
+    try:
+        driver.current_url
+        return True
+    except WebDriverException:
+        return False
+
+@contextmanager
+def acquire():
+    """ยืม driver จาก pool (สร้างใหม่ถ้ายังไม่ครบ BROWSER_POOL_SIZE) แล้วคืนเมื่อจบ block"""
+    global _created
+    driver = None
+    with _lock:
+        if _pool.empty() and _created < BROWSER_POOL_SIZE:
+            _created += 1
+            driver = "new"
+    if driver == "new":
+        try:
+            driver = _new_driver()
+        except Exception:
+            with _lock:
+                _created -= 1
+            raise
+    else:
+        driver = _pool.get()
+        if not _alive(driver):   # session หลุด (Chrome crash) → ปิด process เดิมแล้วสร้างใหม่แทน
+            _quit(driver)
+            try:
+                driver = _new_driver()
+            except Exception:
+                with _lock:
+                    _created -= 1
+                raise
+    try:
+        yield driver
+    finally:
+        _pool.put(driver)
+
+@contextmanager
+def page(url, timeout=BROWSER_TIMEOUT):
+    """เปิด url บน driver จาก pool รอ document ready แล้วจับเวลา"""
+    with acquire() as driver:
+        t0 = time.time()
+        driver.get(url)
+        wait_ready(driver, timeout)
+        t_load = time.time() - t0
+        try:
+            yield driver
+        finally:
+            TIMINGS.append((url, t_load, time.time() - t0))
+
+def close():
+    """ปิด Chrome ทั้งหมดใน pool"""
+    global _created
+    while not _pool.empty():
+        _quit(_pool.get_nowait())
+    _created = 0
+
+atexit.register(close)
+
+def print_timings():
+    for url, t_load, t_total in TIMINGS:
+        print(f"   ⏱️ load {t_load:6.2f}s  total {t_total:6.2f}s  {url}")
+
+# ------------------------------------------------
+def wait_ready(driver, timeout=BROWSER_TIMEOUT):
+    WebDriverWait(driver, timeout).until(lambda d: d.execute_script("return document.readyState") == "complete")
+
+def wait_clickable(driver, xpath, timeout=BROWSER_TIMEOUT):
+    return WebDriverWait(driver, timeout).until(EC.element_to_be_clickable((By.XPATH, xpath)))
+
+def wait_rows(driver, table_xpath, timeout=BROWSER_TIMEOUT):
+    """รอจนตารางมี <tr> ใน tbody อย่างน้อย 1 แถว"""
+    wait = WebDriverWait(driver, timeout)
+    wait.until(EC.presence_of_element_located((By.XPATH, table_xpath)))
+    wait.until(lambda d: len(d.find_elements(By.XPATH, table_xpath + "/tbody/tr")) > 0)
+
+def scroll_into_view(driver, element, offset=80, timeout=BROWSER_TIMEOUT):
+    """เลื่อน element มากลางจอ (เว้น header) แล้วรอจนอยู่ใน viewport แทนการ sleep"""
+    driver.execute_script("arguments[0].scrollIntoView({block:'center', inline:'nearest'});"
+                          "window.scrollBy(0, -arguments[1]);", element, offset)
+    WebDriverWait(driver, timeout).until(lambda d: d.execute_script(
+        "const r = arguments[0].getBoundingClientRect();"
+        "return r.top >= 0 && r.bottom <= window.innerHeight;", element))
+
+def click(driver, xpath, timeout=BROWSER_TIMEOUT):
+    """รอ clickable → เลื่อนเข้าจอ → คลิก (สำรองด้วย JavaScript ถ้ามีอะไรบัง)"""
+    el = wait_clickable(driver, xpath, timeout)
+    scroll_into_view(driver, el, timeout=timeout)
+    try:
+        el.click()
+    except WebDriverException:
+        driver.execute_script("arguments[0].click();", el)
+    return el
+
+def table_html(driver, table_xpath, timeout=BROWSER_TIMEOUT):
+    wait_rows(driver, table_xpath, timeout)
+    return driver.find_element(By.XPATH, table_xpath).get_attribute("outerHTML")
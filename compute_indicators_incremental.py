@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Incremental mode ของ compute_indicators_v4
+- เก็บ state ล่าสุดต่อ symbol (EMA, RSI avg_gain/avg_loss, MACD signal EMA, volume EMA, หน้าต่าง volume 20 วัน)
+  ไว้ในตาราง stock_indicator_state_v4 แล้วเดิน state ต่อเฉพาะแท่งใหม่ (date > last_trade_date)
+- symbol ที่ยังไม่มี state จะ seed จากช่วง START_DATE / LOOKBACK_DAYS แบบเดียวกับโหมดเต็ม
+- สูตร recursive เหมือน pandas ewm(adjust=False, min_periods=...) ที่ ema()/rsi()/macd_components() ใช้
+  ผลจึงเท่ากับการคำนวณเต็มช่วงตั้งแต่วันที่ seed
+- state จำจำนวนแท่งที่เดินไปแล้ว (first_trade_date..last_trade_date, n_bars) ถ้าจำนวนแท่งในช่วงนั้นใน DB ไม่ตรง
+  (เช่น gap planner ของ updateStockPrice เติมวันที่ขาดย้อนหลัง หรือมีแถวถูกลบ) symbol นั้นจะถูก seed ใหม่อัตโนมัติ
+- ถ้าแก้ราคาย้อนหลังโดยจำนวนแท่งเท่าเดิม ให้รัน IND_RESEED=1 (ลบ state แล้ว seed ใหม่) หรือรันโหมดเต็มตามเดิม
+"""
+
+import os
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+from psycopg2.extras import execute_values, Json
+from dotenv import load_dotenv
+
+import db
+import compute_indicators_v4 as v4
+
+load_dotenv()
+
+RESEED = os.getenv("IND_RESEED", "0") == "1"
+
+EMA_SPANS, RSI_PERIODS, MACD_SETS, VOL_EMA_SPANS = v4.EMA_SPANS, v4.RSI_PERIODS, v4.MACD_SETS, v4.VOL_EMA_SPANS
+VOL_WINDOW  = 20
+MIN_CLOSES  = 30   # เหมือนโหมดเต็ม: ข้าม symbol ที่มีราคาปิดน้อยกว่านี้
+
+STATE_DDL = """
+CREATE TABLE IF NOT EXISTS stock_indicator_state_v4 (
+    symbol          TEXT PRIMARY KEY,
+    last_trade_date DATE NOT NULL,
+    state           JSONB NOT NULL,
+    updated_at      TIMESTAMP DEFAULT now()
+);
+"""
+
+STATE_UPSERT_SQL = """
+INSERT INTO stock_indicator_state_v4 (symbol, last_trade_date, state)
+VALUES %s
+ON CONFLICT (symbol) DO UPDATE SET
+  last_trade_date = EXCLUDED.last_trade_date,
+  state = EXCLUDED.state,
+  updated_at = now();
+"""
+
+def ensure_state_table():
+    with db.connect() as conn, conn.cursor() as cur:
+        cur.execute(STATE_DDL)
+        if RESEED:
+            cur.execute("TRUNCATE stock_indicator_state_v4;")
+        conn.commit()
+
+def load_states(symbols):
+    with db.connect() as conn, conn.cursor() as cur:
+        cur.execute("SELECT symbol, state FROM stock_indicator_state_v4 WHERE symbol = ANY(%s);", (symbols,))
+        # state รุ่นเก่าที่ยังไม่มี vol_ema / n_bars จะถูก seed ใหม่ (EMA ย้อนหลังสร้างจาก state ไม่ได้)
+        return {sym: st for sym, st in cur.fetchall() if "vol_ema" in st and "n_bars" in st}
+
+def stale_symbols(spans):
+    """spans = {symbol: (first_date, last_date, n_bars)} ที่คำนวณไว้แล้ว
+    คืน symbol ที่จำนวนแท่งใน stock_price_history ช่วง first_date..last_date ไม่เท่ากับ n_bars
+    = มีแท่งถูกเติม/ลบย้อนหลัง (วันที่ <= last_date) ซึ่งการอ่านเฉพาะแท่งใหม่มองไม่เห็น
+    (ใช้ร่วมกับ compute_support_resistance / compute_liquidity)"""
+    if not spans:
+        return set()
+    syms = list(spans)
+    with db.connect() as conn, conn.cursor() as cur:
+        cur.execute("""
+            SELECT s.symbol
+            FROM unnest(%s::text[], %s::date[], %s::date[], %s::int[]) AS s(symbol, first_date, last_date, n_bars)
+            WHERE (SELECT count(*) FROM stock_price_history p
+                   WHERE p.symbol = s.symbol AND p.date BETWEEN s.first_date AND s.last_date) <> s.n_bars;
+        """, (syms, *(list(col) for col in zip(*(spans[s] for s in syms)))))
+        return {r[0] for r in cur.fetchall()}
+
+def backfilled_symbols(states):
+    """symbol ที่ state เดินไม่ครบ/เกินจำนวนแท่งใน DB (ดู stale_symbols)"""
+    return stale_symbols({sym: (st["first_trade_date"], st["last_trade_date"], st["n_bars"]) for sym, st in states.items()})
+
+def save_states(states):
+    if not states:
+        return
+    rows = [(sym, st["last_trade_date"], Json(st)) for sym, st in states.items()]
+    with db.connect() as conn, conn.cursor() as cur:
+        execute_values(cur, STATE_UPSERT_SQL, rows, page_size=v4.BATCH_SIZE)
+        conn.commit()
+
+def fetch_new_bars(symbols):
+    """ดึงเฉพาะแท่งที่ใหม่กว่า last_trade_date ของแต่ละ symbol ในคิวรีเดียว"""
+    with db.connect() as conn:
+        q = """
+        SELECT p.symbol, p.date AS trade_date, p.open, p.high, p.low, p.close, p.volume
+        FROM stock_price_history p
+        JOIN stock_indicator_state_v4 s ON s.symbol = p.symbol
+        WHERE p.date > s.last_trade_date AND p.symbol = ANY(%s)
+        ORDER BY p.symbol, trade_date;
+        """
+        return pd.read_sql(q, conn, params=(symbols,))
+
+# -------- recursive state (ตรงกับ pandas ewm adjust=False, ignore_na=False) --------
+def ewm_init():
+    # w = ค่า weighted ล่าสุด (None = ยังไม่มี observation), nobs = จำนวน observation ที่เจอ
+    return {"w": None, "old_wt": 1.0, "nobs": 0}
+
+def ewm_step(st, x, alpha, min_periods):
+    """เดิน ewm ไป 1 แท่ง (แก้ st ในที่) คืนค่า output ของแท่งนั้น (NaN ถ้ายังไม่ครบ min_periods)"""
+    obs = not np.isnan(x)
+    if obs:
+        st["nobs"] += 1
+    if st["w"] is not None:
+        st["old_wt"] *= 1.0 - alpha
+        if obs:
+            w = st["w"]
+            if w != x:
+                w = (st["old_wt"] * w + alpha * x) / (st["old_wt"] + alpha)
+            st["w"] = w
+            st["old_wt"] = 1.0
+    elif obs:
+        st["w"] = x
+    return st["w"] if st["nobs"] >= min_periods else np.nan
+
+def new_state():
+    spans = set(EMA_SPANS)
+    for fast, slow, _ in MACD_SETS.values():
+        spans.update((fast, slow))
+    return {
+        "first_trade_date": None,
+        "last_trade_date": None,
+        "n_bars": 0,                # จำนวนแท่ง (ทุกแถวใน stock_price_history) ที่เดินไปแล้ว
+        "close": None,
+        "ema": {str(s): ewm_init() for s in sorted(spans)},
+        "rsi": {str(p): {"gain": ewm_init(), "loss": ewm_init()} for p in RSI_PERIODS},
+        "macd_signal": {k: ewm_init() for k in MACD_SETS},
+        "vol_ema": {str(s): ewm_init() for s in VOL_EMA_SPANS},
+        "vol": [],
+    }
+
+def advance(state, df_sym):
+    """เดิน state ต่อด้วยแท่งใน df_sym (เรียงตาม trade_date) คืน (DataFrame แบบ compute_for_symbol, state ใหม่)"""
+    d = df_sym.sort_values("trade_date").reset_index(drop=True)
+    closes = pd.to_numeric(d["close"], errors="coerce").astype(float).to_numpy()
+    vols   = pd.to_numeric(d["volume"], errors="coerce").astype(float).to_numpy()
+    n = len(d)
+
+    ema_out  = {k: np.full(n, np.nan) for k in state["ema"]}
+    gain_out = {k: np.full(n, np.nan) for k in state["rsi"]}
+    loss_out = {k: np.full(n, np.nan) for k in state["rsi"]}
+    sig_out  = {k: np.full(n, np.nan) for k in MACD_SETS}
+    vol_out  = np.full(n, np.nan)
+    vema_out = {k: np.full(n, np.nan) for k in state["vol_ema"]}
+
+    prev_close = np.nan if state["close"] is None else state["close"]
+    window = [np.nan if v is None else v for v in state["vol"]]
+    for i in range(n):
+        c = closes[i]
+        for k, st in state["ema"].items():
+            ema_out[k][i] = ewm_step(st, c, v4.span_alpha(int(k)), int(k))
+
+        delta = c - prev_close
+        gain = np.nan if np.isnan(delta) else max(delta, 0.0)
+        loss = np.nan if np.isnan(delta) else max(-delta, 0.0)
+        for k, st in state["rsi"].items():
+            p = int(k)
+            gain_out[k][i] = ewm_step(st["gain"], gain, v4.period_alpha(p), p)
+            loss_out[k][i] = ewm_step(st["loss"], loss, v4.period_alpha(p), p)
+        prev_close = c
+
+        for k, (fast, slow, signal) in MACD_SETS.items():
+            m = ema_out[str(fast)][i] - ema_out[str(slow)][i]
+            sig_out[k][i] = ewm_step(state["macd_signal"][k], m, v4.span_alpha(signal), signal)
+
+        for k, st in state["vol_ema"].items():
+            vema_out[k][i] = ewm_step(st, vols[i], v4.span_alpha(int(k)), int(k))
+        window = (window + [vols[i]])[-VOL_WINDOW:]
+        if len(window) == VOL_WINDOW and not np.isnan(window).any():
+            vol_out[i] = sum(window) / VOL_WINDOW
+
+    out = d[["symbol", "trade_date", "close"]].copy()
+    for s in EMA_SPANS:
+        out[f"ema{s}"] = ema_out[str(s)]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for p in RSI_PERIODS:
+            rs = gain_out[str(p)] / loss_out[str(p)]
+            out[f"rsi{p}"] = 100 - (100 / (1 + rs))
+    for k, (fast, slow, _) in MACD_SETS.items():
+        macd = ema_out[str(fast)] - ema_out[str(slow)]
+        out[k], out[f"{k}_signal"], out[f"{k}_hist"] = macd, sig_out[k], macd - sig_out[k]
+    out["volume_avg20"] = vol_out
+    for s in VOL_EMA_SPANS:
+        out[f"vol_ema{s}"] = vema_out[str(s)]
+    out["trend_status"] = v4.classify_trend_vec(out["close"], out["ema20"], out["ema50"], out["ema200"], out["rsi14"])
+
+    state["close"] = None if np.isnan(prev_close) else float(prev_close)
+    state["vol"] = [None if np.isnan(v) else float(v) for v in window]
+    if n:
+        state["first_trade_date"] = state["first_trade_date"] or str(d["trade_date"].iloc[0])
+        state["last_trade_date"] = str(d["trade_date"].iloc[-1])
+        state["n_bars"] += n
+    return out.drop(columns="close"), state
+
+# -------- main --------
+def main(keep_since=None):
+    """ถ้าระบุ keep_since จะคืน DataFrame indicator ที่คำนวณรอบนี้ตั้งแต่วันนั้น (สำหรับ pipeline ไป compute_signals)"""
+    v4.ensure_table()
+    ensure_state_table()
+    symbols = v4.get_active_symbols()
+    if not symbols:
+        print("❌ No symbols.")
+        return
+
+    states = load_states(symbols)
+    stale = backfilled_symbols(states)
+    if stale:
+        print(f"♻️ Reseeding {len(stale):,} symbols with backfilled bars (e.g. {', '.join(sorted(stale)[:5])})")
+        states = {s: st for s, st in states.items() if s not in stale}
+    to_write, touched = [], {}
+
+    # 1) seed symbol ที่ยังไม่มี state ด้วยช่วงเต็ม (ครั้งแรกครั้งเดียว)
+    seed_syms = [s for s in symbols if s not in states]
+    if seed_syms:
+        start_date = v4.resolve_start_date()
+        print(f"🌱 Seeding state for {len(seed_syms):,} symbols from {start_date}")
+        price = v4.fetch_prices(seed_syms, start_date)
+        for sym, df_sym in tqdm(price.groupby("symbol"), total=price["symbol"].nunique(), desc="Seed state"):
+            if df_sym["close"].notna().sum() < MIN_CLOSES:
+                continue
+            calc, touched[sym] = advance(new_state(), df_sym)
+            to_write.append(calc)
+
+    # 2) เดิน state ต่อเฉพาะแท่งใหม่
+    if states:
+        price = fetch_new_bars(list(states))
+        for sym, df_sym in price.groupby("symbol"):
+            calc, touched[sym] = advance(states[sym], df_sym)
+            to_write.append(calc)
+
+    calc = pd.concat(to_write, ignore_index=True) if to_write else pd.DataFrame(columns=v4.OUT_COLS)
+    if to_write:
+        print(f"🧾 Upserting {len(calc):,} rows for {len(touched):,} symbols ...")
+        v4.write_rows(calc)
+    else:
+        print("No new bars.")
+    # เขียน state หลัง indicator สำเร็จเท่านั้น (ถ้าพังกลางทาง รอบหน้าจะเดินซ้ำจาก state เดิม)
+    save_states(touched)
+
+    print("✅ Done v4 incremental")
+    if keep_since is not None:
+        return calc[calc["trade_date"] >= keep_since].reset_index(drop=True)
+
+if __name__ == "__main__":
+    main()
@@ -12,19 +12,13 @@ from datetime import date, datetime, timedelta
 import numpy as np
 import pandas as pd
 from tqdm import tqdm
-import psycopg2
+import db
 from psycopg2.extras import execute_values
 from dotenv import load_dotenv
 
-load_dotenv()
+from trend_status import classify_trend_vec
 
-PG_CONN_STR = (
-    f"host={os.getenv('posql_host','localhost')} "
-    f"port={os.getenv('posql_port','5432')} "
-    f"dbname={os.getenv('posql_db','stocks')} "
-    f"user={os.getenv('posql_user','postgres')} "
-    f"password={os.getenv('posql_password','postgres')}"
-)
+load_dotenv()
 
 # ------- พารามิเตอร์หลัก -------
 START_DATE_STR = os.getenv("START_DATE")        # เช่น '2020-01-01'; ถ้าไม่ตั้ง จะใช้ LOOKBACK_DAYS
@@ -69,16 +63,13 @@ ON CONFLICT (symbol, trade_date) DO UPDATE SET
   updated_at   = now();
 """
 
-def pg_conn():
-    return psycopg2.connect(PG_CONN_STR)
-
 def ensure_table():
-    with pg_conn() as conn, conn.cursor() as cur:
+    with db.connect() as conn, conn.cursor() as cur:
         cur.execute(DDL)
         conn.commit()
 
 def get_active_symbols():
-    with pg_conn() as conn, conn.cursor() as cur:
+    with db.connect() as conn, conn.cursor() as cur:
         cur.execute("SELECT DISTINCT symbol FROM settrade_stocklist WHERE symbol IS NOT NULL;")
         return [r[0] for r in cur.fetchall()]
 
@@ -88,25 +79,23 @@ def resolve_start_date():
     return date.today() - timedelta(days=LOOKBACK_DAYS)
 
 def fetch_prices(symbols, start_date):
-    with pg_conn() as conn:
-        q = """
+    q = """
         SELECT symbol, date AS trade_date, open, high, low, close, volume
         FROM stock_price_history
         WHERE date >= %s AND symbol = ANY(%s)
         ORDER BY symbol, trade_date;
-        """
-        return pd.read_sql(q, conn, params=(start_date, symbols))
+    """
+    return db.read_frame(q, (start_date, symbols))  # server-side cursor (ประวัติหลายปี)
 
 def fetch_existing_indicators(symbols, start_date):
     """ดึง indicator ที่มีอยู่แล้วในช่วงเดียวกัน เพื่อใช้เทียบค่า (ลดการเขียน)"""
-    with pg_conn() as conn:
-        q = """
+    q = """
         SELECT symbol, trade_date, ema20, ema50, ema200, rsi14, macd, macd_signal, macd_hist, volume_avg20, trend_status
         FROM stock_indicator_daily
         WHERE trade_date >= %s AND symbol = ANY(%s)
         ORDER BY symbol, trade_date;
-        """
-        return pd.read_sql(q, conn, params=(start_date, symbols))
+    """
+    return db.read_frame(q, (start_date, symbols))  # server-side cursor (ประวัติหลายปี)
 
 # -------- indicator functions (no TA-Lib) --------
 def ema(series, span): 
@@ -126,14 +115,6 @@ def rsi(series, period=14):
     rs = avg_gain / avg_loss
     return 100 - (100 / (1 + rs))
 
-def classify_trend(c, e20, e50, e200, r):
-    if pd.notna(c) and pd.notna(e200) and pd.notna(e20) and pd.notna(e50):
-        if c > e200 and e20 > e50: return "uptrend"
-        if c < e200 and e20 < e50: return "downtrend"
-        if pd.notna(r) and e50 not in (None, 0) and abs(c - e50)/abs(e50) <= 0.02 and 40 <= r <= 60:
-            return "sideway"
-    return None
-
 def compute_for_symbol(df_sym):
     d = df_sym.copy()
     d["ema20"]  = ema(d["close"], 20)
@@ -143,7 +124,7 @@ def compute_for_symbol(df_sym):
     macd, sig, hist = macd_components(d["close"])
     d["macd"], d["macd_signal"], d["macd_hist"] = macd, sig, hist
     d["volume_avg20"] = d["volume"].rolling(20, min_periods=20).mean()
-    d["trend_status"] = d.apply(lambda r: classify_trend(r["close"], r["ema20"], r["ema50"], r["ema200"], r["rsi14"]), axis=1)
+    d["trend_status"] = classify_trend_vec(d["close"], d["ema20"], d["ema50"], d["ema200"], d["rsi14"])
 
     return d[["symbol","trade_date","ema20","ema50","ema200","rsi14","macd","macd_signal","macd_hist","volume_avg20","trend_status"]]
 
@@ -177,7 +158,7 @@ def need_update(row_new, row_old):
 def upsert_rows(rows):
     if not rows: 
         return
-    with pg_conn() as conn, conn.cursor() as cur:
+    with db.connect() as conn, conn.cursor() as cur:
         batch = []
         for r in rows:
             batch.append(r)
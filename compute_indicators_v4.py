@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 """
-v3: คำนวณเต็มช่วงย้อนหลังที่กำหนด แล้ว "เขียนเฉพาะที่เปลี่ยนจริง"
+v4: คำนวณเต็มช่วงย้อนหลังที่กำหนด แล้ว "เขียนเฉพาะที่เปลี่ยนจริง"
 - START_DATE (YYYY-MM-DD) หรือ LOOKBACK_DAYS (เช่น 1300)
 - เปรียบเทียบกับค่าที่มีใน stock_indicator_daily_v4 ด้วย epsilon เพื่อลด write I/O
 """
@@ -11,25 +11,22 @@ from datetime import date, datetime, timedelta
 import numpy as np
 import pandas as pd
 from tqdm import tqdm
-import psycopg2
+import db
 from psycopg2.extras import execute_values
 from dotenv import load_dotenv
 
-load_dotenv()
+from trend_status import classify_trend_vec
 
-PG_CONN_STR = (
-    f"host={os.getenv('posql_host','localhost')} "
-    f"port={os.getenv('posql_port','5432')} "
-    f"dbname={os.getenv('posql_db','stocks')} "
-    f"user={os.getenv('posql_user','postgres')} "
-    f"password={os.getenv('posql_password','postgres')}"
-)
+load_dotenv()
 
 # ------- พารามิเตอร์หลัก -------
 START_DATE_STR = os.getenv("START_DATE")        # เช่น '2020-01-01'; ถ้าไม่ตั้ง จะใช้ LOOKBACK_DAYS
 LOOKBACK_DAYS  = int(os.getenv("LOOKBACK_DAYS", "1300"))
 BATCH_SIZE     = int(os.getenv("IND_BATCH_SIZE", "3000"))
 EPS            = float(os.getenv("IND_EPS", "1e-6"))  # tolerance สำหรับ float comparison
+SYMBOL_CHUNK   = int(os.getenv("IND_SYMBOL_CHUNK", "200"))  # จำนวน symbol ต่อก้อนของ batched kernel
+IND_WRITER     = os.getenv("IND_WRITER", "copy")  # copy = COPY เข้า staging แล้ว merge, values = execute_values แบบเดิม
+IND_MODE       = os.getenv("IND_MODE", "full")    # full = คำนวณเต็มช่วง, incremental = เดิน state ต่อเฉพาะแท่งใหม่ (compute_indicators_incremental)
 
 # ------- SQL -------
 DDL = """
@@ -65,7 +62,8 @@ CREATE INDEX IF NOT EXISTS ix_stock_indicator_daily_v4_symdate ON stock_indicato
 UPSERT_SQL = """
 INSERT INTO stock_indicator_daily_v4
 (symbol, trade_date, ema20, ema50, ema200, rsi14, macd, macd_signal, macd_hist, volume_avg20, trend_status,
- ema5, ema10, ema12, ema26, rsi21, macd_19_39_9, macd_19_39_9_signal, macd_19_39_9_hist)
+ ema5, ema10, ema12, ema26, rsi21, macd_19_39_9, macd_19_39_9_signal, macd_19_39_9_hist,
+ vol_ema10, vol_ema20, vol_ema50)
 VALUES %s
 ON CONFLICT (symbol, trade_date) DO UPDATE SET
   ema20 = EXCLUDED.ema20,
@@ -85,20 +83,25 @@ ON CONFLICT (symbol, trade_date) DO UPDATE SET
   macd_19_39_9 = EXCLUDED.macd_19_39_9,
   macd_19_39_9_signal = EXCLUDED.macd_19_39_9_signal,
   macd_19_39_9_hist = EXCLUDED.macd_19_39_9_hist,
+  vol_ema10 = EXCLUDED.vol_ema10,
+  vol_ema20 = EXCLUDED.vol_ema20,
+  vol_ema50 = EXCLUDED.vol_ema50,
   updated_at = now();   
     
 """
 
-def pg_conn():
-    return psycopg2.connect(PG_CONN_STR)
+# ลำดับคอลัมน์เดียวกับ UPSERT_SQL (ใช้ทั้ง tuple และ COPY)
+WRITE_COLS = ["symbol","trade_date","ema20","ema50","ema200","rsi14","macd","macd_signal","macd_hist","volume_avg20","trend_status",
+              "ema5","ema10","ema12","ema26","rsi21","macd_19_39_9","macd_19_39_9_signal","macd_19_39_9_hist",
+              "vol_ema10","vol_ema20","vol_ema50"]
 
 def ensure_table():
-    with pg_conn() as conn, conn.cursor() as cur:
+    with db.connect() as conn, conn.cursor() as cur:
         cur.execute(DDL)
         conn.commit()
 
 def get_active_symbols():
-    with pg_conn() as conn, conn.cursor() as cur:
+    with db.connect() as conn, conn.cursor() as cur:
         cur.execute("SELECT DISTINCT symbol FROM settrade_stocklist WHERE symbol IS NOT NULL;")
         return [r[0] for r in cur.fetchall()]
 
@@ -108,28 +111,41 @@ def resolve_start_date():
     return date.today() - timedelta(days=LOOKBACK_DAYS)
 
 def fetch_prices(symbols, start_date):
-    with pg_conn() as conn:
-        q = """
+    q = """
         SELECT symbol, date AS trade_date, open, high, low, close, volume
         FROM stock_price_history
         WHERE date >= %s AND symbol = ANY(%s)
         ORDER BY symbol, trade_date;
-        """
-        return pd.read_sql(q, conn, params=(start_date, symbols))
+    """
+    return db.read_frame(q, (start_date, symbols))  # server-side cursor (ประวัติหลายปี)
 
 def fetch_existing_indicators(symbols, start_date):
     """ดึง indicator ที่มีอยู่แล้วในช่วงเดียวกัน เพื่อใช้เทียบค่า (ลดการเขียน)"""
-    with pg_conn() as conn:
-        q = """
+    q = """
         SELECT symbol, trade_date, ema20, ema50, ema200, rsi14, macd, macd_signal, macd_hist, volume_avg20, trend_status,
-               ema5, ema10, ema12, ema26, rsi21, macd_19_39_9, macd_19_39_9_signal, macd_19_39_9_hist
+               ema5, ema10, ema12, ema26, rsi21, macd_19_39_9, macd_19_39_9_signal, macd_19_39_9_hist,
+               vol_ema10, vol_ema20, vol_ema50
         FROM stock_indicator_daily_v4
         WHERE trade_date >= %s AND symbol = ANY(%s)
         ORDER BY symbol, trade_date;
-        """
-        return pd.read_sql(q, conn, params=(start_date, symbols))
+    """
+    return db.read_frame(q, (start_date, symbols))  # server-side cursor (ประวัติหลายปี)
 
 # -------- indicator functions (no TA-Lib) --------
+EMA_SPANS   = (5, 10, 12, 20, 26, 50, 200)
+RSI_PERIODS = (14, 21)
+MACD_SETS   = {"macd": (12, 26, 9), "macd_19_39_9": (19, 39, 9)}  # prefix -> (fast, slow, signal)
+VOL_EMA_SPANS = (10, 20, 50)  # EMA ของ volume → vol_ema10/20/50
+OUT_COLS    = ["symbol","trade_date","ema20","ema50","ema200","rsi14","macd","macd_signal","macd_hist","volume_avg20","trend_status","macd_19_39_9","macd_19_39_9_signal","macd_19_39_9_hist","ema5","ema10","ema12","ema26","rsi21","vol_ema10","vol_ema20","vol_ema50"]
+
+# alpha แบบเดียวกับที่ pandas ewm แปลงจาก span/alpha ภายใน (ผ่าน center of mass) เพื่อให้ผลตรงกันทุกบิต
+def span_alpha(span):
+    return 1.0 / (1.0 + (span - 1) / 2)
+
+def period_alpha(period):
+    a = 1 / period
+    return 1.0 / (1.0 + (1 - a) / a)
+
 def ema(series, span): 
     return series.ewm(span=span, adjust=False, min_periods=span).mean()
 
@@ -147,16 +163,6 @@ def rsi(series, period=14):
     rs = avg_gain / avg_loss
     return 100 - (100 / (1 + rs))
 
-# classify คือ uptrend / downtrend / sideway / None
-def classify_trend(c, e20, e50, e200, r):
-    # c = close price, eXX = EMA XX, r = RSI14
-    if pd.notna(c) and pd.notna(e200) and pd.notna(e20) and pd.notna(e50):
-        if c > e200 and e20 > e50: return "uptrend"
-        if c < e200 and e20 < e50: return "downtrend"
-        if pd.notna(r) and e50 not in (None, 0) and abs(c - e50)/abs(e50) <= 0.02 and 40 <= r <= 60:
-            return "sideway"
-    return None
-
 def compute_for_symbol(df_sym):
     d = df_sym.copy()
     d["ema20"]  = ema(d["close"], 20)
@@ -175,44 +181,131 @@ def compute_for_symbol(df_sym):
     d["rsi21"]  = rsi(d["close"], 21)
     macd_19_39_9, sig_19_39_9, hist_19_39_9 = macd_components(d["close"], fast=19, slow=39, signal=9)
     d["macd_19_39_9"], d["macd_19_39_9_signal"], d["macd_19_39_9_hist"] = macd_19_39_9, sig_19_39_9, hist_19_39_9
+    for s in VOL_EMA_SPANS:
+        d[f"vol_ema{s}"] = ema(pd.to_numeric(d["volume"], errors="coerce").astype(float), s)
 
     # classify trend  
-    d["trend_status"] = d.apply(lambda r: classify_trend(r["close"], r["ema20"], r["ema50"], r["ema200"], r["rsi14"]), axis=1)
-
-    return d[["symbol","trade_date","ema20","ema50","ema200","rsi14","macd","macd_signal","macd_hist","volume_avg20","trend_status","macd_19_39_9","macd_19_39_9_signal","macd_19_39_9_hist","ema5","ema10","ema12","ema26","rsi21"]]
+    d["trend_status"] = classify_trend_vec(d["close"], d["ema20"], d["ema50"], d["ema200"], d["rsi14"])
+
+    return d[OUT_COLS]
+
+# -------- batched kernel: ทุก symbol พร้อมกันบนเมทริกซ์ dates × symbols --------
+def ewm_2d(x, alpha, min_periods, present):
+    """ewm(adjust=False, min_periods) แบบ pandas เดินทีละวันพร้อมกันทุก symbol (คอลัมน์)
+    - present=False คือไม่มีแถวราคาในวันนั้น (ก่อน IPO / หยุดพัก) → ข้ามไปโดยไม่ decay เหมือนคำนวณทีละ symbol
+    - แถวที่มีแต่ค่าเป็น NaN ยัง decay ตาม ignore_na=False
+    """
+    T, N = x.shape
+    out = np.full((T, N), np.nan)
+    w = np.full(N, np.nan)
+    old_wt = np.ones(N)
+    nobs = np.zeros(N, dtype=np.int64)
+    for t in range(T):
+        xt, pt = x[t], present[t]
+        obs = pt & ~np.isnan(xt)
+        nobs += obs
+        has_w = ~np.isnan(w)
+        old_wt = np.where(pt & has_w, old_wt * (1.0 - alpha), old_wt)
+        upd = pt & has_w & obs
+        with np.errstate(invalid="ignore"):
+            blended = (old_wt * w + alpha * xt) / (old_wt + alpha)
+            w = np.where(upd & (w != xt), blended, w)
+        w = np.where(~has_w & obs, xt, w)
+        old_wt = np.where(upd, 1.0, old_wt)
+        out[t] = np.where(nobs >= min_periods, w, np.nan)
+    return out
+
+def compute_batch(price):
+    """คำนวณ indicator ของทุก symbol ใน price พร้อมกัน (ผลเท่ากับ compute_for_symbol ทีละกลุ่ม)"""
+    d = price.sort_values(["symbol","trade_date"]).reset_index(drop=True)
+    close  = pd.to_numeric(d["close"], errors="coerce").astype(float)
+    volume = pd.to_numeric(d["volume"], errors="coerce").astype(float)
+
+    # pivot เป็น dates × symbols ด้วย index ตำแหน่ง แล้วดึงกลับเป็นแถวด้วย index เดิม
+    di, dates = pd.factorize(d["trade_date"], sort=True)
+    si, syms  = pd.factorize(d["symbol"], sort=True)
+    shape = (len(dates), len(syms))
+    present = np.zeros(shape, dtype=bool)
+    present[di, si] = True
+    def to_mat(v):
+        m = np.full(shape, np.nan)
+        m[di, si] = v
+        return m
+
+    C = to_mat(close.to_numpy())
+    spans = set(EMA_SPANS)
+    for fast, slow, _ in MACD_SETS.values():
+        spans.update((fast, slow))
+    emas = {s: ewm_2d(C, span_alpha(s), s, present) for s in spans}
+
+    # diff ต้องเทียบกับแถวก่อนหน้าของ symbol เดียวกัน จึงทำในรูปแบบแถวก่อน pivot
+    delta = close.groupby(d["symbol"]).diff()
+    G = to_mat(delta.clip(lower=0).to_numpy())
+    L = to_mat((-delta).clip(lower=0).to_numpy())
+
+    out = d[["symbol","trade_date"]].copy()
+    out["close"] = close
+    for s in EMA_SPANS:
+        out[f"ema{s}"] = emas[s][di, si]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for p in RSI_PERIODS:
+            rs = ewm_2d(G, period_alpha(p), p, present) / ewm_2d(L, period_alpha(p), p, present)
+            out[f"rsi{p}"] = (100 - (100 / (1 + rs)))[di, si]
+    for k, (fast, slow, signal) in MACD_SETS.items():
+        macd = emas[fast] - emas[slow]
+        sig = ewm_2d(macd, span_alpha(signal), signal, present)
+        out[k], out[f"{k}_signal"], out[f"{k}_hist"] = macd[di, si], sig[di, si], (macd - sig)[di, si]
+    out["volume_avg20"] = volume.groupby(d["symbol"]).rolling(20, min_periods=20).mean().reset_index(level=0, drop=True)
+    V = to_mat(volume.to_numpy())
+    for s in VOL_EMA_SPANS:
+        out[f"vol_ema{s}"] = ewm_2d(V, span_alpha(s), s, present)[di, si]
+
+    out["trend_status"] = classify_trend_vec(out["close"], out["ema20"], out["ema50"], out["ema200"], out["rsi14"])
+    return out[OUT_COLS]
 
 # -------- compare & selective write --------
 # คอลัมน์ที่จะเปรียบเทียบ (ถ้าเปลี่ยนจึงเขียน)
-FLOAT_COLS = ["ema20","ema50","ema200","rsi14","macd","macd_signal","macd_hist","volume_avg20","macd_19_39_9","macd_19_39_9_signal","macd_19_39_9_hist","ema5","ema10","ema12","ema26","rsi21"] # คอลัมน์ที่เป็น float
+FLOAT_COLS = ["ema20","ema50","ema200","rsi14","macd","macd_signal","macd_hist","volume_avg20","macd_19_39_9","macd_19_39_9_signal","macd_19_39_9_hist","ema5","ema10","ema12","ema26","rsi21","vol_ema10","vol_ema20","vol_ema50"] # คอลัมน์ที่เป็น float
+NUM2_COLS  = {"volume_avg20","vol_ema10","vol_ema20","vol_ema50"}  # เก็บเป็น NUMERIC(18,2) ใน DB → เทียบด้วย tolerance ครึ่งสตางค์
 STR_COLS   = ["trend_status"] # คอลัมน์ที่เป็น string
 
-def is_diff(a, b, eps=EPS):
-    # เทียบ float: True ถ้าแตกต่างเกิน eps; เทียบ None/NaN ให้เท่ากัน
-    if pd.isna(a) and pd.isna(b): return False
-    if (a is None and b is None): return False
-    if (a is None) ^ (b is None): return True
-    try:
-        return abs(float(a) - float(b)) > eps
-    except Exception:
-        return str(a) != str(b)
-
-def need_update(row_new, row_old):
-    """True ถ้าควรเขียน (ไม่เคยมี หรือค่าเปลี่ยน)"""
-    if row_old is None:
-        return True
-    # เปรียบเทียบทุกคอลัมน์อินดิเคเตอร์
-    for col in FLOAT_COLS:
-        if is_diff(row_new.get(col), row_old.get(col)):
-            return True
+def changed_rows(calc, existing, eps=EPS):
+    """คืนเฉพาะแถวของ calc ที่ยังไม่เคยมี หรือค่าต่างจาก existing เกิน eps
+    - align ด้วย (symbol, trade_date) แล้วเทียบ FLOAT_COLS ทั้งเฟรมด้วย np.isclose ครั้งเดียว
+    - NaN/NULL ทั้งคู่ถือว่าเท่ากัน, ฝั่งเดียวเป็น NaN ถือว่าเปลี่ยน
+    """
+    if existing is None or existing.empty:
+        return calc
+    old = existing[["symbol","trade_date"] + FLOAT_COLS + STR_COLS]
+    m = calc.merge(old, on=["symbol","trade_date"], how="left", suffixes=("", "_old"), indicator=True)
+
+    new_vals = m[FLOAT_COLS].apply(pd.to_numeric, errors="coerce").to_numpy(dtype=float)
+    old_vals = m[[f"{c}_old" for c in FLOAT_COLS]].apply(pd.to_numeric, errors="coerce").to_numpy(dtype=float)
+    atol = np.array([0.005 + eps if c in NUM2_COLS else eps for c in FLOAT_COLS])
+    diff = ~np.isclose(new_vals, old_vals, rtol=0.0, atol=atol, equal_nan=True).all(axis=1)
     for col in STR_COLS:
-        if (row_new.get(col) or None) != (row_old.get(col) or None):
-            return True
-    return False
+        diff |= m[col].fillna("").to_numpy() != m[f"{col}_old"].fillna("").to_numpy()
+    diff |= (m["_merge"] == "left_only").to_numpy()
+    return m.loc[diff, calc.columns]
+
+def to_upsert_row(rec):
+    """แปลง record (itertuples ของผล compute_for_symbol) เป็น tuple ตามลำดับคอลัมน์ใน UPSERT_SQL"""
+    f = lambda v: None if pd.isna(v) else float(v)
+    return (
+        rec.symbol, rec.trade_date,
+        f(rec.ema20), f(rec.ema50), f(rec.ema200), f(rec.rsi14),
+        f(rec.macd), f(rec.macd_signal), f(rec.macd_hist), f(rec.volume_avg20),
+        rec.trend_status,
+        # new add 2025-10-21
+        f(rec.ema5), f(rec.ema10), f(rec.ema12), f(rec.ema26), f(rec.rsi21),
+        f(rec.macd_19_39_9), f(rec.macd_19_39_9_signal), f(rec.macd_19_39_9_hist),
+        f(rec.vol_ema10), f(rec.vol_ema20), f(rec.vol_ema50),
+    )
 
 def upsert_rows(rows):
     if not rows: 
         return
-    with pg_conn() as conn, conn.cursor() as cur:
+    with db.connect() as conn, conn.cursor() as cur:
         batch = []
         for r in rows:
             batch.append(r)
@@ -224,7 +317,27 @@ def upsert_rows(rows):
             execute_values(cur, UPSERT_SQL, batch, page_size=BATCH_SIZE)
             conn.commit()
 
-def main():
+def copy_upsert(df):
+    """เขียน DataFrame ด้วย COPY เข้า temp staging แล้ว merge ครั้งเดียว (db.copy_upsert)"""
+    if df.empty:
+        return
+    with db.connect() as conn:
+        db.copy_upsert(conn, df, "stock_indicator_daily_v4", WRITE_COLS)
+
+def write_rows(df):
+    """เขียนผล indicator (คอลัมน์ตาม compute_for_symbol) ด้วย writer ที่เลือกใน IND_WRITER"""
+    if IND_WRITER == "values":
+        upsert_rows([to_upsert_row(rec) for rec in df.itertuples(index=False)])
+    else:
+        copy_upsert(df)
+
+def main(keep_since=None):
+    """คำนวณ + เขียน indicator; ถ้าระบุ keep_since จะคืน DataFrame ผลคำนวณตั้งแต่วันนั้น (ทุกแถว ไม่ใช่แค่แถวที่เปลี่ยน)
+    ให้ taskUpdate ส่งต่อเข้า compute_signals ในหน่วยความจำได้เลย ไม่ต้องอ่านกลับจาก DB"""
+    if IND_MODE == "incremental":
+        import compute_indicators_incremental as inc
+        return inc.main(keep_since)
+
     ensure_table()
     symbols = get_active_symbols()
     if not symbols:
@@ -243,78 +356,32 @@ def main():
 
     # 2) โหลด indicators เดิมในช่วงเดียวกัน (ไว้เทียบ)
     existing = fetch_existing_indicators(symbols, start_date)
-    # ทำเป็น dict เร็ว ๆ: key = (symbol, date) → dict ของค่าเดิม
-    old_map = {}
-    if not existing.empty:
-        for rec in existing.itertuples(index=False):
-            #
-            old_map[(rec.symbol, rec.trade_date)] = {
-                "ema20": rec.ema20, "ema50": rec.ema50, "ema200": rec.ema200,
-                "rsi14": rec.rsi14, "macd": rec.macd, "macd_signal": rec.macd_signal,
-                "macd_hist": rec.macd_hist, "volume_avg20": rec.volume_avg20,
-                "trend_status": rec.trend_status,
-                # new add 2025-10-21
-                "ema5": rec.ema5, "ema10": rec.ema10, "ema12": rec.ema12, "ema26": rec.ema26,
-                "rsi21": rec.rsi21,
-                "macd_19_39_9": rec.macd_19_39_9, "macd_19_39_9_signal": rec.macd_19_39_9_signal,"macd_19_39_9_hist": rec.macd_19_39_9_hist
-            }
-
-    # 3) คำนวณทั้งหมดในช่วงที่กำหนด
-    to_write = []
-    for sym, df_sym in tqdm(price.groupby("symbol"), total=price["symbol"].nunique(), desc="Compute v3"):
-        if df_sym["close"].notna().sum() < 30:
-            continue
-        calc = compute_for_symbol(df_sym)
-
-        for rec in calc.itertuples(index=False):
-            new_row = {
-                "ema20": rec.ema20, "ema50": rec.ema50, "ema200": rec.ema200,
-                "rsi14": rec.rsi14, "macd": rec.macd, "macd_signal": rec.macd_signal,
-                "macd_hist": rec.macd_hist, "volume_avg20": rec.volume_avg20,
-                "trend_status": rec.trend_status
-                # new add 2025-10-21
-                ,"ema5": rec.ema5, "ema10": rec.ema10, "ema12": rec.ema12, "ema26": rec.ema26,
-                "rsi21": rec.rsi21,
-                "macd_19_39_9": rec.macd_19_39_9, "macd_19_39_9_signal": rec.macd_19_39_9_signal, "macd_19_39_9_hist": rec.macd_19_39_9_hist
-            }
-            old_row = old_map.get((rec.symbol, rec.trade_date))
-            if need_update(new_row, old_row):
-                to_write.append((
-                    rec.symbol, rec.trade_date,
-                    None if pd.isna(rec.ema20) else float(rec.ema20),
-                    None if pd.isna(rec.ema50) else float(rec.ema50),
-                    None if pd.isna(rec.ema200) else float(rec.ema200),
-                    None if pd.isna(rec.rsi14) else float(rec.rsi14),
-                    None if pd.isna(rec.macd) else float(rec.macd),
-                    None if pd.isna(rec.macd_signal) else float(rec.macd_signal),
-                    None if pd.isna(rec.macd_hist) else float(rec.macd_hist),
-                    None if pd.isna(rec.volume_avg20) else float(rec.volume_avg20),
-                    rec.trend_status,
-                    # new add 2025-10-21
-                    None if pd.isna(rec.ema5) else float(rec.ema5),
-                    None if pd.isna(rec.ema10) else float(rec.ema10),
-                    None if pd.isna(rec.ema12) else float(rec.ema12),
-                    None if pd.isna(rec.ema26) else float(rec.ema26),
-                    None if pd.isna(rec.rsi21) else float(rec.rsi21),
-                    None if pd.isna(rec.macd_19_39_9) else float(rec.macd_19_39_9),
-                    None if pd.isna(rec.macd_19_39_9_signal) else float(rec.macd_19_39_9_signal),
-                    None if pd.isna(rec.macd_19_39_9_hist) else float(rec.macd_19_39_9_hist),
-                ))
-
-        # flush เป็นช่วง ๆ เพื่อลด RAM
-        if len(to_write) >= 120_000:
-            print(f"🧾 Upserting chunk: {len(to_write):,} rows ...")
-            upsert_rows(to_write)
-            to_write.clear()
-
-    # 4) เขียนส่วนคงค้าง
-    if to_write:
-        print(f"🧾 Upserting final: {len(to_write):,} rows ...")
-        upsert_rows(to_write)
-    else:
+
+    def write_changed(calc):
+        old = existing[existing["symbol"].isin(calc["symbol"].unique())]
+        changed = changed_rows(calc, old)
+        if not changed.empty:
+            print(f"🧾 Upserting {len(changed):,} / {len(calc):,} rows ...")
+            write_rows(changed)
+        return len(changed)
+
+    # 3) คำนวณด้วย batched kernel เป็นก้อนละ SYMBOL_CHUNK symbol แล้ว diff/เขียนทีละก้อนเพื่อลด RAM
+    n_close = price.groupby("symbol")["close"].count()
+    keep = n_close[n_close >= 30].index.tolist()
+    written, kept = 0, []
+    for i in tqdm(range(0, len(keep), SYMBOL_CHUNK), desc="Compute v4"):
+        chunk = keep[i:i + SYMBOL_CHUNK]
+        calc = compute_batch(price[price["symbol"].isin(chunk)])
+        written += write_changed(calc)
+        if keep_since is not None:
+            kept.append(calc[calc["trade_date"] >= keep_since])
+
+    if not written:
         print("No changed rows to write.")
 
-    print("✅ Done v3")
+    print("✅ Done v4")
+    if keep_since is not None:
+        return pd.concat(kept, ignore_index=True) if kept else pd.DataFrame(columns=OUT_COLS)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+สภาพคล่อง / คัดหุ้น "ตาย" (ราคาขยับไม่กี่ tick หลายวัน, มูลค่าซื้อขายต่ำ, วันที่ไม่มีการซื้อขาย)
+- คำนวณทุก symbol พร้อมกันบนเมทริกซ์ dates × symbols (rolling ของ pandas ทั้งเมทริกซ์ ไม่วนทีละ symbol)
+- range_ticks   = (high สูงสุด - low ต่ำสุด ใน LIQ_RANGE_DAYS วัน) / ช่วงราคา (tick) ตามตาราง SET ของราคาปิดวันนั้น
+- turnover      = close * volume, turnover_avg20 = เฉลี่ย 20 วัน
+- zero_volume_days = จำนวนวันที่ volume = 0 ใน LIQ_ZERO_DAYS วัน
+- tradable      = range_ticks >= LIQ_MIN_RANGE_TICKS และ turnover_avg20 >= LIQ_MIN_TURNOVER (ยังไม่ครบ 20 วัน = ผ่าน) และ zero_volume_days <= LIQ_MAX_ZERO_DAYS
+- volume EMA (vol_ema10/20/50) คำนวณใน compute_indicators_v4 (batched kernel เดียวกับ EMA ราคา)
+- เก็บใน stock_liquidity_daily (symbol, trade_date) เขียนเฉพาะวันที่ใหม่ต่อ symbol
+  symbol ที่มีราคาถูกเติม/ลบย้อนหลัง (จำนวนแท่งไม่ตรงกับจำนวนแถวเดิม) ถูกลบแล้ว backfill ใหม่
+- compute_signals ใช้ tradable_symbols() ตัดหุ้นไม่มีสภาพคล่องออกก่อนประเมินกฎ
+- เขียนเสร็จแล้ว refresh latest_snapshot ของ symbol ที่มีแถวใหม่
+"""
+
+import os
+from datetime import date, timedelta
+import numpy as np
+import pandas as pd
+
+import db
+import compute_indicators_v4 as v4
+import compute_indicators_incremental as inc
+import screener
+
+LIQ_RANGE_DAYS      = int(os.getenv("LIQ_RANGE_DAYS", "10"))
+LIQ_ZERO_DAYS       = int(os.getenv("LIQ_ZERO_DAYS", "20"))
+LIQ_MIN_RANGE_TICKS = float(os.getenv("LIQ_MIN_RANGE_TICKS", "5"))
+LIQ_MIN_TURNOVER    = float(os.getenv("LIQ_MIN_TURNOVER", "1000000"))   # บาท/วัน
+LIQ_MAX_ZERO_DAYS   = int(os.getenv("LIQ_MAX_ZERO_DAYS", "2"))
+LIQ_HISTORY_DAYS    = int(os.getenv("LIQ_HISTORY_DAYS", "90"))          # ช่วงราคาที่โหลดในรอบ incremental (ต้องครอบคลุม window)
+
+# ตารางช่วงราคา SET: ราคาต่ำกว่า bound → tick
+TICK_BOUNDS = np.array([2, 5, 10, 25, 100, 200, 400], dtype=float)
+TICK_SIZES  = np.array([0.01, 0.02, 0.05, 0.10, 0.25, 0.50, 1.00, 2.00])
+
+WRITE_COLS = ["symbol", "trade_date", "close", "tick_size", "range_ticks", "turnover", "turnover_avg20",
+              "zero_volume_days", "tradable"]
+
+DDL = """
+CREATE TABLE IF NOT EXISTS stock_liquidity_daily (
+    symbol              TEXT NOT NULL,
+    trade_date          DATE NOT NULL,
+    close               NUMERIC(18,6),
+    tick_size           NUMERIC(10,2),
+    range_ticks         NUMERIC(18,2),
+    turnover            NUMERIC(20,2),
+    turnover_avg20      NUMERIC(20,2),
+    zero_volume_days    INT,
+    tradable            BOOLEAN,
+    updated_at          TIMESTAMP DEFAULT now(),
+    PRIMARY KEY(symbol, trade_date)
+);
+CREATE INDEX IF NOT EXISTS ix_stock_liquidity_daily_date_tradable ON stock_liquidity_daily(trade_date, tradable);
+"""
+
+# ------------------------------------------------
+def ensure_table():
+    with db.connect() as conn, conn.cursor() as cur:
+        cur.execute(DDL)
+        conn.commit()
+
+def fetch_spans(symbols):
+    """ช่วงที่คำนวณแล้วใน stock_liquidity_daily ต่อ symbol: {symbol: (วันแรก, วันล่าสุด, จำนวนแถว)}
+    ทุกแถวราคาได้ 1 แถวผลลัพธ์ → จำนวนแถวใช้ตรวจราคาที่ถูกเติม/ลบย้อนหลังด้วย inc.stale_symbols"""
+    with db.connect() as conn, conn.cursor() as cur:
+        cur.execute("""
+            SELECT symbol, min(trade_date), max(trade_date), count(*)
+            FROM stock_liquidity_daily
+            WHERE symbol = ANY(%s)
+            GROUP BY symbol;
+        """, (list(symbols),))
+        return {sym: (first, last, n) for sym, first, last, n in cur.fetchall()}
+
+def drop_symbols(symbols):
+    """ลบผลเดิมของ symbol ที่ต้องคำนวณใหม่ทั้งช่วง (แถวของวันที่ที่ราคาถูกลบไปแล้วจะไม่ค้าง)"""
+    with db.connect() as conn, conn.cursor() as cur:
+        cur.execute("DELETE FROM stock_liquidity_daily WHERE symbol = ANY(%s);", (list(symbols),))
+        conn.commit()
+
+def tradable_symbols(symbols):
+    """คืน set ของ symbol ที่ tradable ตามแถวล่าสุดใน stock_liquidity_daily
+    symbol ที่ยังไม่มีข้อมูลถือว่า tradable; ถ้ายังไม่มีตารางคืน None (ไม่กรอง)"""
+    with db.connect() as conn, conn.cursor() as cur:
+        cur.execute("SELECT to_regclass('stock_liquidity_daily') IS NOT NULL;")
+        if not cur.fetchone()[0]:
+            return None
+        cur.execute("""
+            SELECT s.symbol
+            FROM unnest(%s::text[]) AS s(symbol)
+            LEFT JOIN LATERAL (
+                SELECT tradable FROM stock_liquidity_daily d
+                WHERE d.symbol = s.symbol ORDER BY d.trade_date DESC LIMIT 1
+            ) t ON true
+            WHERE t.tradable IS NOT FALSE;
+        """, (list(symbols),))
+        return {r[0] for r in cur.fetchall()}
+
+# ------------------------------------------------
+def tick_size(price):
+    """ช่วงราคาขั้นต่ำตามระดับราคา (vectorized) NaN คืน NaN"""
+    price = np.asarray(price, dtype=float)
+    out = TICK_SIZES[np.searchsorted(TICK_BOUNDS, np.nan_to_num(price), side="right")]
+    return np.where(np.isnan(price), np.nan, out)
+
+def compute_liquidity(price):
+    """คำนวณทุก symbol พร้อมกัน คืน DataFrame[WRITE_COLS] ต่อแถวราคาใน price
+    window นับเป็นวันทำการของตลาด (วันที่ symbol ไม่มีแถวราคา = ไม่มีการซื้อขาย)"""
+    d = price.sort_values(["symbol", "trade_date"]).reset_index(drop=True)
+    di, dates = pd.factorize(d["trade_date"], sort=True)
+    si, syms = pd.factorize(d["symbol"], sort=True)
+    shape = (len(dates), len(syms))
+
+    def to_mat(col):
+        m = np.full(shape, np.nan)
+        m[di, si] = pd.to_numeric(d[col], errors="coerce").to_numpy(dtype=float)
+        return pd.DataFrame(m)
+
+    H, L, C, V = to_mat("high"), to_mat("low"), to_mat("close"), to_mat("volume")
+    listed = C.notna().cumsum() > 0  # นับวันหยุดซื้อขายหลังเข้าตลาดแล้วเท่านั้น
+
+    hi = H.rolling(LIQ_RANGE_DAYS, min_periods=1).max()
+    lo = L.rolling(LIQ_RANGE_DAYS, min_periods=1).min()
+    tick = tick_size(C.to_numpy())
+    range_ticks = (hi - lo).to_numpy() / tick
+    turnover = (C * V).to_numpy()
+    # วันที่ไม่มีการซื้อขายหลังเข้าตลาดนับเป็นมูลค่า 0 (ไม่ใช่ NaN ที่ทำให้ค่าเฉลี่ยหาย)
+    turnover_avg20 = (C * V).fillna(0).where(listed).rolling(20, min_periods=20).mean().to_numpy()
+    zero = ((V.fillna(0) <= 0) & listed).astype(float).rolling(LIQ_ZERO_DAYS, min_periods=1).sum().to_numpy()
+
+    out = d[["symbol", "trade_date"]].copy()
+    out["close"] = C.to_numpy()[di, si]
+    out["tick_size"] = tick[di, si]
+    out["range_ticks"] = range_ticks[di, si]
+    out["turnover"] = turnover[di, si]
+    out["turnover_avg20"] = turnover_avg20[di, si]
+    out["zero_volume_days"] = zero[di, si].astype(np.int64)
+    # turnover_avg20 ยังไม่มี (เข้าตลาดไม่ถึง 20 วัน เช่นหุ้น IPO) = ไม่รู้ → ไม่ตัดด้วยเงื่อนไขนี้
+    out["tradable"] = ((out["range_ticks"] >= LIQ_MIN_RANGE_TICKS)
+                       & (out["turnover_avg20"].isna() | (out["turnover_avg20"] >= LIQ_MIN_TURNOVER))
+                       & (out["zero_volume_days"] <= LIQ_MAX_ZERO_DAYS))
+    return out[WRITE_COLS]
+
+# ------------------------------------------------
+def copy_upsert(df):
+    if df.empty:
+        return
+    with db.connect() as conn:
+        db.copy_upsert(conn, df, "stock_liquidity_daily", WRITE_COLS)
+
+def main():
+    ensure_table()
+    symbols = v4.get_active_symbols()
+    if not symbols:
+        print("❌ No symbols.")
+        return
+
+    spans = fetch_spans(symbols)
+    stale = inc.stale_symbols(spans)
+    if stale:
+        # ราคาถูกเติม/ลบย้อนหลัง → rolling window ของวันหลังจากนั้นเปลี่ยน คำนวณ symbol นั้นใหม่ทั้งช่วง
+        print(f"♻️ Reseed liquidity for {len(stale):,} symbols (price bars changed before last computed date)")
+        drop_symbols(stale)
+    last = {sym: span[1] for sym, span in spans.items() if sym not in stale}
+    seed = [s for s in symbols if s not in last]
+    parts = []
+    if seed:
+        start = v4.resolve_start_date()
+        print(f"🌱 Backfill liquidity for {len(seed):,} symbols from {start}")
+        parts.append(v4.fetch_prices(seed, start))
+    if last:
+        parts.append(v4.fetch_prices(list(last), date.today() - timedelta(days=LIQ_HISTORY_DAYS)))
+    price = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame()
+    if price.empty:
+        print("No price rows.")
+        return
+
+    calc = compute_liquidity(price)
+    last_s = calc["symbol"].map(last)
+    calc = calc[last_s.isna() | (calc["trade_date"] > last_s.fillna(date.min))]  # เขียนเฉพาะวันที่ใหม่
+    if calc.empty:
+        print("No new rows.")
+    else:
+        print(f"🧾 Upserting {len(calc):,} rows ...")
+        copy_upsert(calc)
+        latest = calc.sort_values("trade_date").groupby("symbol").tail(1)
+        print(f"   tradable {int(latest['tradable'].sum()):,} / {len(latest):,} symbols (ล่าสุด)")
+        screener.refresh(latest["symbol"].unique())  # tradable / turnover_avg20 ใน latest_snapshot
+
+    print("✅ Done compute_liquidity.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+แผนขายหุ้นในพอร์ต 4 ระดับ (ตามไอเดียคำนวนสถานะ.txt) + trailing stop
+- อ่านหุ้นที่ถืออยู่จาก snapshot ล่าสุดของ portfolio_stock (updatePort.UpdatePortfolio) ต่อ account
+- ราคาล่าสุดจาก stock_price_history, สัญญาณล่าสุดจาก stock_signal
+- คำนวณทุก position พร้อมกันด้วย np.select (เงื่อนไขเรียงตามความสำคัญ):
+  (ตัวเลขหน้าแต่ละข้อ = level ที่บันทึกใน position_exit_plan)
+    4. ขาดทุน <= -10%                          → ขายทั้งหมดทันที ไม่สน cooldown
+    5. ราคาหลุด trailing stop                   → ขายทั้งหมดทันที
+    0. อยู่ใน cooldown 3 วันหลังขายครั้งล่าสุด     → HOLD
+    6. สัญญาณ SELL ของแท่งล่าสุด (stock_signal)    → ขาย 1/2 ("ตั้งจุดขาย เมื่อมีสัญญาณ sell")
+    1. กำไร >= 10%                              → ขาย 1/4
+    2. กำไรเหลือไม่เกิน 3% (เคยขึ้นไปสูงกว่านั้น)  → ขาย 1/3 (รักษากำไรใกล้ทุน)
+    3. ขาดทุน -5% ถึง -10%                      → ขาย 1/2 (รักษาต้น)
+- เก็บ state ต่อ position (peak_price, trail_stop, last_sell_date, volume, cost) ใน position_exit_state
+  เขียนเฉพาะ position ที่ state เปลี่ยน, ลบ state ของหุ้นที่ขายหมดแล้ว
+- รู้ว่าขายไปแล้วจาก volume ที่ลดลงเทียบกับ state รอบก่อน → เริ่มนับ cooldown
+- ต้นทุนเฉลี่ยเปลี่ยน (ซื้อเพิ่ม) → เริ่มนับ peak_price / trail_stop ใหม่จากราคาปัจจุบัน
+- แผนที่ต้องทำ (action != HOLD) บันทึกลง position_exit_plan ต่อวัน
+"""
+
+import os
+import numpy as np
+import pandas as pd
+import db
+from psycopg2.extras import execute_values
+from datetime import date
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# ------- พารามิเตอร์แผนขาย (สัดส่วน ไม่ใช่ %) -------
+TAKE_PROFIT_PCT   = float(os.getenv("EXIT_TAKE_PROFIT_PCT", "0.10"))   # ระดับ 1: กำไรถึงเท่านี้ ขาย 1/4
+NEAR_COST_PCT     = float(os.getenv("EXIT_NEAR_COST_PCT", "0.03"))     # ระดับ 2: กำไรถอยมาเหลือไม่เกินเท่านี้ ขาย 1/3
+SMALL_LOSS_PCT    = float(os.getenv("EXIT_SMALL_LOSS_PCT", "0.05"))    # ระดับ 3: ขาดทุนเกินเท่านี้ ขาย 1/2
+STOP_ALL_PCT      = float(os.getenv("EXIT_STOP_ALL_PCT", "0.10"))      # ระดับ 4: ขาดทุนเกินเท่านี้ ขายหมด
+TRAIL_ACTIVATE_PCT = float(os.getenv("EXIT_TRAIL_ACTIVATE_PCT", "0.10"))  # เริ่มใช้ trailing stop เมื่อ peak กำไรถึงเท่านี้
+TRAIL_PCT         = float(os.getenv("EXIT_TRAIL_PCT", "0.08"))         # stop = peak * (1 - TRAIL_PCT) ขยับขึ้นอย่างเดียว
+COOLDOWN_DAYS     = int(os.getenv("EXIT_COOLDOWN_DAYS", "3"))
+SIGNAL_SELL_FRAC  = float(os.getenv("EXIT_SIGNAL_SELL_FRAC", "0.5"))   # สัญญาณ SELL วันล่าสุด ขายสัดส่วนนี้
+BOARD_LOT         = 100  # หน่วยซื้อขายของ SET
+
+DDL = """
+CREATE TABLE IF NOT EXISTS position_exit_state (
+    account_no      TEXT NOT NULL,
+    symbol          TEXT NOT NULL,
+    volume          BIGINT,
+    cost            NUMERIC(18,6),
+    peak_price      NUMERIC(18,6),
+    trail_stop      NUMERIC(18,6),
+    last_sell_date  DATE,
+    updated_at      TIMESTAMP DEFAULT now(),
+    PRIMARY KEY(account_no, symbol)
+);
+CREATE TABLE IF NOT EXISTS position_exit_plan (
+    plan_date       DATE NOT NULL,
+    account_no      TEXT NOT NULL,
+    symbol          TEXT NOT NULL,
+    action          TEXT,
+    level           INT,
+    sell_qty        BIGINT,
+    price           NUMERIC(18,6),
+    gain_pct        NUMERIC(18,6),
+    trail_stop      NUMERIC(18,6),
+    signal_type     TEXT,
+    reason          TEXT,
+    created_at      TIMESTAMP DEFAULT now(),
+    PRIMARY KEY(plan_date, account_no, symbol)
+);
+"""
+
+HOLD_COLS = ["account_no", "symbol", "volume", "cost", "market_price", "close", "price_date", "signal_type", "signal_date"]
+STATE_COLS = ["account_no", "symbol", "volume", "cost", "peak_price", "trail_stop", "last_sell_date"]
+PLAN_COLS = ["plan_date", "account_no", "symbol", "action", "level", "sell_qty", "price", "gain_pct", "trail_stop", "signal_type", "reason"]
+
+STATE_UPSERT_SQL = f"""
+INSERT INTO position_exit_state ({", ".join(STATE_COLS)})
+VALUES %s
+ON CONFLICT (account_no, symbol) DO UPDATE SET
+  {", ".join(f"{c} = EXCLUDED.{c}" for c in STATE_COLS[2:])},
+  updated_at = now();
+"""
+
+PLAN_UPSERT_SQL = f"""
+INSERT INTO position_exit_plan ({", ".join(PLAN_COLS)})
+VALUES %s
+ON CONFLICT (plan_date, account_no, symbol) DO UPDATE SET
+  {", ".join(f"{c} = EXCLUDED.{c}" for c in PLAN_COLS[3:])},
+  created_at = now();
+"""
+
+# ------------------------------------------------
+def ensure_table():
+    with db.connect() as conn, conn.cursor() as cur:
+        cur.execute(DDL)
+        conn.commit()
+
+def fetch_holdings():
+    """position ที่ถืออยู่จาก snapshot ล่าสุด (imported_at สูงสุด) ของแต่ละ account"""
+    with db.connect() as conn:
+        q = """
+        SELECT p.account_no, p.symbol, p.actual_volume AS volume, p.average_price AS cost, p.market_price
+        FROM portfolio_stock p
+        JOIN (SELECT account_no, max(imported_at) AS imported_at FROM portfolio_stock GROUP BY account_no) l
+          ON l.account_no = p.account_no AND l.imported_at = p.imported_at
+        WHERE p.actual_volume > 0;
+        """
+        return pd.read_sql(q, conn)
+
+def fetch_latest_market(symbols):
+    """ราคาปิดล่าสุด + สัญญาณล่าสุด (และวันที่ของสัญญาณ) ของแต่ละ symbol (LATERAL ... LIMIT 1 ใช้ index symbol/date)"""
+    with db.connect() as conn:
+        q = """
+        SELECT s.symbol, p.close, p.date AS price_date, g.signal_type, g.trade_date AS signal_date
+        FROM unnest(%s::text[]) AS s(symbol)
+        LEFT JOIN LATERAL (
+            SELECT close, date FROM stock_price_history h
+            WHERE h.symbol = s.symbol ORDER BY h.date DESC LIMIT 1
+        ) p ON true
+        LEFT JOIN LATERAL (
+            SELECT signal_type, trade_date FROM stock_signal g
+            WHERE g.symbol = s.symbol ORDER BY g.trade_date DESC LIMIT 1
+        ) g ON true;
+        """
+        return pd.read_sql(q, conn, params=(list(symbols),))
+
+def fetch_states():
+    with db.connect() as conn:
+        return pd.read_sql(f"SELECT {', '.join(STATE_COLS)} FROM position_exit_state;", conn)
+
+# ------------------------------------------------
+def lot_qty(volume, frac):
+    """จำนวนหุ้นที่จะขายปัดลงเป็น board lot; ถ้าปัดแล้วเป็น 0 ขายเท่าที่เหลือ (odd lot)"""
+    q = np.floor(volume * frac / BOARD_LOT) * BOARD_LOT
+    return np.where(q > 0, q, volume).astype(np.int64)
+
+def evaluate(hold, state, today=None):
+    """คำนวณแผนขายทุก position พร้อมกัน
+    hold  = DataFrame[HOLD_COLS] (ว่างได้ = ขายหมดทุกตัว → plan ว่าง, state ใหม่ว่าง)
+    state = position_exit_state รอบก่อน
+    คืน (plan DataFrame ทุก position, state ใหม่ DataFrame[STATE_COLS])"""
+    today = today or date.today()
+    prev = state.rename(columns={c: f"{c}_prev" for c in STATE_COLS[2:]})
+    df = hold.merge(prev, on=["account_no", "symbol"], how="left")
+
+    num = lambda c: pd.to_numeric(df[c], errors="coerce").to_numpy(dtype=float)
+    volume, cost = num("volume"), num("cost")
+    price = np.where(np.isnan(num("close")), num("market_price"), num("close"))
+    # ต้นทุนเฉลี่ยเปลี่ยนจากรอบก่อน (ซื้อเพิ่ม) → peak/trail เดิมอิงต้นทุนเก่า ทิ้งแล้วนับใหม่
+    cost_prev = num("cost_prev")
+    recost = ~np.isnan(cost_prev) & ~np.isclose(cost, cost_prev, rtol=1e-6, atol=1e-6)
+    peak = np.fmax(np.where(recost, np.nan, num("peak_price_prev")), price)  # fmax: state ว่าง (NaN) ใช้ราคาปัจจุบัน
+
+    # volume ลดลงจากรอบก่อน = มีการขายไปแล้ว → เริ่ม cooldown วันนี้
+    sold = volume < num("volume_prev")
+    last_sell = pd.to_datetime(df["last_sell_date_prev"]).to_numpy(dtype="datetime64[D]")
+    last_sell = np.where(sold, np.datetime64(today, "D"), last_sell)
+    in_cooldown = ~np.isnat(last_sell) & ((np.datetime64(today, "D") - last_sell).astype(int) < COOLDOWN_DAYS)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        gain = price / cost - 1
+        peak_gain = peak / cost - 1
+    trail_new = np.where(peak_gain >= TRAIL_ACTIVATE_PCT, peak * (1 - TRAIL_PCT), np.nan)
+    trail = np.fmax(np.where(recost, np.nan, num("trail_stop_prev")), trail_new)  # ขยับขึ้นอย่างเดียว
+
+    # สัญญาณ SELL นับเฉพาะที่ออกบนแท่งล่าสุด (สัญญาณเก่าที่ยังค้างเป็นแถวล่าสุดไม่นับ)
+    signal_date = pd.to_datetime(df["signal_date"]).to_numpy(dtype="datetime64[D]")
+    price_date = pd.to_datetime(df["price_date"]).to_numpy(dtype="datetime64[D]")
+    sell_signal = (df["signal_type"] == "SELL").to_numpy(dtype=bool) & ~np.isnat(signal_date) & (signal_date >= price_date)
+
+    conds = [
+        gain <= -STOP_ALL_PCT,
+        ~np.isnan(trail) & (price <= trail),
+        in_cooldown,
+        sell_signal,
+        gain >= TAKE_PROFIT_PCT,
+        (gain > 0) & (gain <= NEAR_COST_PCT) & (peak_gain > NEAR_COST_PCT),
+        gain <= -SMALL_LOSS_PCT,
+    ]
+    # (action, level, สัดส่วนที่ขาย, reason)
+    table = [
+        ("SELL_ALL", 4, 1.0,     f"ขาดทุน <= -{STOP_ALL_PCT:.0%} ขายทั้งหมด"),
+        ("SELL_ALL", 5, 1.0,     "หลุด trailing stop"),
+        ("HOLD",     0, 0.0,     f"cooldown {COOLDOWN_DAYS} วันหลังขาย"),
+        ("SELL",     6, SIGNAL_SELL_FRAC, f"สัญญาณ SELL ขาย {SIGNAL_SELL_FRAC:.0%}"),
+        ("SELL",     1, 1 / 4,   f"กำไร >= {TAKE_PROFIT_PCT:.0%} ขาย 1/4"),
+        ("SELL",     2, 1 / 3,   f"กำไรถอยมาใกล้ทุน (<= {NEAR_COST_PCT:.0%}) ขาย 1/3"),
+        ("SELL",     3, 1 / 2,   f"ขาดทุน -{SMALL_LOSS_PCT:.0%} ถึง -{STOP_ALL_PCT:.0%} ขาย 1/2"),
+    ]
+    default = ("HOLD", 0, 0.0, "ไม่เข้าเงื่อนไข")
+    idx = np.select(conds, list(range(len(table))), default=len(table))
+    rows = table + [default]
+
+    frac = np.array([rows[k][2] for k in idx])
+    plan = pd.DataFrame({
+        "plan_date": today,
+        "account_no": df["account_no"].to_numpy(),
+        "symbol": df["symbol"].to_numpy(),
+        "action": [rows[k][0] for k in idx],
+        "level": [rows[k][1] for k in idx],
+        "sell_qty": np.where(frac > 0, lot_qty(np.nan_to_num(volume), frac), 0),
+        "price": price,
+        "gain_pct": gain * 100,
+        "trail_stop": trail,
+        "signal_type": df["signal_type"].to_numpy(),
+        "reason": [rows[k][3] for k in idx],
+    })
+    new_state = pd.DataFrame({
+        "account_no": df["account_no"].to_numpy(),
+        "symbol": df["symbol"].to_numpy(),
+        "volume": volume,
+        "cost": cost,
+        "peak_price": peak,
+        "trail_stop": trail,
+        "last_sell_date": pd.to_datetime(last_sell).date if len(df) else [],
+    })
+    return plan, new_state
+
+def changed_states(new, old, eps=1e-6):
+    """คืนเฉพาะ state ที่เปลี่ยน/ใหม่ (ไม่เขียนแถวที่เหมือนเดิม)"""
+    if old.empty:
+        return new
+    m = new.merge(old, on=["account_no", "symbol"], how="left", suffixes=("", "_old"), indicator=True)
+    diff = (m["_merge"] == "left_only").to_numpy().copy()
+    for c in ["volume", "cost", "peak_price", "trail_stop"]:
+        a = pd.to_numeric(m[c], errors="coerce").to_numpy(dtype=float)
+        b = pd.to_numeric(m[f"{c}_old"], errors="coerce").to_numpy(dtype=float)
+        diff |= ~np.isclose(a, b, atol=eps, equal_nan=True)
+    a = pd.to_datetime(m["last_sell_date"]).to_numpy(dtype="datetime64[D]")
+    b = pd.to_datetime(m["last_sell_date_old"]).to_numpy(dtype="datetime64[D]")
+    diff |= ~((a == b) | (np.isnat(a) & np.isnat(b)))
+    return new[diff]
+
+def to_db_rows(df, cols):
+    """NaN/NaT → None และ numpy scalar → python (psycopg2 adapt numpy ไม่ได้)"""
+    out = df[cols].astype(object).where(df[cols].notna(), None)
+    return [tuple(r) for r in out.itertuples(index=False, name=None)]
+
+def save(new_state, old_state, plan):
+    changed = changed_states(new_state, old_state)
+    held = set(zip(new_state["account_no"], new_state["symbol"]))
+    gone = [(a, s) for a, s in zip(old_state["account_no"], old_state["symbol"]) if (a, s) not in held]
+    todo = plan[plan["action"] != "HOLD"]
+    with db.connect() as conn, conn.cursor() as cur:
+        if not changed.empty:
+            execute_values(cur, STATE_UPSERT_SQL, to_db_rows(changed, STATE_COLS))
+        if gone:
+            execute_values(cur, "DELETE FROM position_exit_state WHERE (account_no, symbol) IN (VALUES %s);", gone)
+        if not todo.empty:
+            execute_values(cur, PLAN_UPSERT_SQL, to_db_rows(todo, PLAN_COLS))
+        conn.commit()
+    return len(changed), len(gone), len(todo)
+
+# ------------------------------------------------
+def main():
+    ensure_table()
+    hold = fetch_holdings()
+    state = fetch_states()
+    if hold.empty:
+        print("No holdings.")
+        hold = pd.DataFrame(columns=HOLD_COLS)   # state ของหุ้นที่ขายหมดแล้วยังต้องถูกลบใน save()
+    else:
+        market = fetch_latest_market(hold["symbol"].unique())
+        hold = hold.merge(market, on="symbol", how="left")
+
+    plan, new_state = evaluate(hold, state)
+    n_state, n_gone, n_plan = save(new_state, state, plan)
+    print(f"🧾 {len(plan):,} positions: state changed {n_state:,}, removed {n_gone:,}, sell plans {n_plan:,}")
+    for r in plan[plan["action"] != "HOLD"].itertuples(index=False):
+        print(f"   {r.account_no} {r.symbol}: {r.action} {r.sell_qty:,} @ {r.price:.2f} ({r.gain_pct:+.1f}%) - {r.reason}")
+
+    print("✅ Done compute_position_exit.")
+
+if __name__ == "__main__":
+    main()
@@ -1,31 +1,39 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 """
-Compute trading signals from stock_indicator_daily
-- Rule-based logic (BUY, SELL, SIDEWAY, HOLD)
-- เขียนเฉพาะเมื่อมีการเปลี่ยนสถานะจริง
+Compute trading signals from stock_indicator_daily_v4
+- Rule-based logic (BUY, SELL, SIDEWAY, HOLD) ประกาศเป็น expression ใน signal_rules
+- pipeline mode: main(ind) รับ DataFrame indicator ที่เพิ่งคำนวณจาก compute_indicators_v4 ได้เลย ไม่ต้องอ่านกลับจาก DB
+- เขียนเฉพาะเมื่อมีการเปลี่ยนสถานะจริง (เช็คใน DB ด้วย ON CONFLICT ... WHERE ... IS DISTINCT FROM ไม่ต้องโหลด stock_signal มาเทียบ)
+- หุ้นที่ถูกตัดเพราะไม่มีสภาพคล่อง (SIGNAL_TRADABLE_ONLY) ไม่ถูกประเมินกฎรอบนี้ สัญญาณเดิมใน stock_signal ไม่ถูกแตะ
+  สถานะสภาพคล่องดูจาก latest_snapshot.tradable (compute_liquidity)
 """
 
 import os
 import pandas as pd
-import psycopg2
+import db
 from psycopg2.extras import execute_values
 from datetime import date, timedelta
-from tqdm import tqdm
 from dotenv import load_dotenv
 
-load_dotenv()
+import signal_rules
+import screener
+import compute_liquidity
 
-PG_CONN_STR = (
-    f"host={os.getenv('posql_host','localhost')} "
-    f"port={os.getenv('posql_port','5432')} "
-    f"dbname={os.getenv('posql_db','stocks')} "
-    f"user={os.getenv('posql_user','postgres')} "
-    f"password={os.getenv('posql_password','postgres')}"
-)
+load_dotenv()
 
 BATCH_SIZE = int(os.getenv("SIGNAL_BATCH_SIZE", "2000"))
 LOOKBACK_DAYS = int(os.getenv("SIGNAL_LOOKBACK_DAYS", "10"))  # ดึงอินดิเคเตอร์ย้อนหลังกี่วันเพื่อตัดสิน cross
+RULESET = os.getenv("SIGNAL_RULESET", "base")  # ชุดกฎใน signal_rules.RULESETS
+TRADABLE_ONLY = os.getenv("SIGNAL_TRADABLE_ONLY", "1") == "1"  # ตัดหุ้นที่ compute_liquidity บอกว่าไม่มีสภาพคล่องออกก่อนประเมินกฎ
+
+RULES = signal_rules.load_ruleset(RULESET)  # compile ครั้งเดียวตอน import
+
+IND_TABLE = "stock_indicator_daily_v4"
+IND_COLS = ["symbol", "trade_date", "ema5", "ema10", "ema12", "ema20", "ema26", "ema50", "ema200",
+            "rsi14", "rsi21", "macd", "macd_signal", "macd_hist",
+            "macd_19_39_9", "macd_19_39_9_signal", "macd_19_39_9_hist",
+            "volume_avg20", "vol_ema10", "vol_ema20", "vol_ema50", "trend_status"]
 
 DDL = """
 CREATE TABLE IF NOT EXISTS stock_signal (
@@ -47,109 +55,103 @@ ON CONFLICT (symbol, trade_date) DO UPDATE
 SET signal_type = EXCLUDED.signal_type,
     priority    = EXCLUDED.priority,
     reason      = EXCLUDED.reason,
-    created_at  = now();
+    created_at  = now()
+WHERE stock_signal.signal_type IS DISTINCT FROM EXCLUDED.signal_type
+RETURNING 1;
 """
 
 # ------------------------------------------------
-def pg_conn():
-    return psycopg2.connect(PG_CONN_STR)
-
 def ensure_table():
-    with pg_conn() as conn, conn.cursor() as cur:
+    with db.connect() as conn, conn.cursor() as cur:
         cur.execute(DDL)
         conn.commit()
 
+def signal_start(days_back=LOOKBACK_DAYS):
+    """วันแรกที่จะออกสัญญาณ (ใช้เป็น keep_since ของ compute_indicators_v4 ใน pipeline mode)"""
+    return date.today() - timedelta(days=days_back)
+
 def fetch_recent_indicators(days_back=LOOKBACK_DAYS):
-    start = date.today() - timedelta(days=days_back)
-    with pg_conn() as conn:
-        q = """
-        SELECT
-            symbol, trade_date,
-            ema20, ema50, ema200,
-            rsi14, macd, macd_signal, macd_hist,
-            trend_status
-        FROM stock_indicator_daily
-        WHERE trade_date >= %s
-        ORDER BY symbol, trade_date;
-        """
-        return pd.read_sql(q, conn, params=(start,))
-
-
-def fetch_existing_signals():
-    """โหลดสัญญาณล่าสุด เพื่อเทียบว่าควรเขียนใหม่ไหม"""
-    with pg_conn() as conn:
-        q = "SELECT symbol, trade_date, signal_type FROM stock_signal;"
-        df = pd.read_sql(q, conn)
-        return {(r.symbol, r.trade_date): r.signal_type for r in df.itertuples(index=False)}
+    q = f"""
+    SELECT {", ".join(IND_COLS)}
+    FROM {IND_TABLE}
+    WHERE trade_date >= %s
+    ORDER BY symbol, trade_date;
+    """
+    return db.read_frame(q, (signal_start(days_back),))  # server-side cursor (backtest อ่านย้อนหลังหลายปี)
+
+def fetch_prior_rows(symbols, start):
+    """แถวล่าสุดก่อน start ของแต่ละ symbol (ใช้เป็นแถวก่อนหน้าให้ cross/prev ของวันแรก)"""
+    # LATERAL ... LIMIT 1 ต่อ symbol ใช้ index (symbol, trade_date) ไม่ต้องสแกนประวัติทั้งหมด
+    q = f"""
+    SELECT t.*
+    FROM unnest(%s::text[]) AS s(symbol)
+    CROSS JOIN LATERAL (
+        SELECT {", ".join(IND_COLS)}
+        FROM {IND_TABLE} i
+        WHERE i.symbol = s.symbol AND i.trade_date < %s
+        ORDER BY i.trade_date DESC
+        LIMIT 1
+    ) t;
+    """
+    return db.read_frame(q, (list(symbols), start))
+
+def with_context(ind, start):
+    """เติมแถวก่อน start ให้ symbol ที่เฟรมเริ่มที่ start พอดี (เช่นโหมด incremental ที่คำนวณแค่แท่งใหม่)
+    symbol ที่เฟรมมีข้อมูลก่อน start อยู่แล้วไม่ต้องอ่าน DB"""
+    first = ind.groupby("symbol")["trade_date"].min()
+    need = first[first >= start].index
+    if len(need) == 0:
+        return ind
+    prior = fetch_prior_rows(need, start)
+    prior = prior[[c for c in prior.columns if c in ind.columns]]
+    return pd.concat([prior, ind], ignore_index=True) if not prior.empty else ind
 
 # ------------------------------------------------
-def detect_signals(df_sym: pd.DataFrame):
-    """คืนค่า list ของสัญญาณสำหรับ symbol เดียว"""
-    out = []
-    df_sym = df_sym.sort_values("trade_date").reset_index(drop=True)
-    for i, r in df_sym.iterrows():
-        sig, pri, reason = None, 0, None
-
-        # skip incomplete data
-        if pd.isna(r["ema20"]) or pd.isna(r["ema50"]) or pd.isna(r["rsi14"]) or pd.isna(r["macd_signal"]):
-            continue
-
-        prev_macd, prev_sigline = (None, None)
-        if i > 0:
-            prev_macd, prev_sigline = df_sym.loc[i-1, ["macd", "macd_signal"]]
-
-        macd_cross_up = prev_macd is not None and prev_sigline is not None and (prev_macd < prev_sigline) and (r["macd"] > r["macd_signal"])
-        macd_cross_down = prev_macd is not None and prev_sigline is not None and (prev_macd > prev_sigline) and (r["macd"] < r["macd_signal"])
-
-        # --- RULES ---
-        if r["ema20"] > r["ema50"] and macd_cross_up and r["rsi14"] > 45:
-            sig, pri, reason = "BUY", 3, "EMA20>EMA50 & MACD↑ & RSI>45" # แนวโน้มขาขึ้น + MACD ตัดขึ้น + RSI ไม่ต่ำเกิน
-        elif r["ema20"] > r["ema50"] and r["rsi14"] < 40:
-            sig, pri, reason = "BUY-WATCH", 2, "EMA20>EMA50 & RSI<40 (pullback)" # แนวโน้มขาขึ้น แต่ RSI ต่ำ
-        elif r["ema20"] < r["ema50"] and macd_cross_down and r["rsi14"] < 55:
-            sig, pri, reason = "SELL", 3, "EMA20<EMA50 & MACD↓ & RSI<55" # แนวโน้มขาลง + MACD ตัดลง + RSI ไม่สูงเกิน
-        elif r["ema20"] < r["ema50"] and r["rsi14"] > 60:
-            sig, pri, reason = "SELL-WATCH", 2, "EMA20<EMA50 & RSI>60 (bounce)" # แนวโน้มขาลง แต่ RSI สูง
-        elif abs(r["ema20"] - r["ema50"]) / r["ema50"] < 0.01 and 40 <= r["rsi14"] <= 60:
-            sig, pri, reason = "SIDEWAY", 1, "EMA20≈EMA50 & RSI neutral" # แนวโน้มแกว่งตัว
-        else:
-            sig, pri, reason = "HOLD", 0, "No signal change"# ถือสถานะเดิม
-
-        out.append((r["symbol"], r["trade_date"], sig, pri, reason))
-
-    return out
+def detect_signals(df: pd.DataFrame, rules=None):
+    """คืนค่า list ของ (symbol, trade_date, signal_type, priority, reason)
+    คำนวณทั้งเฟรมพร้อมกัน (กี่ symbol ก็ได้) ด้วยกฎที่ compile แล้วจาก signal_rules"""
+    rules = rules or RULES
+    out = rules.evaluate(df)
+    return list(zip(out["symbol"].tolist(), out["trade_date"].tolist(), out["signal_type"].tolist(),
+                    out["priority"].tolist(), out["reason"].tolist()))
 
 # ------------------------------------------------
 def upsert(rows):
-    if not rows: return
-    with pg_conn() as conn, conn.cursor() as cur:
-        execute_values(cur, UPSERT_SQL, rows, page_size=BATCH_SIZE)
+    """upsert ทั้งหมด แต่ DB จะเขียนเฉพาะแถวใหม่/สัญญาณเปลี่ยน คืนจำนวนแถวที่ถูกเขียนจริง"""
+    if not rows: return 0
+    with db.connect() as conn, conn.cursor() as cur:
+        written = execute_values(cur, UPSERT_SQL, rows, page_size=BATCH_SIZE, fetch=True)
         conn.commit()
+    return len(written)
 
 # ------------------------------------------------
-def main():
+def main(ind=None):
+    """ind = DataFrame indicator จาก compute_indicators_v4.main(keep_since=signal_start()) (pipeline mode)
+    ถ้าไม่ส่งมาจะอ่านจาก stock_indicator_daily_v4 เอง"""
     ensure_table()
 
-    ind = fetch_recent_indicators()
+    start = signal_start()
+    if ind is None:
+        ind = fetch_recent_indicators()
+    elif not ind.empty:
+        ind = with_context(ind, start)
     if ind.empty:
         print("❌ No indicator data found.")
         return
-
-    existing = fetch_existing_signals()
-
-    all_rows = []
-    for sym, df_sym in tqdm(ind.groupby("symbol"), total=ind["symbol"].nunique(), desc="Compute signals"):
-        sigs = detect_signals(df_sym)
-        for (symb, dt, sig, pri, reason) in sigs:
-            old = existing.get((symb, dt))
-            if old != sig:  # เขียนเฉพาะวันที่สัญญาณเปลี่ยน
-                all_rows.append((symb, dt, sig, pri, reason))
-
-    if all_rows:
-        print(f"🧾 Writing {len(all_rows):,} updated signals ...")
-        upsert(all_rows)
+    all_symbols = ind["symbol"].unique()
+    if TRADABLE_ONLY:
+        ok = compute_liquidity.tradable_symbols(all_symbols)
+        if ok is not None:
+            ind = ind[ind["symbol"].isin(ok)]
+            print(f"💧 tradable {ind['symbol'].nunique():,} / {len(all_symbols):,} symbols")
+
+    all_rows = [r for r in detect_signals(ind) if r[1] >= start]  # แถว context ใช้คำนวณ cross เท่านั้น
+    written = upsert(all_rows)  # เขียนเฉพาะวันที่สัญญาณเปลี่ยน (กรองใน DB)
+    if written:
+        print(f"🧾 Wrote {written:,} / {len(all_rows):,} updated signals")
     else:
         print("No signal changes to write.")
+    screener.refresh(all_symbols)  # latest_snapshot ของ symbol ที่คำนวณรอบนี้ รวมที่ถูกตัดด้วย TRADABLE_ONLY
 
     print("✅ Done compute_signals.")
 
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+แนวรับ/แนวต้าน + rolling high/low ต่อ symbol (stage เสริมข้าง compute_indicators_v4)
+- rolling high/low N วัน (SR_WINDOWS) ด้วย monotonic deque O(n) ต่อ symbol ไม่ต้องสแกน window ซ้ำทุกวัน
+- pivot แบบ floor (P, R1, S1) จากแท่งวันนี้ ใช้เป็นแนวของวันถัดไป
+- swing high/low (fractal ±SR_PIVOT_BARS แท่ง ยืนยันเมื่อผ่านไปครบ k แท่ง ไม่มองอนาคต)
+  จัดกลุ่มราคาที่ห่างกันไม่เกิน SR_CLUSTER_PCT เป็นแนวรับ/ต้าน (strength = จำนวนครั้งที่แตะ)
+- เก็บใน stock_sr_daily (symbol, trade_date) พร้อม dist_support_pct / dist_resistance_pct ที่มี index
+  → screen "ห่างแนวรับไม่เกิน 2%" เป็น index lookup
+- incremental: symbol ที่มีข้อมูลแล้วคำนวณจากราคาย้อนหลัง SR_HISTORY_DAYS (พอสำหรับ warmup) และเขียนเฉพาะวันที่ใหม่
+  symbol ใหม่ backfill ช่วงเต็มตาม START_DATE/LOOKBACK_DAYS ของ compute_indicators_v4
+  symbol ที่จำนวนแท่งราคาในช่วงที่คำนวณแล้วไม่ตรงกับจำนวนแถวเดิม (เติม/ลบราคาย้อนหลัง) ถูกลบแล้ว backfill ใหม่
+"""
+
+import os
+import bisect
+from collections import deque
+from datetime import date, timedelta
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+import db
+import compute_indicators_v4 as v4
+import compute_indicators_incremental as inc
+import screener
+
+SR_WINDOWS      = tuple(int(x) for x in os.getenv("SR_WINDOWS", "20,60,250").split(","))
+SR_PIVOT_BARS   = int(os.getenv("SR_PIVOT_BARS", "5"))          # swing pivot ต้องสูง/ต่ำสุดใน ±k แท่ง
+SR_LOOKBACK     = int(os.getenv("SR_LOOKBACK", "250"))          # ใช้ swing pivot ย้อนหลังกี่แท่งมาจัดกลุ่ม
+SR_CLUSTER_PCT  = float(os.getenv("SR_CLUSTER_PCT", "0.015"))   # ราคาห่างกันไม่เกินเท่านี้ถือเป็นแนวเดียวกัน
+SR_MIN_TOUCHES  = int(os.getenv("SR_MIN_TOUCHES", "2"))         # แนวต้องแตะอย่างน้อยกี่ครั้ง
+SR_HISTORY_DAYS = int(os.getenv("SR_HISTORY_DAYS", "550"))      # ช่วงราคาที่โหลดในรอบ incremental (ต้องครอบคลุม window/lookback)
+
+WINDOW_COLS = [f"{p}_{n}" for n in SR_WINDOWS for p in ("high", "low")]
+WRITE_COLS = (["symbol", "trade_date", "close"] + WINDOW_COLS +
+              ["pivot", "r1", "s1", "support", "support_strength", "resistance", "resistance_strength",
+               "dist_support_pct", "dist_resistance_pct"])
+
+DDL = f"""
+CREATE TABLE IF NOT EXISTS stock_sr_daily (
+    symbol              TEXT NOT NULL,
+    trade_date          DATE NOT NULL,
+    close               NUMERIC(18,6),
+    {"".join(f"{c:<20}NUMERIC(18,6),{chr(10)}    " for c in WINDOW_COLS)}pivot               NUMERIC(18,6),
+    r1                  NUMERIC(18,6),
+    s1                  NUMERIC(18,6),
+    support             NUMERIC(18,6),
+    support_strength    INT,
+    resistance          NUMERIC(18,6),
+    resistance_strength INT,
+    dist_support_pct    NUMERIC(18,6),
+    dist_resistance_pct NUMERIC(18,6),
+    updated_at          TIMESTAMP DEFAULT now(),
+    PRIMARY KEY(symbol, trade_date)
+);
+CREATE INDEX IF NOT EXISTS ix_stock_sr_daily_date_support ON stock_sr_daily(trade_date, dist_support_pct);
+CREATE INDEX IF NOT EXISTS ix_stock_sr_daily_date_resistance ON stock_sr_daily(trade_date, dist_resistance_pct);
+"""
+
+# ------------------------------------------------
+def ensure_table():
+    with db.connect() as conn, conn.cursor() as cur:
+        cur.execute(DDL)
+        conn.commit()
+
+def fetch_spans(symbols):
+    """ช่วงที่คำนวณแล้วใน stock_sr_daily ต่อ symbol: {symbol: (วันแรก, วันล่าสุด, จำนวนแถว)}
+    ทุกแถวราคาได้ 1 แถวผลลัพธ์ → จำนวนแถวใช้ตรวจราคาที่ถูกเติม/ลบย้อนหลังด้วย inc.stale_symbols"""
+    with db.connect() as conn, conn.cursor() as cur:
+        cur.execute("""
+            SELECT symbol, min(trade_date), max(trade_date), count(*)
+            FROM stock_sr_daily
+            WHERE symbol = ANY(%s)
+            GROUP BY symbol;
+        """, (list(symbols),))
+        return {sym: (first, last, n) for sym, first, last, n in cur.fetchall()}
+
+def drop_symbols(symbols):
+    """ลบผลเดิมของ symbol ที่ต้องคำนวณใหม่ทั้งช่วง (แถวของวันที่ที่ราคาถูกลบไปแล้วจะไม่ค้าง)"""
+    with db.connect() as conn, conn.cursor() as cur:
+        cur.execute("DELETE FROM stock_sr_daily WHERE symbol = ANY(%s);", (list(symbols),))
+        conn.commit()
+
+# ------------------------------------------------
+def rolling_max(x, window):
+    """max ของ window แท่งล่าสุด (รวมแท่งปัจจุบัน) ด้วย monotonic deque O(n)
+    ก่อนครบ window ใช้เท่าที่มี, NaN ถูกข้าม"""
+    out = np.full(len(x), np.nan)
+    dq = deque()  # index ที่ค่าเรียงจากมากไปน้อย
+    for i, v in enumerate(x):
+        if v == v:
+            while dq and x[dq[-1]] <= v:
+                dq.pop()
+            dq.append(i)
+        while dq and dq[0] <= i - window:
+            dq.popleft()
+        if dq:
+            out[i] = x[dq[0]]
+    return out
+
+def rolling_min(x, window):
+    return -rolling_max(-np.asarray(x, dtype=float), window)
+
+def swing_points(high, low, k=SR_PIVOT_BARS):
+    """swing high/low ที่ index i (สูง/ต่ำสุดใน ±k แท่ง) คืน list ของ (แท่งที่ยืนยัน = i+k, ราคา)"""
+    n = len(high)
+    hi = rolling_max(high, 2 * k + 1)
+    lo = rolling_min(low, 2 * k + 1)
+    pts = []
+    for j in range(2 * k, n):
+        i = j - k
+        if high[i] == hi[j]:
+            pts.append((j, high[i]))
+        if low[i] == lo[j]:
+            pts.append((j, low[i]))
+    return pts
+
+def cluster_levels(prices, tol=SR_CLUSTER_PCT, min_touches=SR_MIN_TOUCHES):
+    """จัดกลุ่มราคาที่ห่างจากต้นกลุ่มไม่เกิน tol → [(ระดับเฉลี่ย, จำนวนครั้ง)] เรียงจากต่ำไปสูง"""
+    levels, group = [], []
+    for p in sorted(prices):
+        if group and (p - group[0]) > group[0] * tol:
+            if len(group) >= min_touches:
+                levels.append((sum(group) / len(group), len(group)))
+            group = []
+        group.append(p)
+    if len(group) >= min_touches:
+        levels.append((sum(group) / len(group), len(group)))
+    return levels
+
+def compute_sr(df_sym):
+    """คำนวณทุกคอลัมน์ของ stock_sr_daily ให้ symbol เดียว (เรียงตาม trade_date)"""
+    df_sym = df_sym.sort_values("trade_date")
+    high = pd.to_numeric(df_sym["high"], errors="coerce").to_numpy(dtype=float)
+    low = pd.to_numeric(df_sym["low"], errors="coerce").to_numpy(dtype=float)
+    close = pd.to_numeric(df_sym["close"], errors="coerce").to_numpy(dtype=float)
+    n = len(close)
+
+    out = {"symbol": df_sym["symbol"].to_numpy(), "trade_date": df_sym["trade_date"].to_numpy(), "close": close}
+    for w in SR_WINDOWS:
+        out[f"high_{w}"] = rolling_max(high, w)
+        out[f"low_{w}"] = rolling_min(low, w)
+
+    pivot = (high + low + close) / 3
+    out["pivot"], out["r1"], out["s1"] = pivot, 2 * pivot - low, 2 * pivot - high
+
+    # แนวรับ/ต้านจาก swing pivot ที่ยืนยันแล้วใน SR_LOOKBACK แท่งล่าสุด จัดกลุ่มใหม่เฉพาะวันที่ชุด pivot เปลี่ยน
+    sup, sup_n, res, res_n = (np.full(n, np.nan) for _ in range(4))
+    pts = swing_points(high, low)
+    window, p, levels, changed = deque(), 0, [], False
+    for j in range(n):
+        while p < len(pts) and pts[p][0] <= j:
+            window.append(pts[p])
+            p += 1
+            changed = True
+        while window and window[0][0] <= j - SR_LOOKBACK:
+            window.popleft()
+            changed = True
+        if changed:
+            levels = cluster_levels([q for _, q in window])
+            prices = [lv for lv, _ in levels]
+            changed = False
+        if not levels or close[j] != close[j]:
+            continue
+        k = bisect.bisect_right(prices, close[j])
+        if k > 0:
+            sup[j], sup_n[j] = levels[k - 1]
+        if k < len(levels):
+            res[j], res_n[j] = levels[k]
+
+    out["support"], out["support_strength"] = sup, sup_n
+    out["resistance"], out["resistance_strength"] = res, res_n
+    with np.errstate(divide="ignore", invalid="ignore"):
+        out["dist_support_pct"] = (close - sup) / sup * 100
+        out["dist_resistance_pct"] = (res - close) / close * 100
+    return pd.DataFrame(out)
+
+# ------------------------------------------------
+def copy_upsert(df):
+    if df.empty:
+        return
+    df = df.copy()
+    for c in ("support_strength", "resistance_strength"):
+        df[c] = df[c].astype("Int64")
+    with db.connect() as conn:
+        db.copy_upsert(conn, df, "stock_sr_daily", WRITE_COLS)
+
+def main():
+    ensure_table()
+    symbols = v4.get_active_symbols()
+    if not symbols:
+        print("❌ No symbols.")
+        return
+
+    spans = fetch_spans(symbols)
+    stale = inc.stale_symbols(spans)
+    if stale:
+        # ราคาถูกเติม/ลบย้อนหลัง → rolling window ของวันหลังจากนั้นเปลี่ยน คำนวณ symbol นั้นใหม่ทั้งช่วง
+        print(f"♻️ Reseed S/R for {len(stale):,} symbols (price bars changed before last computed date)")
+        drop_symbols(stale)
+    last = {sym: span[1] for sym, span in spans.items() if sym not in stale}
+    seed = [s for s in symbols if s not in last]
+    parts = []
+    if seed:
+        start = v4.resolve_start_date()
+        print(f"🌱 Backfill S/R for {len(seed):,} symbols from {start}")
+        parts.append(v4.fetch_prices(seed, start))
+    if last:
+        parts.append(v4.fetch_prices(list(last), date.today() - timedelta(days=SR_HISTORY_DAYS)))
+    price = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame()
+    if price.empty:
+        print("No price rows.")
+        return
+
+    out = []
+    for sym, df_sym in tqdm(price.groupby("symbol"), total=price["symbol"].nunique(), desc="S/R"):
+        calc = compute_sr(df_sym)
+        if sym in last:
+            calc = calc[calc["trade_date"] > last[sym]]  # เขียนเฉพาะวันที่ใหม่
+        out.append(calc)
+
+    calc = pd.concat(out, ignore_index=True) if out else pd.DataFrame(columns=WRITE_COLS)
+    if calc.empty:
+        print("No new rows.")
+    else:
+        print(f"🧾 Upserting {len(calc):,} rows ...")
+        copy_upsert(calc)
+        screener.refresh(calc["symbol"].unique())
+
+    print("✅ Done compute_support_resistance.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+จุดเดียวสำหรับเชื่อมต่อ PostgreSQL (psycopg2) ของทุก job
+- ใช้ initialApp.postgresqldb_args (env ที่ไม่ได้ตั้งใช้ค่า default localhost:5432 / stocks / postgres)
+- pool จำกัดขนาด DB_POOL_MAX: connect() ยืม connection ที่เปิดค้างไว้ (ไม่ต้อง handshake/auth ใหม่ทุกครั้ง)
+  ถ้า pool เต็มจะรอจนมีคืน (ไม่ error), connection ที่เสีย (server restart / network หลุด) ถูกทิ้งแล้วเปิดใหม่
+- with connect() as conn: commit เมื่อจบ block ปกติ, rollback เมื่อมี exception แล้วคืนเข้า pool
+  (พฤติกรรมเดียวกับ with psycopg2.connect(...) as conn เดิม แต่ไม่ทิ้ง connection ค้าง)
+- connect() ซ้อนใน thread เดียวกัน (เช่น helper ที่เปิด connection เองถูกเรียกระหว่างถือ connection อยู่)
+  ไม่รอ slot ของ pool: ถ้า pool เต็มจะเปิด connection แยกชั่วคราวแล้วปิดเมื่อจบ block (ไม่ deadlock ที่ DB_POOL_MAX)
+- read_frame / iter_frames: อ่านผลใหญ่ผ่าน server-side (named) cursor ทีละ DB_ITERSIZE แถว
+- copy_upsert: เขียน DataFrame ด้วย COPY เข้า temp staging แล้ว merge ด้วย INSERT ... ON CONFLICT ครั้งเดียว
+- process ลูก (ProcessPoolExecutor ใน backtest) สร้าง pool ของตัวเอง ไม่ใช้ socket ร่วมกับ parent
+
+ตัวอย่าง:
+    import db
+    with db.connect() as conn, conn.cursor() as cur:
+        cur.execute("SELECT 1")
+    df = db.read_frame("SELECT * FROM stock_price_history WHERE date >= %s", (start,))
+"""
+
+import os
+import io
+import time
+import atexit
+import threading
+import itertools
+from contextlib import contextmanager
+
+import pandas as pd
+import psycopg2
+from psycopg2 import pool as pg_pool
+from psycopg2 import extensions
+
+import initialApp as cfg
+
+DB_POOL_MIN  = int(os.getenv("DB_POOL_MIN", "1"))
+DB_POOL_MAX  = int(os.getenv("DB_POOL_MAX", "4"))
+DB_ITERSIZE  = int(os.getenv("DB_ITERSIZE", "50000"))   # แถวต่อรอบของ server-side cursor
+
+DEFAULTS = {"host": "localhost", "port": "5432", "database": "stocks", "user": "postgres", "password": "postgres"}
+
+_pool = None
+_pool_pid = None
+_slots = None
+_lock = threading.Lock()
+_cursor_seq = itertools.count()
+_local = threading.local()   # จำนวน connection ที่ thread นี้ถืออยู่ (กัน deadlock เมื่อ connect() ซ้อน)
+
+# ------------------------------------------------
+def conn_args():
+    args = {k: v for k, v in cfg.postgresqldb_args.items() if v}
+    for k, v in DEFAULTS.items():
+        args.setdefault(k, v)
+    # keepalive กัน NAT/router ตัด connection ที่ค้างใน pool ระหว่างขั้นที่คำนวณนาน
+    args.update(keepalives=1, keepalives_idle=30, keepalives_interval=10, keepalives_count=3,
+                application_name=os.getenv("DB_APP_NAME", "thai-stock-screener"))
+    return args
+
+def get_pool():
+    global _pool, _pool_pid, _slots
+    pid = os.getpid()
+    if _pool is None or _pool_pid != pid:
+        with _lock:
+            if _pool is None or _pool_pid != pid:
+                # หลัง fork ห้ามใช้ socket ของ parent → สร้างใหม่ (ไม่ closeall เพราะจะปิด connection ของ parent)
+                _pool = pg_pool.ThreadedConnectionPool(DB_POOL_MIN, DB_POOL_MAX, **conn_args())
+                _pool_pid = pid
+                _slots = threading.BoundedSemaphore(DB_POOL_MAX)
+    return _pool
+
+@contextmanager
+def _transaction(conn):
+    """commit เมื่อสำเร็จ, rollback เมื่อ error; state["broken"] = True ถ้า connection ใช้ต่อไม่ได้"""
+    state = {"broken": False}
+    try:
+        yield state
+        if not conn.closed:
+            conn.commit()
+    except BaseException as e:
+        state["broken"] = conn.closed or isinstance(e, (psycopg2.OperationalError, psycopg2.InterfaceError))
+        if not conn.closed:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                state["broken"] = True
+        raise
+
+@contextmanager
+def connect():
+    """ยืม connection จาก pool: commit เมื่อสำเร็จ, rollback เมื่อ error, คืน pool เสมอ"""
+    p = get_pool()
+    slots = _slots
+    nested = getattr(_local, "depth", 0) > 0
+    if nested and not slots.acquire(blocking=False):
+        # ถือ connection อยู่แล้วและ pool เต็ม: ถ้ารอ slot อาจ deadlock กับ thread อื่นที่รอแบบเดียวกัน
+        conn = psycopg2.connect(**conn_args())
+        _local.depth += 1
+        try:
+            with _transaction(conn):
+                yield conn
+        finally:
+            _local.depth -= 1
+            conn.close()
+        return
+    if not nested:
+        slots.acquire()
+
+    conn = None
+    state = {"broken": False}
+    _local.depth = getattr(_local, "depth", 0) + 1
+    try:
+        conn = p.getconn()
+        if conn.closed:
+            p.putconn(conn, close=True)
+            conn = p.getconn()
+        with _transaction(conn) as state:
+            yield conn
+    finally:
+        _local.depth -= 1
+        if conn is not None:
+            broken = state["broken"]
+            if not broken and not conn.closed and conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+            p.putconn(conn, close=broken or bool(conn.closed))
+        slots.release()
+
+def close_all():
+    global _pool
+    with _lock:
+        if _pool is not None and _pool_pid == os.getpid():
+            _pool.closeall()
+        _pool = None
+
+atexit.register(close_all)
+
+# ------------------------------------------------
+def iter_frames(sql, params=None, itersize=DB_ITERSIZE):
+    """อ่านผล query เป็น DataFrame ทีละก้อน (server-side cursor ไม่โหลดทั้งหมดเข้าหน่วยความจำของ client ครั้งเดียว)"""
+    with connect() as conn, conn.cursor(name=f"db_stream_{next(_cursor_seq)}") as cur:
+        cur.itersize = itersize
+        cur.execute(sql, params)
+        while True:
+            rows = cur.fetchmany(itersize)
+            if not rows:
+                break
+            # coerce_float: NUMERIC (Decimal) → float เหมือน pd.read_sql
+            yield pd.DataFrame.from_records(rows, columns=[d[0] for d in cur.description], coerce_float=True)
+
+def read_frame(sql, params=None, itersize=DB_ITERSIZE):
+    """เหมือน pd.read_sql แต่อ่านผ่าน server-side cursor; ไม่มีแถวจะคืน DataFrame ว่างพร้อมชื่อคอลัมน์"""
+    frames = list(iter_frames(sql, params, itersize))
+    if frames:
+        return pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+    with connect() as conn, conn.cursor() as cur:   # หาชื่อคอลัมน์จาก query เดิมแบบไม่มีแถว
+        cur.execute(f"SELECT * FROM ({sql.strip().rstrip(';')}) q LIMIT 0", params)
+        return pd.DataFrame(columns=[d[0] for d in cur.description])
+
+def copy_upsert(conn, df, table, cols, key=("symbol", "trade_date"), touch="updated_at"):
+    """เขียน df[cols] ด้วย COPY FROM STDIN (CSV) เข้า temp staging (LIKE table) แล้ว merge ครั้งเดียว คืนจำนวนแถว
+    - key = คอลัมน์ของ ON CONFLICT (อัปเดตคอลัมน์อื่นใน cols); key ว่าง = append อย่างเดียว
+    - touch = คอลัมน์เวลาที่ set now() ตอนอัปเดต (None = ไม่มี)
+    - temp table ไม่เขียน WAL และถูก drop เมื่อ commit (ผู้เรียก commit เองหรือให้ with connect() commit)"""
+    if df.empty:
+        return 0
+    stg = f"stg_{table}"
+    names = ", ".join(cols)
+    merge = f"INSERT INTO {table} ({names}) SELECT {names} FROM {stg}"
+    if key:
+        sets = [f"{c} = EXCLUDED.{c}" for c in cols if c not in key] + ([f"{touch} = now()"] if touch else [])
+        merge += f" ON CONFLICT ({', '.join(key)}) " + (f"DO UPDATE SET {', '.join(sets)}" if sets else "DO NOTHING")
+    buf = io.StringIO()
+    df[cols].to_csv(buf, index=False, header=False, na_rep="")
+    buf.seek(0)
+    t0 = time.time()
+    with conn.cursor() as cur:
+        cur.execute(f"CREATE TEMP TABLE {stg} (LIKE {table} INCLUDING DEFAULTS) ON COMMIT DROP;")
+        cur.copy_expert(f"COPY {stg} ({names}) FROM STDIN WITH (FORMAT csv)", buf)
+        cur.execute(merge + ";")
+        cur.execute(f"DROP TABLE {stg};")   # เรียกซ้ำใน transaction เดียวกันได้
+    dt = max(time.time() - t0, 1e-9)
+    print(f"   COPY+merge {len(df):,} rows in {dt:.2f}s ({len(df)/dt:,.0f} rows/s)")
+    return len(df)
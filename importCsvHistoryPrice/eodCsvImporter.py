@@ -0,0 +1,251 @@
+# import csv ราคา EOD เข้า postgresql แบบ stream ทีละก้อน (ใช้ RAM คงที่ รันบน Pi ได้)
+
+# csv data example
+# TICKER,DTYYYYMMDD,OPEN,HIGH,LOW,CLOSE,VOL
+# SET,19750430,100,100,100,100,163310
+# import to table stock_price_history
+# symbol, date, open, high, low, close, volume
+
+# - อ่านด้วย pd.read_csv(chunksize=...) แล้วทำความสะอาด TICKER/DTYYYYMMDD/VOL แบบ vectorized ทั้งก้อน
+# - แต่ละก้อน COPY เข้า temp staging แล้ว merge เข้า stock_price_history ด้วย INSERT ... ON CONFLICT
+# - บันทึก checkpoint (จำนวนแถวที่ทำแล้ว) ลง stock_price_import_log ใน transaction เดียวกับก้อนนั้น
+#   ถ้าหยุดกลางทาง รันใหม่จะข้ามแถวที่ทำแล้ว (resume) และไฟล์ที่ทำเสร็จแล้วจะถูกข้ามทั้งไฟล์
+# - หลายไฟล์ (directory / glob): parse ใน process pool, process หลักเป็น writer คนเดียวที่ COPY ทีละไฟล์
+#   ไฟล์ใหญ่ (> EOD_PARALLEL_MAX_MB) หรือไฟล์ที่ค้างครึ่งทางจะใช้โหมด stream + resume ตามปกติ
+#
+# usage: python importCsvHistoryPrice/eodCsvImporter.py importCsvHistoryPrice/PriceHistoryEOD1970-2024.csv
+#        python importCsvHistoryPrice/eodCsvImporter.py "importCsvHistoryPrice/daily/*.csv" --workers 4
+#        python importCsvHistoryPrice/eodCsvImporter.py importCsvHistoryPrice/daily/
+
+import io
+import os
+import sys
+import glob
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import pandas as pd
+import psycopg2
+from dotenv import load_dotenv
+load_dotenv()
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))  # db.py อยู่ที่ root ของ repo
+import db
+
+CHUNKSIZE = int(os.getenv("EOD_CHUNKSIZE", "100000"))
+WORKERS   = int(os.getenv("EOD_WORKERS", str(os.cpu_count() or 2)))
+PARALLEL_MAX_MB = float(os.getenv("EOD_PARALLEL_MAX_MB", "50"))  # ไฟล์ใหญ่กว่านี้ไม่ parse ทั้งไฟล์ใน worker (กิน RAM)
+
+CSV_DTYPE = {
+    "TICKER": str,
+    "DTYYYYMMDD": str,
+    "OPEN": str,
+    "HIGH": str,
+    "LOW": str,
+    "CLOSE": str,
+    "VOL": str,
+}
+PRICE_COLS = ["symbol", "date", "open", "high", "low", "close", "volume"]
+
+LOG_DDL = """
+CREATE TABLE IF NOT EXISTS stock_price_import_log (
+    file_name   TEXT PRIMARY KEY,
+    file_size   BIGINT,
+    rows_done   BIGINT NOT NULL DEFAULT 0,
+    done        BOOLEAN NOT NULL DEFAULT false,
+    updated_at  TIMESTAMP DEFAULT now()
+);
+"""
+
+STAGING_DDL = """
+CREATE TEMP TABLE stg_price_import (LIKE stock_price_history INCLUDING DEFAULTS) ON COMMIT DROP;
+"""
+
+MERGE_SQL = """
+INSERT INTO stock_price_history (symbol, date, open, high, low, close, volume)
+SELECT symbol, date, open, high, low, close, volume FROM stg_price_import
+ON CONFLICT (symbol, date) DO UPDATE SET
+  open   = EXCLUDED.open,
+  high   = EXCLUDED.high,
+  low    = EXCLUDED.low,
+  close  = EXCLUDED.close,
+  volume = EXCLUDED.volume;
+"""
+
+CHECKPOINT_SQL = """
+INSERT INTO stock_price_import_log (file_name, file_size, rows_done, done)
+VALUES (%s, %s, %s, %s)
+ON CONFLICT (file_name) DO UPDATE SET
+  file_size = EXCLUDED.file_size,
+  rows_done = EXCLUDED.rows_done,
+  done      = EXCLUDED.done,
+  updated_at = now();
+"""
+
+
+def ensure_log_table(conn):
+    with conn.cursor() as cur:
+        cur.execute(LOG_DDL)
+    conn.commit()
+
+
+def file_key(path):
+    """key ของไฟล์ใน import log = ชื่อไฟล์ (ไม่รวม path) + ขนาด ถ้าขนาดเปลี่ยนถือเป็นไฟล์ใหม่"""
+    return os.path.basename(path), os.path.getsize(path)
+
+
+def get_checkpoint(conn, path):
+    """คืน (rows_done, done) ของไฟล์นี้ ถ้ายังไม่เคย import หรือขนาดไฟล์เปลี่ยน คืน (0, False)"""
+    name, size = file_key(path)
+    with conn.cursor() as cur:
+        cur.execute("SELECT file_size, rows_done, done FROM stock_price_import_log WHERE file_name = %s;", (name,))
+        row = cur.fetchone()
+    if row is None or row[0] != size:
+        return 0, False
+    return row[1], row[2]
+
+
+def clean_chunk(df):
+    """แปลงก้อน csv ดิบเป็นคอลัมน์ PRICE_COLS ทั้งก้อนในครั้งเดียว (ตัดแถวที่ไม่มี ticker/วันที่)"""
+    out = pd.DataFrame({
+        "symbol": df["TICKER"].str.strip(),
+        "date":   pd.to_datetime(df["DTYYYYMMDD"].str.strip(), format="%Y%m%d", errors="coerce").dt.date,
+    })
+    for src, dst in (("OPEN", "open"), ("HIGH", "high"), ("LOW", "low"), ("CLOSE", "close")):
+        out[dst] = pd.to_numeric(df[src], errors="coerce")
+    out["volume"] = pd.to_numeric(df["VOL"], errors="coerce").fillna(0).round().astype("int64")
+    out = out[out["symbol"].notna() & (out["symbol"] != "") & out["date"].notna()]
+    # ON CONFLICT แก้แถวเดียวกันซ้ำในคำสั่งเดียวไม่ได้ → ตัดแถวซ้ำในก้อนก่อน
+    return out.drop_duplicates(["symbol", "date"], keep="last")
+
+
+def parse_file(path, chunksize=CHUNKSIZE, skip_rows=0):
+    """generator: อ่านไฟล์ทีละก้อน คืน (จำนวนแถวดิบในก้อน, DataFrame ที่ทำความสะอาดแล้ว)"""
+    reader = pd.read_csv(path, dtype=CSV_DTYPE, na_values=['', 'NA'], keep_default_na=False,
+                         chunksize=chunksize, skiprows=range(1, skip_rows + 1))
+    for raw in reader:
+        yield len(raw), clean_chunk(raw)
+
+
+def copy_chunk(conn, df, path=None, rows_done=None, done=False):
+    """COPY ก้อนเข้า staging แล้ว merge; ถ้าส่ง path มาจะบันทึก checkpoint ใน transaction เดียวกัน"""
+    buf = io.StringIO()
+    df[PRICE_COLS].to_csv(buf, index=False, header=False, na_rep="")
+    buf.seek(0)
+    with conn.cursor() as cur:
+        cur.execute(STAGING_DDL)
+        cur.copy_expert(f"COPY stg_price_import ({', '.join(PRICE_COLS)}) FROM STDIN WITH (FORMAT csv)", buf)
+        cur.execute(MERGE_SQL)
+        if path is not None:
+            name, size = file_key(path)
+            cur.execute(CHECKPOINT_SQL, (name, size, rows_done, done))
+    conn.commit()
+
+
+def mark_done(conn, path, rows_done):
+    name, size = file_key(path)
+    with conn.cursor() as cur:
+        cur.execute(CHECKPOINT_SQL, (name, size, rows_done, True))
+    conn.commit()
+
+
+def import_csv(path, conn=None, chunksize=CHUNKSIZE):
+    """import ไฟล์เดียวแบบ stream + resume คืนจำนวนแถวที่เขียน (ไม่ส่ง conn = ยืมจาก db.connect())"""
+    if conn is None:
+        with db.connect() as conn:
+            return import_csv(path, conn, chunksize)
+    try:
+        ensure_log_table(conn)
+        rows_done, done = get_checkpoint(conn, path)
+        if done:
+            print(f"⏭️  {path} already imported, skip")
+            return 0
+        if rows_done:
+            print(f"↪️  resume {path} from row {rows_done:,}")
+
+        written, start = 0, time.time()
+        for n_raw, df in parse_file(path, chunksize, rows_done):
+            rows_done += n_raw
+            copy_chunk(conn, df, path, rows_done)
+            written += len(df)
+            dt = max(time.time() - start, 1e-9)
+            print(f"   {os.path.basename(path)}: {rows_done:,} rows read, {written:,} written ({written/dt:,.0f} rows/s)")
+        mark_done(conn, path, rows_done)
+        return written
+    except psycopg2.Error as e:
+        print(f"❌ Error importing {path}: {e}")
+        conn.rollback()  # ก้อนที่พังไม่ถูก commit; checkpoint ยังชี้ที่ก้อนก่อนหน้า
+        raise
+
+
+def expand_paths(args):
+    """รับชื่อไฟล์ / directory / glob คืนรายชื่อไฟล์ csv เรียงตามชื่อ (ไม่ซ้ำ)"""
+    paths = []
+    for arg in args:
+        if os.path.isdir(arg):
+            paths.extend(glob.glob(os.path.join(arg, "*.csv")))
+        elif glob.has_magic(arg):
+            paths.extend(glob.glob(arg))
+        else:
+            paths.append(arg)
+    return sorted(set(paths))
+
+
+def parse_whole(path):
+    """(รันใน worker process) parse ทั้งไฟล์ คืน (path, จำนวนแถวดิบ, DataFrame ที่ทำความสะอาดแล้ว)"""
+    frames, n = [], 0
+    for n_raw, df in parse_file(path):
+        n += n_raw
+        frames.append(df)
+    df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=PRICE_COLS)
+    return path, n, df.drop_duplicates(["symbol", "date"], keep="last")
+
+
+def import_many(paths, workers=WORKERS, chunksize=CHUNKSIZE):
+    """import หลายไฟล์: ไฟล์เล็ก parse ขนานใน process pool แล้ว writer connection เดียว COPY ทีละไฟล์
+    ไฟล์ที่ import เสร็จแล้ว (ชื่อ+ขนาดเดิม) ถูกข้าม คืนจำนวนแถวที่เขียนรวม"""
+    with db.connect() as conn:
+        ensure_log_table(conn)
+        small, large = [], []
+        for path in paths:
+            rows_done, done = get_checkpoint(conn, path)
+            if done:
+                print(f"⏭️  {path} already imported, skip")
+            elif rows_done or os.path.getsize(path) > PARALLEL_MAX_MB * 1024 * 1024:
+                large.append(path)
+            else:
+                small.append(path)
+
+        written = 0
+        if small:
+            with ProcessPoolExecutor(max_workers=max(1, workers)) as pool:
+                futures = [pool.submit(parse_whole, p) for p in small]
+                for fut in as_completed(futures):
+                    try:
+                        path, n_raw, df = fut.result()
+                    except Exception as e:
+                        print(f"❌ Error parsing file: {e}")  # ไม่ mark done → รอบหน้าลองใหม่
+                        continue
+                    copy_chunk(conn, df, path, n_raw, done=True)  # ข้อมูล + สถานะ done อยู่ใน transaction เดียวกัน
+                    written += len(df)
+                    print(f"   {os.path.basename(path)}: {len(df):,} rows")
+        for path in large:
+            written += import_csv(path, conn, chunksize)
+        return written
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="stream import EOD csv into stock_price_history")
+    ap.add_argument("paths", nargs="+", help="ไฟล์ csv, directory หรือ glob")
+    ap.add_argument("--chunksize", type=int, default=CHUNKSIZE)
+    ap.add_argument("--workers", type=int, default=WORKERS)
+    args = ap.parse_args(argv)
+
+    stratTime = time.time()
+    paths = expand_paths(args.paths)
+    written = import_many(paths, args.workers, args.chunksize)
+    print(f"End process, {len(paths)} files, {written:,} rows, using {time.time() - stratTime:.1f} seconds")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
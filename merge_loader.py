@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+โหลดผล scrape เข้าตารางแบบ merge (แทน DELETE ทั้งตาราง + COPY ใหม่)
+- hash ต่อแถว (ไม่รวมคอลัมน์ใน ignore เช่น import_datetime) เทียบกับ row_hash ที่เก็บไว้
+  → INSERT เฉพาะ key ใหม่, UPDATE เฉพาะแถวที่ hash เปลี่ยน, แถวที่ไม่เปลี่ยนไม่ถูกแตะ (ไม่มี dead tuple)
+- key ที่หายไปจาก scrape = soft delete: ย้ายแถวไปเก็บใน <table>_delisted (พร้อม delisted_at)
+  ตารางหลักจึงมีแต่ symbol ที่ยัง active ผู้อ่านเดิม (SELECT DISTINCT symbol FROM settrade_stocklist) ไม่ต้องแก้
+- บันทึก LISTED / DELISTED ลง stock_listing_event
+- ทุกขั้นอยู่ใน transaction เดียว: scrape พัง/รันล้มกลางทาง ตารางยังเป็นชุดเดิมครบ
+- ถ้า scrape ได้แถวน้อยกว่า MERGE_MIN_KEEP_RATIO ของแถวเดิม จะไม่ delist (กันหน้าเว็บโหลดไม่ครบ)
+- คอลัมน์ใหม่ใน df ที่ตารางยังไม่มี (เช่น industry / sector / security_type จาก symbol_list_fetcher)
+  ถูกเพิ่มด้วย ALTER TABLE ... ADD COLUMN IF NOT EXISTS ทั้งตารางหลักและ <table>_delisted
+
+ตัวอย่าง:
+    import merge_loader
+    merge_loader.merge_frame(df, "settrade_stocklist", key="symbol")
+"""
+
+import os
+import io
+import re
+import pandas as pd
+import db
+from psycopg2 import sql
+from dotenv import load_dotenv
+
+load_dotenv()
+
+MERGE_MIN_KEEP_RATIO = float(os.getenv("MERGE_MIN_KEEP_RATIO", "0.5"))
+EVENT_TABLE = "stock_listing_event"
+
+EVENT_DDL = f"""
+CREATE TABLE IF NOT EXISTS {EVENT_TABLE} (
+    id          BIGSERIAL PRIMARY KEY,
+    source      TEXT NOT NULL,
+    symbol      TEXT NOT NULL,
+    event       TEXT NOT NULL,          -- LISTED / DELISTED
+    event_at    TIMESTAMP DEFAULT now()
+);
+CREATE INDEX IF NOT EXISTS ix_{EVENT_TABLE}_symbol ON {EVENT_TABLE}(symbol, event_at);
+"""
+
+META_COLS = ["row_hash", "first_seen", "updated_at"]
+
+# ------------------------------------------------
+def _norm(name):
+    return re.sub(r"[^0-9a-z]", "", str(name).lower())
+
+def row_hashes(df, ignore=()):
+    """hash ของค่าในแถว (เป็น string ก่อน เพื่อไม่ให้ dtype int/float ที่เปลี่ยนระหว่างรอบทำให้ hash เปลี่ยน)"""
+    cols = [c for c in df.columns if c not in set(ignore)]
+    as_text = pd.DataFrame(index=df.index)
+    for c in cols:
+        s = df[c]
+        if pd.api.types.is_numeric_dtype(s) and not pd.api.types.is_bool_dtype(s):
+            s = s.astype(float).map("{:.10g}".format)   # 5 กับ 5.0 ได้ข้อความเดียวกัน
+        as_text[c] = s.astype(object).where(df[c].notna(), "").astype(str)
+    return pd.util.hash_pandas_object(as_text, index=False).map("{:016x}".format)
+
+def table_columns(cur, table):
+    cur.execute("""
+        SELECT column_name FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = %s ORDER BY ordinal_position;
+    """, (table,))
+    return [r[0] for r in cur.fetchall()]
+
+def map_columns(df_cols, tbl_cols):
+    """จับคู่ชื่อคอลัมน์ DataFrame กับคอลัมน์จริงในตาราง (ไม่สนตัวพิมพ์/สัญลักษณ์ เช่น 'P/E' ↔ 'p/e' หรือ 'p_e')"""
+    by_norm = {_norm(c): c for c in tbl_cols}
+    return {c: by_norm[_norm(c)] for c in df_cols if _norm(c) in by_norm}
+
+def column_name(name):
+    """ชื่อคอลัมน์ใหม่ใน Postgres: ตัวเล็ก + ตัวอักษรอื่นเป็น _ ('P/E' → 'p_e', 'securityType' → 'securitytype')"""
+    return re.sub(r"[^0-9a-z]+", "_", str(name).lower()).strip("_") or "col"
+
+def column_type(s):
+    if pd.api.types.is_bool_dtype(s):
+        return "BOOLEAN"
+    if pd.api.types.is_numeric_dtype(s):
+        return "DOUBLE PRECISION"
+    return "TEXT"
+
+def add_columns(cur, table, df, cols):
+    """เพิ่มคอลัมน์ของ df ที่ตารางยังไม่มี (ทั้งตารางหลักและ archive) คืนชื่อคอลัมน์ที่เพิ่ม"""
+    added = []
+    for c in cols:
+        name = column_name(c)
+        for t in (table, f"{table}_delisted"):
+            cur.execute(sql.SQL("ALTER TABLE {t} ADD COLUMN IF NOT EXISTS {c} " + column_type(df[c]) + ";").format(
+                t=sql.Identifier(t), c=sql.Identifier(name)))
+        added.append(name)
+    return added
+
+def ensure_meta(cur, table):
+    t = sql.Identifier(table)
+    cur.execute(EVENT_DDL)
+    cur.execute(sql.SQL("""
+        ALTER TABLE {t} ADD COLUMN IF NOT EXISTS row_hash TEXT;
+        ALTER TABLE {t} ADD COLUMN IF NOT EXISTS first_seen TIMESTAMP DEFAULT now();
+        ALTER TABLE {t} ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT now();
+        CREATE TABLE IF NOT EXISTS {arc} (LIKE {t});
+        ALTER TABLE {arc} ADD COLUMN IF NOT EXISTS delisted_at TIMESTAMP DEFAULT now();
+    """).format(t=t, arc=sql.Identifier(f"{table}_delisted")))
+
+# ------------------------------------------------
+def merge_frame(df, table, key, ignore=("import_datetime",), source=None, new_columns=True):
+    """merge df (ผล scrape ทั้งชุด) เข้า table โดยใช้ key เป็นคอลัมน์ symbol
+    ตารางต้องถูกสร้างไว้แล้ว (เช่น fPgSql.generate_create_table_script) คืน dict จำนวน inserted/updated/delisted/unchanged
+    new_columns=False จะข้ามคอลัมน์ที่ตารางไม่มีแทนการเพิ่มคอลัมน์"""
+    source = source or table
+    df = df[df[key].notna()].copy()
+    df[key] = df[key].astype(str).str.strip()
+    df = df[df[key] != ""].drop_duplicates(key)
+
+    with db.connect() as conn, conn.cursor() as cur:
+        ensure_meta(cur, table)
+        tbl_cols = table_columns(cur, table)
+        colmap = map_columns(df.columns, [c for c in tbl_cols if c not in META_COLS])
+        if key not in colmap:
+            raise ValueError(f"Key column {key!r} not found in {table} (columns: {tbl_cols})")
+        missing = [c for c in df.columns if c not in colmap]
+        if missing and new_columns:
+            print(f"➕ {table}: add columns {add_columns(cur, table, df, missing)}")
+            tbl_cols = table_columns(cur, table)
+            colmap = map_columns(df.columns, [c for c in tbl_cols if c not in META_COLS])
+        elif missing:
+            print(f"⚠️ {table}: ignore columns not in table {missing}")
+
+        data = df[list(colmap)].copy()
+        data["row_hash"] = row_hashes(data, ignore)
+        cols = [colmap[c] for c in colmap] + ["row_hash"]
+        k = sql.Identifier(colmap[key])
+        t, arc = sql.Identifier(table), sql.Identifier(f"{table}_delisted")
+        ident = sql.SQL(", ").join(map(sql.Identifier, cols))
+        set_cols = sql.SQL(", ").join(
+            sql.SQL("{c} = s.{c}").format(c=sql.Identifier(c)) for c in cols if c != colmap[key])
+
+        buf = io.StringIO()
+        data.to_csv(buf, index=False, header=False, na_rep="")
+        buf.seek(0)
+        cur.execute(sql.SQL("CREATE TEMP TABLE stg_merge (LIKE {t}) ON COMMIT DROP;").format(t=t))
+        cur.copy_expert(sql.SQL("COPY stg_merge ({c}) FROM STDIN WITH (FORMAT csv)").format(c=ident).as_string(cur), buf)
+        cur.execute("ANALYZE stg_merge;")
+
+        # UPDATE เฉพาะแถวที่ hash เปลี่ยน (แถวเดิมก่อนมี row_hash ถูก update หนึ่งครั้ง)
+        cur.execute(sql.SQL("""
+            UPDATE {t} AS d SET {set_cols}, updated_at = now()
+            FROM stg_merge s
+            WHERE d.{k} = s.{k} AND d.row_hash IS DISTINCT FROM s.row_hash;
+        """).format(t=t, set_cols=set_cols, k=k))
+        updated = cur.rowcount
+
+        cur.execute(sql.SQL("""
+            WITH ins AS (
+                INSERT INTO {t} ({c})
+                SELECT {c} FROM stg_merge s
+                WHERE NOT EXISTS (SELECT 1 FROM {t} d WHERE d.{k} = s.{k})
+                RETURNING {k}
+            )
+            INSERT INTO {ev} (source, symbol, event) SELECT %s, {k}, 'LISTED' FROM ins;
+        """).format(t=t, c=ident, k=k, ev=sql.Identifier(EVENT_TABLE)), (source,))
+        inserted = cur.rowcount
+
+        # soft delete: key ที่ไม่อยู่ใน scrape รอบนี้ย้ายไป <table>_delisted
+        cur.execute(sql.SQL("SELECT count(*) FROM {t};").format(t=t))
+        total = cur.fetchone()[0]
+        delisted = 0
+        if len(data) >= MERGE_MIN_KEEP_RATIO * (total - inserted):
+            arc_cols = set(table_columns(cur, f"{table}_delisted"))
+            keep = sql.SQL(", ").join(sql.Identifier(c) for c in tbl_cols if c in arc_cols)
+            cur.execute(sql.SQL("""
+                WITH gone AS (
+                    DELETE FROM {t} d
+                    WHERE NOT EXISTS (SELECT 1 FROM stg_merge s WHERE s.{k} = d.{k})
+                    RETURNING d.*
+                ), arc AS (
+                    INSERT INTO {arc} ({keep}, delisted_at) SELECT {keep}, now() FROM gone
+                )
+                INSERT INTO {ev} (source, symbol, event) SELECT %s, {k}, 'DELISTED' FROM gone;
+            """).format(t=t, k=k, arc=arc, keep=keep, ev=sql.Identifier(EVENT_TABLE)), (source,))
+            delisted = cur.rowcount
+        else:
+            print(f"⚠️ {table}: scrape has only {len(data):,} rows vs {total - inserted:,} existing → skip delisting")
+        conn.commit()
+
+    stats = {"inserted": inserted, "updated": updated, "delisted": delisted,
+             "unchanged": len(data) - inserted - updated}
+    print(f"🔁 {table}: " + ", ".join(f"{k} {v:,}" for k, v in stats.items()))
+    return stats
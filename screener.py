@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+latest_snapshot: 1 แถวต่อ symbol เก็บค่าล่าสุดของ indicator (v4), signal, value score, แนวโน้มพื้นฐานหลายปี, แนวรับ/ต้าน และสภาพคล่อง (compute_liquidity)
+- refresh(symbols) ดึงค่าล่าสุดต่อ symbol ด้วย LATERAL ... ORDER BY date DESC LIMIT 1 (ใช้ PK index ไม่ต้อง GROUP BY/max ทั้งตาราง)
+  และเขียนเฉพาะแถวที่ค่าเปลี่ยน, ถูกเรียกต่อท้าย compute_signals / compute_liquidity / compute_support_resistance / stockScore_siamChart / stockFundamentalHistory_siamChart
+  ลบแถวของ symbol ที่ไม่อยู่ใน settrade_stocklist แล้ว, DDL (ALTER ADD COLUMN) รันครั้งเดียวต่อ process เมื่อคอลัมน์ยังไม่ครบ
+- screen(...) API กรอง/เรียงจาก latest_snapshot ตรง ๆ (หลัก ms)
+
+ตัวอย่าง:
+    import screener
+    screener.screen(trend_status="uptrend", macd_hist__gt=0, value_score__gte=0.6, order_by="-macd_hist", limit=20)
+
+    python screener.py --refresh
+    python screener.py trend_status=uptrend macd_hist__gt=0 --order -macd_hist --limit 20
+"""
+
+import os
+import re
+import argparse
+import pandas as pd
+import db
+from dotenv import load_dotenv
+
+load_dotenv()
+
+IND_COLS = ["ema5", "ema10", "ema20", "ema50", "ema200", "rsi14", "rsi21", "macd", "macd_signal", "macd_hist",
+            "macd_19_39_9_hist", "volume_avg20", "vol_ema10", "vol_ema20", "vol_ema50", "trend_status"]
+
+# คอลัมน์ของ latest_snapshot: (ชื่อ, type, SQL expression จาก LATERAL alias p=ราคา, i=indicator, g=signal, v=value score, f=แนวโน้มพื้นฐานหลายปี, r=S/R, l=สภาพคล่อง)
+SNAPSHOT_SPEC = [
+    ("trade_date",          "DATE",           "p.date"),
+    ("close",               "NUMERIC(18,6)",  "p.close"),
+    ("volume",              "NUMERIC(20,2)",  "p.volume"),
+    ("turnover",            "NUMERIC(20,2)",  "p.close * p.volume"),
+    ("turnover_avg20",      "NUMERIC(20,2)",  "l.turnover_avg20"),
+    ("range_ticks",         "NUMERIC(18,2)",  "l.range_ticks"),
+    ("zero_volume_days",    "INT",            "l.zero_volume_days"),
+    ("tradable",            "BOOLEAN",        "l.tradable"),
+    ("indicator_date",      "DATE",           "i.trade_date"),
+    *[(c, "TEXT" if c == "trend_status" else "NUMERIC(18,6)", f"i.{c}") for c in IND_COLS],
+    ("vol_ema_rising",      "BOOLEAN",        "i.vol_ema10 > i.vol_ema20"),
+    ("signal_date",         "DATE",           "g.trade_date"),
+    ("signal_type",         "TEXT",           "g.signal_type"),
+    ("signal_priority",     "INT",            "g.priority"),
+    ("signal_reason",       "TEXT",           "g.reason"),
+    ("value_score",         "DOUBLE PRECISION", "v.value_score"),
+    ("value_rank",          "INT",            "v.rank"),
+    ("avg_yield_5y",        "REAL",           "f.avg_yield"),
+    ("yield_years",         "INT",            "f.yield_years"),
+    ("dividend_consistency","REAL",           "f.dividend_consistency"),
+    ("eps_slope",           "REAL",           "f.eps_slope"),
+    ("trend_score",         "REAL",           "f.trend_score"),
+    ("support",             "NUMERIC(18,6)",  "r.support"),
+    ("resistance",          "NUMERIC(18,6)",  "r.resistance"),
+    ("dist_support_pct",    "NUMERIC(18,6)",  "r.dist_support_pct"),
+    ("dist_resistance_pct", "NUMERIC(18,6)",  "r.dist_resistance_pct"),
+]
+SNAPSHOT_COLS = ["symbol"] + [c for c, _, _ in SNAPSHOT_SPEC]
+
+DDL = f"""
+CREATE TABLE IF NOT EXISTS latest_snapshot (
+    symbol              TEXT PRIMARY KEY,
+    {"".join(f"{c:<19} {t},{chr(10)}    " for c, t, _ in SNAPSHOT_SPEC)}updated_at          TIMESTAMP DEFAULT now()
+);
+{"".join(f"ALTER TABLE latest_snapshot ADD COLUMN IF NOT EXISTS {c} {t};{chr(10)}" for c, t, _ in SNAPSHOT_SPEC)}CREATE INDEX IF NOT EXISTS ix_latest_snapshot_macd_hist ON latest_snapshot(macd_hist);
+CREATE INDEX IF NOT EXISTS ix_latest_snapshot_value_score ON latest_snapshot(value_score);
+CREATE INDEX IF NOT EXISTS ix_latest_snapshot_signal ON latest_snapshot(signal_type);
+CREATE INDEX IF NOT EXISTS ix_latest_snapshot_turnover ON latest_snapshot(turnover_avg20);
+CREATE INDEX IF NOT EXISTS ix_latest_snapshot_tradable ON latest_snapshot(tradable);
+"""
+
+# LATERAL ต่อแหล่งข้อมูล; ตารางที่ยังไม่ถูกสร้าง (เช่น job ยังไม่เคยรัน) จะใช้ NULL แทน
+SOURCES = {
+    "p": ("stock_price_history", """
+        LEFT JOIN LATERAL (
+            SELECT h.date, h.close, h.volume FROM stock_price_history h
+            WHERE h.symbol = s.symbol ORDER BY h.date DESC LIMIT 1
+        ) p ON true"""),
+    "i": ("stock_indicator_daily_v4", """
+        LEFT JOIN LATERAL (
+            SELECT * FROM stock_indicator_daily_v4 d
+            WHERE d.symbol = s.symbol ORDER BY d.trade_date DESC LIMIT 1
+        ) i ON true"""),
+    "g": ("stock_signal", """
+        LEFT JOIN LATERAL (
+            SELECT trade_date, signal_type, priority, reason FROM stock_signal g
+            WHERE g.symbol = s.symbol ORDER BY g.trade_date DESC LIMIT 1
+        ) g ON true"""),
+    "v": ("stock_value_score", """
+        LEFT JOIN LATERAL (
+            SELECT value_score, rank FROM stock_value_score v
+            WHERE v.name = s.symbol LIMIT 1
+        ) v ON true"""),
+    "f": ("stock_fundamental_trend", """
+        LEFT JOIN LATERAL (
+            SELECT avg_yield, yield_years, dividend_consistency, eps_slope, trend_score FROM stock_fundamental_trend f
+            WHERE f.symbol = s.symbol
+        ) f ON true"""),
+    "r": ("stock_sr_daily", """
+        LEFT JOIN LATERAL (
+            SELECT support, resistance, dist_support_pct, dist_resistance_pct FROM stock_sr_daily d
+            WHERE d.symbol = s.symbol ORDER BY d.trade_date DESC LIMIT 1
+        ) r ON true"""),
+    "l": ("stock_liquidity_daily", """
+        LEFT JOIN LATERAL (
+            SELECT turnover_avg20, range_ticks, zero_volume_days, tradable FROM stock_liquidity_daily d
+            WHERE d.symbol = s.symbol ORDER BY d.trade_date DESC LIMIT 1
+        ) l ON true"""),
+}
+
+OPS = {"eq": "=", "ne": "<>", "gt": ">", "gte": ">=", "lt": "<", "lte": "<="}
+
+# ------------------------------------------------
+_table_ready = False
+
+def ensure_table():
+    """สร้างตาราง/เพิ่มคอลัมน์ครั้งเดียวต่อ process และรัน DDL เฉพาะเมื่อตารางหรือคอลัมน์ยังไม่ครบ
+    (ALTER TABLE ... ADD COLUMN ถือ ACCESS EXCLUSIVE lock แม้คอลัมน์มีอยู่แล้ว จึงไม่รันทุกครั้งที่ refresh)"""
+    global _table_ready
+    if _table_ready:
+        return
+    with db.connect() as conn, conn.cursor() as cur:
+        cur.execute("""
+            SELECT column_name FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = 'latest_snapshot';
+        """)
+        if not set(SNAPSHOT_COLS) <= {r[0] for r in cur.fetchall()}:
+            cur.execute(DDL)
+        conn.commit()
+    _table_ready = True
+
+def existing_tables(cur):
+    cur.execute("SELECT t FROM unnest(%s::text[]) t WHERE to_regclass(t) IS NOT NULL;",
+                ([tbl for tbl, _ in SOURCES.values()],))
+    return {r[0] for r in cur.fetchall()}
+
+def build_refresh_sql(available):
+    """INSERT ... SELECT จาก LATERAL ทุกแหล่ง, เขียนเฉพาะแถวที่มีค่าเปลี่ยน"""
+    joins = "".join(sql for alias, (tbl, sql) in SOURCES.items() if tbl in available)
+    missing = {alias for alias, (tbl, _) in SOURCES.items() if tbl not in available}
+    exprs = ["NULL" if any(re.search(rf"\b{a}\.", expr) for a in missing) else expr for _, _, expr in SNAPSHOT_SPEC]
+    cols = [c for c, _, _ in SNAPSHOT_SPEC]
+    casts = [f"{e}::{t}" if e == "NULL" else e for e, (_, t, _) in zip(exprs, SNAPSHOT_SPEC)]
+    return f"""
+    INSERT INTO latest_snapshot (symbol, {", ".join(cols)})
+    SELECT s.symbol, {", ".join(casts)}
+    FROM unnest(%s::text[]) AS s(symbol)
+    {joins}
+    ON CONFLICT (symbol) DO UPDATE SET
+      {", ".join(f"{c} = EXCLUDED.{c}" for c in cols)},
+      updated_at = now()
+    WHERE ({", ".join(f"latest_snapshot.{c}" for c in cols)})
+          IS DISTINCT FROM ({", ".join(f"EXCLUDED.{c}" for c in cols)});
+    """
+
+def refresh(symbols=None):
+    """อัปเดต latest_snapshot เฉพาะ symbols ที่ระบุ (None = ทุก symbol ใน settrade_stocklist) คืนจำนวนแถวที่เปลี่ยน
+    symbol ที่ไม่อยู่ใน settrade_stocklist แล้ว (ถูกถอนออก) ถูกลบออกจาก latest_snapshot ทุกครั้ง"""
+    ensure_table()
+    with db.connect() as conn, conn.cursor() as cur:
+        cur.execute("SELECT DISTINCT symbol FROM settrade_stocklist WHERE symbol IS NOT NULL;")
+        active = {r[0] for r in cur.fetchall()}
+        removed = 0
+        if active:   # stocklist ว่าง (กำลังโหลดใหม่) → ไม่ลบทั้งตาราง
+            cur.execute("DELETE FROM latest_snapshot WHERE symbol <> ALL(%s);", (sorted(active),))
+            removed = cur.rowcount
+        symbols = sorted(active if symbols is None else {str(s) for s in symbols} & active)
+        n = 0
+        if symbols:
+            cur.execute(build_refresh_sql(existing_tables(cur)), (symbols,))
+            n = cur.rowcount
+        conn.commit()
+    print(f"📸 latest_snapshot: {n:,} / {len(symbols):,} symbols changed" + (f", removed {removed:,} inactive" if removed else ""))
+    return n
+
+# ------------------------------------------------
+def build_query(filters=None, order_by=None, limit=None, columns=None):
+    """filters แบบ column__op=value (op: eq, ne, gt, gte, lt, lte, in, between, isnull) → (sql, params)
+    ชื่อคอลัมน์ต้องอยู่ใน SNAPSHOT_COLS (กัน SQL injection) ค่าเป็น parameter เสมอ"""
+    def col(name):
+        if name not in SNAPSHOT_COLS:
+            raise ValueError(f"unknown snapshot column: {name}")
+        return name
+
+    where, params = [], []
+    for key, val in (filters or {}).items():
+        name, _, op = key.partition("__")
+        name, op = col(name), op or "eq"
+        if op in OPS:
+            where.append(f"{name} {OPS[op]} %s")
+            params.append(val)
+        elif op == "in":
+            where.append(f"{name} = ANY(%s)")
+            params.append(list(val))
+        elif op == "between":
+            where.append(f"{name} BETWEEN %s AND %s")
+            params.extend(val)
+        elif op == "isnull":
+            where.append(f"{name} IS {'' if val else 'NOT '}NULL")
+        else:
+            raise ValueError(f"unknown operator: {op}")
+
+    order = []
+    for o in ([order_by] if isinstance(order_by, str) else (order_by or [])):
+        desc = o.startswith("-")
+        order.append(f"{col(o.lstrip('-'))} {'DESC' if desc else 'ASC'} NULLS LAST")
+
+    sql = f"SELECT {', '.join(col(c) for c in columns) if columns else '*'} FROM latest_snapshot"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    if order:
+        sql += " ORDER BY " + ", ".join(order)
+    if limit:
+        sql += " LIMIT %s"
+        params.append(int(limit))
+    return sql, params
+
+def screen(order_by=None, limit=50, columns=None, **filters):
+    """กรอง/เรียง latest_snapshot คืน DataFrame
+    screen(trend_status="uptrend", macd_hist__gt=0, vol_ema_rising=True, order_by=["-macd_hist", "-turnover_avg20"])"""
+    sql, params = build_query(filters, order_by, limit, columns)
+    with db.connect() as conn:
+        return pd.read_sql(sql, conn, params=params)
+
+# ------------------------------------------------
+def parse_filter(text):
+    """'macd_hist__gt=0' → ('macd_hist__gt', 0.0); ค่าที่มี , จะเป็น list (ใช้กับ __in / __between)"""
+    key, _, raw = text.partition("=")
+
+    def conv(v):
+        if v.lower() in ("true", "false"):
+            return v.lower() == "true"
+        try:
+            return float(v)
+        except ValueError:
+            return v
+
+    return key, [conv(v) for v in raw.split(",")] if "," in raw else conv(raw)
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Screener จาก latest_snapshot")
+    ap.add_argument("filters", nargs="*", help="เช่น trend_status=uptrend macd_hist__gt=0 value_score__gte=0.6")
+    ap.add_argument("--order", action="append", help="คอลัมน์เรียง ใส่ - นำหน้าเพื่อเรียงมากไปน้อย (ใส่ได้หลายครั้ง)")
+    ap.add_argument("--limit", type=int, default=50)
+    ap.add_argument("--refresh", action="store_true", help="refresh latest_snapshot ทุก symbol ก่อน")
+    args = ap.parse_args(argv)
+
+    if args.refresh:
+        refresh()
+    if args.filters or args.order or not args.refresh:
+        df = screen(order_by=args.order, limit=args.limit, **dict(parse_filter(f) for f in args.filters))
+        with pd.option_context("display.max_rows", 500, "display.width", 250):
+            print(df.to_string(index=False))
+
+if __name__ == "__main__":
+    main()
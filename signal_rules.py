@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Rule engine สำหรับ compute_signals
+- ประกาศสัญญาณเป็น expression บนคอลัมน์ indicator เช่น "ema20 > ema50 and cross_up(macd, macd_signal) and rsi14 > 45"
+- compile ครั้งเดียว (parse ด้วย ast, ตรวจว่าใช้ได้เฉพาะคอลัมน์/ฟังก์ชันที่อนุญาต, แปลง and/or/not เป็น & | ~)
+  แล้วประเมินเป็น mask ของ numpy ทั้งเฟรม (ทุก symbol ทุกวัน) ในครั้งเดียว
+- ฟังก์ชันที่ใช้ได้: cross_up(a, b), cross_down(a, b), prev(x[, n]), abs(x)  (prev/cross ดูแถวก่อนหน้าของ symbol เดียวกัน)
+- เลือกสัญญาณต่อแถว: rule ที่ priority สูงกว่าชนะ ถ้าเท่ากันใช้ลำดับที่ประกาศ ไม่เข้าเงื่อนไขใดเลยใช้ default
+"""
+
+import ast
+from functools import reduce
+import numpy as np
+import pandas as pd
+
+# กฎเดิมของ compute_signals (ผลเหมือนเดิมทุกแถว)
+BASE_RULES = [
+    {"signal": "BUY",        "priority": 3, "when": "ema20 > ema50 and cross_up(macd, macd_signal) and rsi14 > 45",
+     "reason": "EMA20>EMA50 & MACD↑ & RSI>45"},        # แนวโน้มขาขึ้น + MACD ตัดขึ้น + RSI ไม่ต่ำเกิน
+    {"signal": "BUY-WATCH",  "priority": 2, "when": "ema20 > ema50 and rsi14 < 40",
+     "reason": "EMA20>EMA50 & RSI<40 (pullback)"},     # แนวโน้มขาขึ้น แต่ RSI ต่ำ
+    {"signal": "SELL",       "priority": 3, "when": "ema20 < ema50 and cross_down(macd, macd_signal) and rsi14 < 55",
+     "reason": "EMA20<EMA50 & MACD↓ & RSI<55"},        # แนวโน้มขาลง + MACD ตัดลง + RSI ไม่สูงเกิน
+    {"signal": "SELL-WATCH", "priority": 2, "when": "ema20 < ema50 and rsi14 > 60",
+     "reason": "EMA20<EMA50 & RSI>60 (bounce)"},       # แนวโน้มขาลง แต่ RSI สูง
+    {"signal": "SIDEWAY",    "priority": 1, "when": "abs(ema20 - ema50) / ema50 < 0.01 and 40 <= rsi14 <= 60",
+     "reason": "EMA20≈EMA50 & RSI neutral"},           # แนวโน้มแกว่งตัว
+]
+BASE_DEFAULT  = {"signal": "HOLD", "priority": 0, "reason": "No signal change"}  # ถือสถานะเดิม
+BASE_REQUIRED = ["ema20", "ema50", "rsi14", "macd_signal"]  # แถวที่ค่าเหล่านี้เป็น NaN จะไม่ออกสัญญาณ
+
+# กลยุทธ์เพิ่มเติม (ต้องใช้คอลัมน์ของ stock_indicator_daily_v4)
+EXTENDED_RULES = BASE_RULES + [
+    {"signal": "BUY",        "priority": 3, "when": "ema50 > ema200 and cross_up(macd_19_39_9, macd_19_39_9_signal)",
+     "reason": "EMA50>EMA200 & MACD(19,39,9)↑"},
+    {"signal": "SELL",       "priority": 3, "when": "ema50 < ema200 and cross_down(macd_19_39_9, macd_19_39_9_signal)",
+     "reason": "EMA50<EMA200 & MACD(19,39,9)↓"},
+    {"signal": "BUY-WATCH",  "priority": 2, "when": "cross_up(ema5, ema10) and ema20 > ema50",
+     "reason": "EMA5 ตัดขึ้น EMA10 ในขาขึ้น"},
+    {"signal": "SELL-WATCH", "priority": 2, "when": "cross_down(ema5, ema10) and ema20 < ema50",
+     "reason": "EMA5 ตัดลง EMA10 ในขาลง"},
+    {"signal": "BUY-WATCH",  "priority": 1, "when": "vol_ema10 > vol_ema50 and vol_ema10 > prev(vol_ema10) and macd_hist > 0",
+     "reason": "Volume EMA10>EMA50 กำลังเพิ่ม & MACD hist > 0"},
+]
+
+RULESETS = {
+    "base":     (BASE_RULES, BASE_DEFAULT, BASE_REQUIRED),
+    "extended": (EXTENDED_RULES, BASE_DEFAULT, BASE_REQUIRED),
+}
+
+FUNCS = {"cross_up", "cross_down", "prev", "abs"}
+_ALLOWED_NODES = (
+    ast.Expression, ast.BoolOp, ast.And, ast.Or, ast.UnaryOp, ast.Not, ast.USub, ast.UAdd,
+    ast.BinOp, ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Compare, ast.Gt, ast.GtE, ast.Lt, ast.LtE,
+    ast.Eq, ast.NotEq, ast.Name, ast.Load, ast.Constant, ast.Call,
+)
+
+
+class _ToNumpy(ast.NodeTransformer):
+    """and/or/not → & | ~ และแตก a <= x <= b เป็น (a <= x) & (x <= b) ให้ใช้กับ array ได้"""
+
+    def visit_BoolOp(self, node):
+        self.generic_visit(node)
+        op = ast.BitAnd() if isinstance(node.op, ast.And) else ast.BitOr()
+        return reduce(lambda a, b: ast.BinOp(a, op, b), node.values)
+
+    def visit_UnaryOp(self, node):
+        self.generic_visit(node)
+        if isinstance(node.op, ast.Not):
+            return ast.UnaryOp(ast.Invert(), node.operand)
+        return node
+
+    def visit_Compare(self, node):
+        self.generic_visit(node)
+        if len(node.ops) == 1:
+            return node
+        parts, left = [], node.left
+        for op, right in zip(node.ops, node.comparators):
+            parts.append(ast.Compare(left, [op], [right]))
+            left = right
+        return reduce(lambda a, b: ast.BinOp(a, ast.BitAnd(), b), parts)
+
+
+def compile_expr(expr):
+    """compile expression เป็น (code object, ชุดคอลัมน์ที่ใช้) ตรวจ syntax/ชื่อที่ไม่อนุญาตตั้งแต่ตอน compile"""
+    tree = ast.parse(expr, mode="eval")
+    columns = set()
+    for node in ast.walk(tree):
+        if not isinstance(node, _ALLOWED_NODES):
+            raise ValueError(f"unsupported syntax {type(node).__name__} in rule: {expr}")
+        if isinstance(node, ast.Call):
+            if not isinstance(node.func, ast.Name) or node.func.id not in FUNCS or node.keywords:
+                raise ValueError(f"unsupported function call in rule: {expr}")
+        elif isinstance(node, ast.Name) and node.id not in FUNCS:
+            columns.add(node.id)
+    tree = ast.fix_missing_locations(_ToNumpy().visit(tree))
+    return compile(tree, f"<rule: {expr}>", "eval"), columns
+
+
+class CompiledRules:
+    """ชุดกฎที่ compile แล้ว ใช้ซ้ำได้กับหลายเฟรม"""
+
+    def __init__(self, rules, default=BASE_DEFAULT, required=()):
+        self.rules = list(rules)
+        self.default = default
+        self.required = list(required)
+        self.codes = []
+        self.columns = set(self.required)
+        for r in self.rules:
+            code, cols = compile_expr(r["when"])
+            self.codes.append(code)
+            self.columns |= cols
+        # priority สูงชนะ, เท่ากันใช้ลำดับที่ประกาศ
+        self.order = sorted(range(len(self.rules)), key=lambda i: -self.rules[i]["priority"])
+
+    def _namespace(self, d):
+        missing = self.columns - set(d.columns)
+        if missing:
+            raise KeyError(f"indicator columns missing for rules: {sorted(missing)}")
+        pos = d.groupby("symbol").cumcount().to_numpy()
+
+        def prev(x, n=1):
+            out = np.roll(np.asarray(x, dtype=float), n)
+            out[pos < n] = np.nan  # แถวแรก ๆ ของแต่ละ symbol ไม่มีแถวก่อนหน้า
+            return out
+
+        ns = {
+            "prev": prev,
+            "abs": np.abs,
+            "cross_up":   lambda a, b: (prev(a) < prev(b)) & (a > b),
+            "cross_down": lambda a, b: (prev(a) > prev(b)) & (a < b),
+        }
+        for c in self.columns:
+            s = d[c]
+            ns[c] = s.to_numpy(dtype=float, na_value=np.nan) if pd.api.types.is_numeric_dtype(s) else s.to_numpy(dtype=object)
+        return ns
+
+    def masks(self, df):
+        """ประเมินทุกกฎ คืน (เฟรมที่เรียง symbol/trade_date แล้ว, bool matrix [n_rows, n_rules])"""
+        d = df.sort_values(["symbol", "trade_date"]).reset_index(drop=True)
+        ns = self._namespace(d)
+        out = np.zeros((len(d), len(self.rules)), dtype=bool)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            for j, code in enumerate(self.codes):
+                out[:, j] = np.broadcast_to(np.asarray(eval(code, {"__builtins__": {}}, ns), dtype=bool), len(d))
+        return d, out
+
+    def evaluate(self, df):
+        """เลือกสัญญาณต่อแถว คืน DataFrame [symbol, trade_date, signal_type, priority, reason] (ตัดแถวที่ขาด required)"""
+        d, m = self.masks(df)
+        table = [self.rules[i] for i in self.order] + [self.default]
+        idx = np.select([m[:, i] for i in self.order], list(range(len(self.order))), default=len(self.order))
+        out = d[["symbol", "trade_date"]].copy()
+        out["signal_type"] = [table[k]["signal"] for k in idx]
+        out["priority"] = [table[k]["priority"] for k in idx]
+        out["reason"] = [table[k]["reason"] for k in idx]
+        ok = ~d[self.required].isna().any(axis=1).to_numpy() if self.required else np.ones(len(d), dtype=bool)
+        return out[ok].reset_index(drop=True)
+
+
+def load_ruleset(name="base"):
+    rules, default, required = RULESETS[name]
+    return CompiledRules(rules, default, required)
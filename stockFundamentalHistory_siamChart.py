@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ประวัติงบ/อัตราส่วนจาก siamchart แบบ append-only + คะแนนแนวโน้มหลายปี
+- stock_list_info_siamchart เก็บแค่ค่าล่าสุดต่อหุ้น (merge ทับทุกรอบ)
+  → เก็บสำเนาแต่ละรอบลง stock_fundamental_history (PK symbol, snapshot_date) แบ่ง partition รายปีตาม snapshot_date
+  คอลัมน์เป็นตัวเลขชนิด REAL/SMALLINT ทั้งหมด (ไม่เก็บ text ดิบ) ขนาดเล็กและ scan เร็ว
+- รันซ้ำวันเดิมไม่เพิ่มแถวซ้ำ (ON CONFLICT DO NOTHING)
+- score_history(): SQL เดียว เฉลี่ยรายปี → รวมหลายปีต่อ symbol (ค่าเฉลี่ย, ต่ำสุด, ความสม่ำเสมอ, slope ของ EPS)
+  แล้วจัดอันดับด้วย percent_rank เป็น trend_score เขียนลง stock_fundamental_trend
+  ใช้ screen เช่น "ปันผล >= 3% ทุกปีใน 5 ปี" ได้โดยไม่ต้อง scrape ย้อนหลัง
+"""
+
+import os
+import io
+from datetime import date
+import pandas as pd
+import db
+from dotenv import load_dotenv
+
+import screener
+
+load_dotenv()
+
+SRC_TABLE   = "stock_list_info_siamchart"
+HIST_TABLE  = "stock_fundamental_history"
+TREND_TABLE = "stock_fundamental_trend"
+FH_YEARS     = int(os.getenv("FH_YEARS", "5"))
+FH_MIN_YIELD = float(os.getenv("FH_MIN_YIELD", "3"))   # Yield% ขั้นต่ำต่อปีที่นับเป็น "ปีที่ปันผลดี"
+
+# คอลัมน์ปลายทาง: (ชนิด, ชื่อคอลัมน์ที่อาจเจอในหน้า siamchart หลัง lower())
+FIELDS = {
+    "last_price": ("REAL",     ["last"]),
+    "mcap_m":     ("REAL",     ["mcap (m)", "mcap"]),
+    "pe":         ("REAL",     ["p/e", "pe"]),
+    "pbv":        ("REAL",     ["p/bv", "pbv"]),
+    "de":         ("REAL",     ["d/e", "de"]),
+    "dps":        ("REAL",     ["dps"]),
+    "eps":        ("REAL",     ["eps"]),
+    "roa":        ("REAL",     ["roa%", "roa"]),
+    "roe":        ("REAL",     ["roe%", "roe"]),
+    "npm":        ("REAL",     ["npm%", "npm"]),
+    "yield_pct":  ("REAL",     ["yield%", "yield"]),
+    "ffloat_pct": ("REAL",     ["ffloat%", "ffloat"]),
+    "mg_pct":     ("REAL",     ["mg%", "mg"]),
+    "magic1":     ("REAL",     ["magic1"]),
+    "magic2":     ("REAL",     ["magic2"]),
+    "peg":        ("REAL",     ["peg"]),
+    "cg":         ("SMALLINT", ["cg"]),
+}
+HIST_COLS = ["symbol", "snapshot_date"] + list(FIELDS)
+
+HIST_DDL = f"""
+CREATE TABLE IF NOT EXISTS {HIST_TABLE} (
+    symbol          TEXT NOT NULL,
+    snapshot_date   DATE NOT NULL,
+    {"".join(f"{c:<16}{t},{chr(10)}    " for c, (t, _) in FIELDS.items())}PRIMARY KEY(symbol, snapshot_date)
+) PARTITION BY RANGE (snapshot_date);
+"""
+
+TREND_DDL = f"""
+CREATE TABLE IF NOT EXISTS {TREND_TABLE} (
+    symbol               TEXT PRIMARY KEY,
+    years                INT,
+    avg_yield            REAL,
+    min_yield            REAL,
+    yield_years          INT,
+    dividend_consistency REAL,
+    avg_dps              REAL,
+    avg_roe              REAL,
+    min_roe              REAL,
+    roe_stddev           REAL,
+    avg_npm              REAL,
+    avg_eps              REAL,
+    eps_slope            REAL,
+    eps_positive_years   INT,
+    eps_consistency      REAL,
+    avg_pe               REAL,
+    trend_score          REAL,
+    first_snapshot       DATE,
+    last_snapshot        DATE,
+    updated_at           TIMESTAMP DEFAULT now()
+);
+CREATE INDEX IF NOT EXISTS ix_{TREND_TABLE}_score ON {TREND_TABLE}(trend_score);
+"""
+
+# เฉลี่ยรายปีก่อน (snapshot รายเดือนไม่ทำให้ปีที่เก็บถี่กว่าได้น้ำหนักมากกว่า) แล้วรวมหลายปีต่อ symbol ในคิวรีเดียว
+SCORE_SQL = f"""
+WITH yearly AS (
+    SELECT symbol, date_part('year', snapshot_date)::int AS yr,
+           avg(yield_pct) AS yield_pct, avg(dps) AS dps, avg(roe) AS roe, avg(npm) AS npm,
+           avg(eps) AS eps, avg(pe) AS pe, min(snapshot_date) AS first_snapshot, max(snapshot_date) AS last_snapshot
+    FROM {HIST_TABLE}
+    WHERE snapshot_date >= %(since)s
+    GROUP BY symbol, yr
+), agg AS (
+    SELECT symbol,
+           count(*)                                              AS years,
+           avg(yield_pct)                                        AS avg_yield,
+           min(yield_pct)                                        AS min_yield,
+           count(*) FILTER (WHERE yield_pct >= %(min_yield)s)    AS yield_years,
+           avg(dps)                                              AS avg_dps,
+           avg(roe)                                              AS avg_roe,
+           min(roe)                                              AS min_roe,
+           stddev_samp(roe)                                      AS roe_stddev,
+           avg(npm)                                              AS avg_npm,
+           avg(eps)                                              AS avg_eps,
+           regr_slope(eps, yr)                                   AS eps_slope,
+           count(*) FILTER (WHERE eps > 0)                       AS eps_positive_years,
+           avg(pe)                                               AS avg_pe,
+           min(first_snapshot)                                   AS first_snapshot,
+           max(last_snapshot)                                    AS last_snapshot
+    FROM yearly
+    GROUP BY symbol
+)
+INSERT INTO {TREND_TABLE} (symbol, years, avg_yield, min_yield, yield_years, dividend_consistency, avg_dps,
+                           avg_roe, min_roe, roe_stddev, avg_npm, avg_eps, eps_slope, eps_positive_years,
+                           eps_consistency, avg_pe, trend_score, first_snapshot, last_snapshot)
+SELECT symbol, years, avg_yield, min_yield, yield_years, yield_years::real / years, avg_dps,
+       avg_roe, min_roe, roe_stddev, avg_npm, avg_eps, eps_slope, eps_positive_years,
+       eps_positive_years::real / years, avg_pe,
+       ( percent_rank() OVER (ORDER BY avg_yield NULLS FIRST)
+       + percent_rank() OVER (ORDER BY yield_years)
+       + percent_rank() OVER (ORDER BY avg_roe NULLS FIRST)
+       + percent_rank() OVER (ORDER BY coalesce(roe_stddev, 'Infinity') DESC)   -- ผันผวนน้อย = ดี
+       + percent_rank() OVER (ORDER BY eps_slope NULLS FIRST)
+       + percent_rank() OVER (ORDER BY eps_positive_years) ) / 6,
+       first_snapshot, last_snapshot
+FROM agg;
+"""
+
+# ------------------------------------------------
+def ensure_tables(cur, years=()):
+    cur.execute(HIST_DDL)
+    cur.execute(TREND_DDL)
+    for y in sorted(set(years)):
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS {HIST_TABLE}_{y} PARTITION OF {HIST_TABLE}
+            FOR VALUES FROM ('{y}-01-01') TO ('{y + 1}-01-01');
+        """)
+
+def to_history_frame(df, snapshot_date=None):
+    """แปลงตารางจาก siamchart (ชื่อคอลัมน์ตามหน้าเว็บ) เป็น HIST_COLS ตัวเลขล้วน"""
+    src = df.rename(columns=lambda c: str(c).strip().lower())
+    name_col = next((c for c in ("name", "symbol", "sign") if c in src.columns), None)
+    if name_col is None:
+        raise ValueError(f"Missing symbol column in siamchart data (found: {list(src.columns)})")
+
+    out = pd.DataFrame({"symbol": src[name_col].astype(str).str.strip()})
+    if snapshot_date is None and "import_datetime" in src.columns:
+        out["snapshot_date"] = pd.to_datetime(src["import_datetime"]).dt.date
+    else:
+        out["snapshot_date"] = snapshot_date or date.today()
+    for col, (typ, aliases) in FIELDS.items():
+        found = next((a for a in aliases if a in src.columns), None)
+        vals = pd.to_numeric(src[found], errors="coerce") if found else pd.Series(float("nan"), index=src.index)
+        out[col] = vals.round().astype("Int64") if typ == "SMALLINT" else vals
+    out = out[out["symbol"].ne("") & out["symbol"].ne("nan")]
+    return out.drop_duplicates(["symbol", "snapshot_date"])[HIST_COLS]
+
+def append_snapshot(df, snapshot_date=None):
+    """เพิ่ม snapshot เข้า history (COPY เข้า temp แล้ว INSERT ... ON CONFLICT DO NOTHING) คืนจำนวนแถวที่เพิ่มจริง"""
+    hist = to_history_frame(df, snapshot_date)
+    if hist.empty:
+        return 0
+    buf = io.StringIO()
+    hist.to_csv(buf, index=False, header=False, na_rep="")
+    buf.seek(0)
+    with db.connect() as conn, conn.cursor() as cur:
+        ensure_tables(cur, [d.year for d in hist["snapshot_date"].unique()])
+        cur.execute(f"CREATE TEMP TABLE stg_fundamental_history (LIKE {HIST_TABLE}) ON COMMIT DROP;")
+        cur.copy_expert(f"COPY stg_fundamental_history ({', '.join(HIST_COLS)}) FROM STDIN WITH (FORMAT csv)", buf)
+        cur.execute(f"""
+            INSERT INTO {HIST_TABLE} ({', '.join(HIST_COLS)})
+            SELECT {', '.join(HIST_COLS)} FROM stg_fundamental_history
+            ON CONFLICT (symbol, snapshot_date) DO NOTHING;
+        """)
+        n = cur.rowcount
+        conn.commit()
+    print(f"🗂️ {HIST_TABLE}: +{n:,} / {len(hist):,} rows")
+    return n
+
+def score_history(years=FH_YEARS, min_yield=FH_MIN_YIELD):
+    """คำนวณ stock_fundamental_trend ใหม่ทั้งตารางใน transaction เดียว (ผู้อ่านเห็นข้อมูลชุดเดิมจนกว่าจะ commit)"""
+    today = date.today()
+    # years ปีปฏิทินรวมปีปัจจุบัน (เช่น 5 ปีในปี 2025 = 2021..2025) ไม่ใช่ years + 1 ปี
+    since = date(today.year - years + 1, 1, 1)
+    with db.connect() as conn, conn.cursor() as cur:
+        ensure_tables(cur)
+        cur.execute(f"DELETE FROM {TREND_TABLE};")
+        cur.execute(SCORE_SQL, {"since": since, "min_yield": min_yield})
+        n = cur.rowcount
+        conn.commit()
+    print(f"📈 {TREND_TABLE}: {n:,} symbols (since {since})")
+    return n
+
+def main():
+    """เก็บ snapshot ปัจจุบันของ stock_list_info_siamchart ลง history แล้วคำนวณคะแนนแนวโน้ม"""
+    df = db.read_frame(f"SELECT * FROM {SRC_TABLE}")
+    if df.empty:
+        print(f"❌ No data in {SRC_TABLE}")
+        return
+    # แถวที่ค่าไม่เปลี่ยนจะไม่ถูก update ใน merge (import_datetime เก่า) → ใช้วันที่รันเป็น snapshot_date
+    append_snapshot(df, date.today())
+    score_history()
+    screener.refresh()
+    print("✅ Done fundamental history.")
+
+if __name__ == "__main__":
+    main()
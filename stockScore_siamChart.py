@@ -1,23 +1,23 @@
 import os
-import urllib
+import io
+import re
 import numpy as np
 import pandas as pd
-from sqlalchemy import create_engine, text
 from dotenv import load_dotenv
 
+import db
+import screener
+
 # -----------------------------
 #  Config
 # -----------------------------
 load_dotenv()  # โหลด .env ถ้ามี
 
-PGHOST =  os.getenv("posql_host")
-PGPORT = os.getenv("posql_port", "5432")
-PGDATABASE = os.getenv("posql_db")
-PGUSER = os.getenv("posql_user")
-PGPASSWORD = os.getenv("posql_password")
-
 SRC_TABLE = "public.stock_list_info_siamchart"
 DEST_TABLE = "public.stock_value_score"   # ตารางผลลัพธ์
+GROUP_TABLE = "public.settrade_stocklist"
+# จัดอันดับภายในกลุ่ม (คอลัมน์ของ settrade_stocklist เช่น market / sector) ว่าง = ทั้งตลาด
+GROUP_BY = os.getenv("SCORE_GROUP_BY", "").strip() or None
 
 # น้ำหนักรวม (จะถูก normalize อีกครั้งตาม metric ที่มีจริง)
 WEIGHTS = {
@@ -40,160 +40,139 @@ WEIGHTS = {
     "mg_score": 0.10/2,   # ถ้าไม่มี cg_score จะถูกปรับน้ำหนักให้ mg_score แทน
 }
 
-def main():
-    # -----------------------------
-    #  Connect
-    # -----------------------------
-    # conn_str = f"postgresql+psycopg2://{PGUSER}:{PGPASSWORD}@{PGHOST}:{PGPORT}/{PGDATABASE}"
-    conn_str = f"postgresql+psycopg2://{PGUSER}:{urllib.parse.quote_plus(PGPASSWORD)}@{PGHOST}:{PGPORT}/{PGDATABASE}"
-    engine = create_engine(conn_str)
-
-    # -----------------------------
-    #  Load source
-    # -----------------------------
-    with engine.connect() as con:
-        df = pd.read_sql(text(f"SELECT * FROM {SRC_TABLE} --limit 10 --WHERE name in ('COMAN','COM7') "), con)
-
-    if df.empty:
-        raise SystemExit(f"No data found in {SRC_TABLE}")
-
-    # -----------------------------
-    #  Normalize columns & alias map
-    # -----------------------------
-    df.columns = [c.strip().lower() for c in df.columns]
-
-    aliases = {
-        "name":   ["name","sign","symbol","ticker","stock"],
-        "pe":     ["pe","p/e"],
-        "pbv":    ["pbv","p/bv"],
-        "peg":    ["peg"],
-        "de":     ["de","d/e","de_ratio"],
-        "roe":    ["roe","roe%","roe_pct"],
-        "roa":    ["roa","roa%","roa_pct"],
-        "npm":    ["npm","npm%","net_profit_margin","net_margin"],
-        "eps":    ["eps"],
-        "yield":  ["yield","yield%","dividend_yield","dy"],
-        "dps":    ["dps","dividend_per_share"],
-        "mg":     ["mg","gross_margin","gm"],
-        "cg":     ["cg","growth","profit_growth","np_growth"],   # optional
-        "magic1": ["magic1"],    # optional
-        "magic2": ["magic2"],    # optional
-    }
-
-    colmap = {}
-    for k, opts in aliases.items():
-        for o in opts:
-            if o in df.columns:
-                colmap[k] = o
-                break
-
-    required_any = ["name"]
-    missing_req = [x for x in required_any if x not in colmap]
-    if missing_req:
-        raise ValueError(f"Missing required columns in source: {missing_req}  (found: {list(df.columns)})")
-
-    # สร้าง working frame
-    metrics = ["pe","pbv","peg","de","roe","roa","npm","eps","yield","dps","mg","cg","magic1","magic2"]
-    present = [m for m in metrics if m in colmap]
-    work = df[[colmap["name"]] + [colmap[m] for m in present]].copy()
-    work.columns = ["name"] + present
-
-    # แปลงเป็นตัวเลข
-    for m in present:
-        work[m] = pd.to_numeric(work[m], errors="coerce")
-
-    # -----------------------------
-    #  Scoring (percentile rank)
-    # -----------------------------
-    lower_better = {"pe","pbv","peg","de","magic1","magic2"}
-    higher_better = {"roe","roa","npm","eps","yield","dps","mg","cg"}
-
-    # ฟังก์ชันคำนวณสกอร์แบบ percentile rank
-    def pct_score(series: pd.Series, higher_is_better: bool) -> pd.Series:
-        s = series.copy()
-        n = s.notna().sum()
-        if n == 0:
-            # ทั้งคอลัมน์ไม่มีข้อมูลเลย → ให้ 0 หมด
-            return pd.Series(0.0, index=s.index)
-
-        # จัดอันดับเป็นเปอร์เซ็นไทล์
-        r = s.rank(ascending=True, pct=True)
-
-        if higher_is_better:
-            score = r                      # ค่าสูง → สกอร์สูง
-        else:
-            score = 1 - r + (1.0 / n)      # ค่าต่ำ → สกอร์สูง
-
-        # ถ้าไม่มีข้อมูลในแถว → ให้ 0
-        return score.where(s.notna(), 0.0)
-
-
+ALIASES = {
+    "name":   ["name","sign","symbol","ticker","stock"],
+    "pe":     ["pe","p/e"],
+    "pbv":    ["pbv","p/bv"],
+    "peg":    ["peg"],
+    "de":     ["de","d/e","de_ratio"],
+    "roe":    ["roe","roe%","roe_pct"],
+    "roa":    ["roa","roa%","roa_pct"],
+    "npm":    ["npm","npm%","net_profit_margin","net_margin"],
+    "eps":    ["eps"],
+    "yield":  ["yield","yield%","dividend_yield","dy"],
+    "dps":    ["dps","dividend_per_share"],
+    "mg":     ["mg","gross_margin","gm"],
+    "cg":     ["cg","growth","profit_growth","np_growth"],   # optional
+    "magic1": ["magic1"],    # optional
+    "magic2": ["magic2"],    # optional
+}
+METRICS = ["pe","pbv","peg","de","roe","roa","npm","eps","yield","dps","mg","cg","magic1","magic2"]
+LOWER_BETTER = {"pe","pbv","peg","de","magic1","magic2"}   # ที่เหลือ higher is better
 
-    scores = pd.DataFrame(index=work.index)
+# -----------------------------
+#  Scoring
+# -----------------------------
+def prepare_frame(df, group_col=None):
+    """เลือกคอลัมน์ตาม ALIASES → DataFrame[name, (score_group), metric ที่มีจริง...] เป็นตัวเลข"""
+    df = df.rename(columns=lambda c: str(c).strip().lower())
+    colmap = {k: next(o for o in opts if o in df.columns) for k, opts in ALIASES.items()
+              if any(o in df.columns for o in opts)}
+    if "name" not in colmap:
+        raise ValueError(f"Missing required columns in source: ['name']  (found: {list(df.columns)})")
+
+    present = [m for m in METRICS if m in colmap]
+    work = pd.DataFrame({"name": df[colmap["name"]]})
+    if group_col:
+        work["score_group"] = df[group_col]
     for m in present:
-        if m in higher_better:
-            scores[f"{m}_score"] = pct_score(work[m], higher_is_better=True)
-        elif m in lower_better:
-            scores[f"{m}_score"] = pct_score(work[m], higher_is_better=False)
-        else:
-            # default ให้ถือว่า higher is better
-            scores[f"{m}_score"] = pct_score(work[m], higher_is_better=True)
-
-    # -----------------------------
-    #  Weight normalization
-    # -----------------------------
-    # ถ้าไม่มี cg_score ให้เทน้ำหนัก growth ทั้งหมดไปที่ mg_score
-    use_weights = WEIGHTS.copy()
-    if "cg_score" not in scores.columns:
-        mg_weight = use_weights.get("mg_score", 0.0) + use_weights.get("cg_score", 0.0)
-        use_weights["mg_score"] = mg_weight
+        work[m] = pd.to_numeric(df[colmap[m]], errors="coerce")
+    return work
+
+def normalize_weights(weights, score_cols):
+    """ถ้าไม่มี cg_score ให้เทน้ำหนัก growth ไปที่ mg_score แล้ว normalize เฉพาะ score ที่มีจริง"""
+    use_weights = dict(weights)
+    if "cg_score" not in score_cols:
+        use_weights["mg_score"] = use_weights.get("mg_score", 0.0) + use_weights.get("cg_score", 0.0)
         use_weights["cg_score"] = 0.0
-
-    available = {k: v for k, v in use_weights.items() if k in scores.columns and v > 0}
+    available = {k: v for k, v in use_weights.items() if k in score_cols and v > 0}
     w_sum = sum(available.values())
-    norm_weights = {k: v / w_sum for k, v in available.items()} if w_sum > 0 else {}
-
-    # -----------------------------
-    #  Compute value_score & rank
-    # -----------------------------
-    value_score = np.zeros(len(scores))
-    for k, w in norm_weights.items():
-        value_score += scores[k].values * w
-
-    out = pd.concat([work[["name"]], pd.Series(value_score, name="value_score", index=work.index)], axis=1)
-
+    return {k: v / w_sum for k, v in available.items()} if w_sum > 0 else {}
+
+def score_frame(work, weights=None, group_by=None):
+    """คะแนน value จาก percentile rank ของทุก metric ในครั้งเดียว (rank ทั้งเมทริกซ์)
+    - lower-better คูณ -1 ก่อน rank (เท่ากับสูตรเดิม 1 - r + 1/n)
+    - ค่าว่าง → 0, group_by = ชื่อคอลัมน์ใน work เพื่อจัดอันดับภายในกลุ่ม (sector/market)
+    คืน DataFrame[name, value_score, rank, (score_group, group_rank), <metric>_score...]"""
+    weights = WEIGHTS if weights is None else weights
+    present = [m for m in METRICS if m in work.columns]
+    sign = np.array([-1.0 if m in LOWER_BETTER else 1.0 for m in present])
+    signed = work[present] * sign
+    ranked = signed.groupby(work[group_by], dropna=False).rank(pct=True) if group_by else signed.rank(pct=True)
+    scores = ranked.fillna(0.0)
+    scores.columns = [f"{m}_score" for m in present]
+
+    norm_weights = normalize_weights(weights, scores.columns)
+    keys = sorted(norm_weights)
+    w = np.array([norm_weights[k] for k in keys])
+
+    out = work[["name"]].copy()
+    out["value_score"] = scores[keys].to_numpy() @ w if keys else 0.0
+    out["rank"] = out["value_score"].rank(ascending=False, method="min").astype(int)  # อันดับ (1 ดีสุด)
+    if group_by:
+        out["score_group"] = work[group_by]
+        out["group_rank"] = out.groupby("score_group", dropna=False)["value_score"].rank(
+            ascending=False, method="min").astype(int)
     # แนบ component score ที่ใช้จริงเพื่อความโปร่งใส
-    for k in sorted(norm_weights.keys()):
+    for k in keys:
         out[k] = scores[k]
+    return out
+
+# -----------------------------
+#  Load / Save
+# -----------------------------
+def load_source(group_by=None):
+    df = db.read_frame(f"SELECT * FROM {SRC_TABLE}")
+    if df.empty or not group_by:
+        return df
+    if not re.fullmatch(r"[a-z_][a-z0-9_]*", group_by):
+        raise ValueError(f"Invalid SCORE_GROUP_BY: {group_by!r}")
+    groups = db.read_frame(f"SELECT symbol, {group_by} FROM {GROUP_TABLE}")
+    name_col = next(c for c in df.columns if c.strip().lower() in ALIASES["name"])
+    df["score_group"] = df[name_col].map(groups.drop_duplicates("symbol").set_index("symbol")[group_by])
+    return df
+
+def swap_table(out):
+    """เขียนลง <DEST>_new ด้วย COPY แล้วสลับชื่อใน transaction เดียว
+    ผู้อ่าน stock_value_score เห็นชุดเดิมครบจนถึงจังหวะ RENAME (ไม่มีช่วงตารางว่าง)"""
+    schema, name = DEST_TABLE.split(".")
+    new, old = f"{name}_new", f"{name}_old"
+    col_types = {"name": "TEXT", "value_score": "DOUBLE PRECISION", "rank": "INTEGER",
+                 "score_group": "TEXT", "group_rank": "INTEGER"}
+    cols = list(out.columns)
+    ddl = ", ".join(f"{c} {col_types.get(c, 'DOUBLE PRECISION')}" for c in cols)
+
+    buf = io.StringIO()
+    out.to_csv(buf, index=False, header=False, na_rep="")
+    buf.seek(0)
+
+    with db.connect() as conn, conn.cursor() as cur:
+        cur.execute(f"DROP TABLE IF EXISTS {schema}.{new}; CREATE TABLE {schema}.{new} ({ddl});")
+        cur.copy_expert(f"COPY {schema}.{new} ({', '.join(cols)}) FROM STDIN WITH (FORMAT csv)", buf)
+        cur.execute(f"""
+            CREATE INDEX ix_{new}_rank ON {schema}.{new} (rank);
+            CREATE INDEX ix_{new}_name ON {schema}.{new} (name);
+            DROP TABLE IF EXISTS {schema}.{old};
+            ALTER TABLE IF EXISTS {schema}.{name} RENAME TO {old};
+            ALTER TABLE {schema}.{new} RENAME TO {name};
+            DROP TABLE IF EXISTS {schema}.{old};
+            ALTER INDEX {schema}.ix_{new}_rank RENAME TO ix_{name}_rank;
+            ALTER INDEX {schema}.ix_{new}_name RENAME TO ix_{name}_name;
+        """)
+        conn.commit()
+
+def main(weights=None, group_by=GROUP_BY):
+    df = load_source(group_by)
+    if df.empty:
+        raise SystemExit(f"No data found in {SRC_TABLE}")
+
+    work = prepare_frame(df, "score_group" if group_by else None)
+    out = score_frame(work, weights, "score_group" if group_by else None)
+    swap_table(out)
 
-    # อันดับ (1 ดีสุด)
-    out["rank"] = out["value_score"].rank(ascending=False, method="min").astype(int)
-
-    # -----------------------------
-    #  Save to Postgres
-    # -----------------------------
-    with engine.begin() as con:
-        # สร้างตารางปลายทาง (replace)
-        create_sql = f"""
-        DROP TABLE IF EXISTS {DEST_TABLE};
-        CREATE TABLE {DEST_TABLE} (
-            name TEXT,
-            value_score DOUBLE PRECISION,
-            rank INTEGER,
-            {", ".join([f"{k} DOUBLE PRECISION" for k in sorted(norm_weights.keys())])}
-        );
-        """
-        con.execute(text(create_sql))
-
-        # เขียนข้อมูลลงตารางปลายทาง
-        out.to_sql(DEST_TABLE.split(".")[-1], con, schema=DEST_TABLE.split(".")[0],
-                if_exists="append", index=False)
-
-        # ดัชนีช่วยค้น (ทางเลือก)
-        con.execute(text(f"CREATE INDEX ON {DEST_TABLE} (rank);"))
-        con.execute(text(f"CREATE INDEX ON {DEST_TABLE} (name);"))
-
-    print(f"Done. Wrote {len(out)} rows to {DEST_TABLE}")
+    print(f"Done. Wrote {len(out)} rows to {DEST_TABLE}" + (f" (grouped by {group_by})" if group_by else ""))
+    screener.refresh()  # value_score ใน latest_snapshot
+    return out
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
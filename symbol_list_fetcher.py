@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ดึงรายชื่อหุ้นผ่าน HTTP ตรง (ไม่เปิด Chrome) พร้อม cache บนดิสก์แบบ conditional request
+- cached_get(url): ส่ง If-None-Match / If-Modified-Since จาก ETag / Last-Modified ที่เก็บไว้
+  ถ้า server ตอบ 304 ใช้ body เดิมจาก cache (ไม่ต้องโหลดซ้ำ), ถ้า request ล้มเหลว / ตอบ 4xx-5xx แต่มี cache ใช้ cache
+- parse_symbol_list(body): แปลง JSON ของ settrade (/api/set/stock/list) หรือ HTML ตาราง (หน้า get-quote ที่ save ไว้)
+  เป็น DataFrame[symbol, name_th, name_en, market, ...] ไม่แตะ network → ทดสอบกับไฟล์ fixture ได้ offline
+- fetch_symbol_list(fallback): HTTP ก่อน ถ้าไม่ได้ข้อมูลค่อยเรียก fallback (Selenium ใน updateStockList)
+
+ตัวอย่าง:
+    python symbol_list_fetcher.py                    # ดึงจริง (ใช้ cache)
+    python symbol_list_fetcher.py --parse saved.json # parse ไฟล์ที่ save ไว้ (offline)
+    ตัวอย่างไฟล์ที่ใช้ทดสอบ: testLab/fixtures/symbol_list.json, testLab/fixtures/symbol_list.html
+"""
+
+import os
+import io
+import json
+import time
+import hashlib
+import argparse
+import pandas as pd
+import requests
+from dotenv import load_dotenv
+
+load_dotenv()
+
+SYMBOL_LIST_URL   = os.getenv("SYMBOL_LIST_URL", "https://www.set.or.th/api/set/stock/list")
+# securityType ที่เก็บ: S = หุ้นสามัญ (เหมือนที่ Selenium โหลดจากหน้า get-quote), เพิ่ม F / P ได้ตามต้องการ
+# API ส่ง warrant / ETF / DR มาด้วย ไม่ต้องการใน settrade_stocklist (ราคา/indicator/signal), "*" = ทุกประเภท
+_types = os.getenv("SYMBOL_LIST_TYPES", "S").strip()
+SYMBOL_LIST_TYPES = [] if _types == "*" else [t.strip() for t in _types.split(",") if t.strip()]
+HTTP_CACHE_DIR    = os.getenv("HTTP_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".http_cache"))
+HTTP_TIMEOUT      = float(os.getenv("HTTP_TIMEOUT", "20"))
+
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (X11; Linux aarch64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0 Safari/537.36",
+    "Accept": "application/json, text/html;q=0.9, */*;q=0.8",
+    "Accept-Language": "th,en;q=0.8",
+    "Referer": "https://www.settrade.com/th/get-quote",
+}
+
+# ชื่อ field ใน JSON → ชื่อคอลัมน์ใน settrade_stocklist (4 คอลัมน์แรกตรงกับที่ updateStockList ตั้งชื่อไว้)
+JSON_FIELDS = {
+    "symbol": "symbol",
+    "nameTH": "name_th",
+    "nameEN": "name_en",
+    "market": "market",
+    "industry": "industry",
+    "sector": "sector",
+    "securityType": "security_type",
+}
+
+# ------------------------------------------------
+def _cache_paths(url):
+    key = hashlib.sha1(url.encode("utf-8")).hexdigest()
+    return os.path.join(HTTP_CACHE_DIR, f"{key}.body"), os.path.join(HTTP_CACHE_DIR, f"{key}.json")
+
+def cached_get(url, session=None, timeout=HTTP_TIMEOUT):
+    """GET แบบ conditional คืน (body bytes, content_type, from_cache)"""
+    body_path, meta_path = _cache_paths(url)
+    meta = {}
+    if os.path.exists(meta_path) and os.path.exists(body_path):
+        with open(meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+
+    headers = dict(HEADERS)
+    if meta.get("etag"):
+        headers["If-None-Match"] = meta["etag"]
+    if meta.get("last_modified"):
+        headers["If-Modified-Since"] = meta["last_modified"]
+
+    http = session or requests
+    try:
+        resp = http.get(url, headers=headers, timeout=timeout)
+        if resp.status_code != 304:
+            resp.raise_for_status()   # HTTPError (4xx/5xx เช่นโดน rate limit) ใช้ cache เหมือน network ล้มเหลว
+    except requests.RequestException as e:
+        if not meta:
+            raise
+        print(f"⚠️ {url}: {e} → ใช้ cache ({meta.get('fetched_at')})")
+        resp = None
+
+    if resp is None or resp.status_code == 304:
+        with open(body_path, "rb") as f:
+            return f.read(), meta.get("content_type", ""), True
+
+    os.makedirs(HTTP_CACHE_DIR, exist_ok=True)
+    with open(body_path, "wb") as f:
+        f.write(resp.content)
+    with open(meta_path, "w", encoding="utf-8") as f:
+        json.dump({"url": url,
+                   "etag": resp.headers.get("ETag"),
+                   "last_modified": resp.headers.get("Last-Modified"),
+                   "content_type": resp.headers.get("Content-Type", ""),
+                   "fetched_at": time.strftime("%Y-%m-%d %H:%M:%S")}, f)
+    return resp.content, resp.headers.get("Content-Type", ""), False
+
+# ------------------------------------------------
+def parse_symbol_list(body, content_type="", types=None):
+    """JSON ({"securitySymbols": [...]}) หรือ HTML <table> → DataFrame[symbol, name_th, name_en, market, ...]"""
+    types = SYMBOL_LIST_TYPES if types is None else types
+    text = body.decode("utf-8-sig") if isinstance(body, bytes) else body
+    stripped = text.lstrip()
+
+    if "json" in content_type or stripped.startswith(("{", "[")):
+        data = json.loads(text)
+        rows = data.get("securitySymbols", data) if isinstance(data, dict) else data
+        df = pd.DataFrame(rows)
+        if df.empty or "symbol" not in df.columns:
+            return pd.DataFrame(columns=list(JSON_FIELDS.values()))
+        if types and "securityType" in df.columns:
+            df = df[df["securityType"].isin(types)]
+        df = df[[c for c in JSON_FIELDS if c in df.columns]].rename(columns=JSON_FIELDS)
+    else:
+        # หน้า get-quote ที่ save ไว้: 4 คอลัมน์แรกคือ symbol, name_th, name_en, market (ตามที่ updateStockList ตั้งชื่อ)
+        df = pd.read_html(io.StringIO(text))[0]
+        df = df.rename(columns=dict(zip(df.columns[:4], ["symbol", "name_th", "name_en", "market"])))
+
+    df["symbol"] = df["symbol"].astype(str).str.strip()
+    return df[df["symbol"].ne("") & df["symbol"].ne("nan")].drop_duplicates("symbol").reset_index(drop=True)
+
+def fetch_symbol_list(fallback=None, url=SYMBOL_LIST_URL):
+    """ดึงผ่าน HTTP (+cache) ก่อน ถ้าล้มเหลวหรือได้ตารางว่างค่อยเรียก fallback()"""
+    t0 = time.time()
+    try:
+        body, ctype, from_cache = cached_get(url)
+        df = parse_symbol_list(body, ctype)
+        if not df.empty:
+            print(f"🌐 symbol list {len(df):,} rows from {'cache (304)' if from_cache else url} in {time.time() - t0:.2f}s")
+            return df
+        print(f"⚠️ {url}: empty symbol list")
+    except Exception as e:
+        print(f"⚠️ {url}: {e}")
+    if fallback is None:
+        raise RuntimeError("Symbol list not available over HTTP and no fallback given")
+    print("🐢 fallback → Selenium")
+    return fallback()
+
+def main():
+    ap = argparse.ArgumentParser(description="Fetch settrade symbol list over HTTP")
+    ap.add_argument("--parse", help="parse ไฟล์ JSON/HTML ที่ save ไว้ (ไม่ต่อ network)")
+    ap.add_argument("--url", default=SYMBOL_LIST_URL)
+    args = ap.parse_args()
+    if args.parse:
+        with open(args.parse, "rb") as f:
+            df = parse_symbol_list(f.read())
+    else:
+        df = fetch_symbol_list(url=args.url)
+    print(df)
+
+if __name__ == "__main__":
+    main()
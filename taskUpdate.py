@@ -1,12 +1,21 @@
+import os
 from datetime import date, datetime
 import updateStockList as usl
 import updateStockInfo_siamChart as usi
 import stockScore_siamChart as ssc
+import stockFundamentalHistory_siamChart as sfh
+import browser_session as bs
 
 import updateStockPrice as usp
-import compute_indicators_v3 as com_ind
+import compute_indicators_v4 as com_ind
 import compute_signals as com_sig
+import compute_support_resistance as com_sr
+import compute_liquidity as com_liq
 import updatePort as uport
+import compute_position_exit as cpe
+
+# 1 = ส่ง DataFrame indicator ที่เพิ่งคำนวณเข้า compute_signals ในหน่วยความจำ (ไม่อ่าน stock_indicator_daily_v4 ซ้ำ)
+PIPELINE = os.getenv("TASK_PIPELINE", "1") == "1"
 
 def main():
     print("=========================================")
@@ -23,16 +32,27 @@ def main():
     if date.today().day == 5:
         usl.main()  # Update stock list from settrade
         usi.main()  # Update stock info from SiamChart
+        bs.print_timings()  # เวลาโหลดต่อหน้าของ scraper
+        bs.close()  # usl/usi ใช้ Chrome ตัวเดียวกัน ปิดทันทีเมื่อ scrape เสร็จ (คืน RAM)
         ssc.main()  # Compute stock scores from SiamChart
+        sfh.main()  # เก็บ snapshot งบลง history + คะแนนแนวโน้มหลายปี
         todayYYYYMMDD_hhmmss = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         print(f"at {todayYYYYMMDD_hhmmss} => ✅ Stock list, info, and scores updated.")
 
 
     # อัพเดทราคาหุ้นรายวัน
     usp.main()  # Update stock prices
-    com_ind.main()  # Compute technical indicators
-    com_sig.main() # Compute trading signals
+    if PIPELINE:
+        ind = com_ind.main(keep_since=com_sig.signal_start())  # Compute technical indicators
+        com_liq.main()  # สภาพคล่อง/หุ้นตาย ก่อน signal เพื่อกรองหุ้นที่ไม่ tradable
+        com_sig.main(ind)  # Compute trading signals จากเฟรมเดียวกัน
+    else:
+        com_ind.main()  # Compute technical indicators
+        com_liq.main()
+        com_sig.main()  # Compute trading signals
+    com_sr.main()  # แนวรับ/แนวต้าน + rolling high/low
     uport.UpdatePortfolio()  # Update portfolio stock data
+    cpe.main()  # แผนขาย 4 ระดับ + trailing stop ของหุ้นในพอร์ต
 
     todayYYYYMMDD_hhmmss = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     print(f"at {todayYYYYMMDD_hhmmss} => ✅ Stock prices, indicators, and signals updated.")
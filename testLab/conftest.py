@@ -0,0 +1,5 @@
+# ให้ pytest import โมดูลที่ root ของ repo ได้ (python -m pytest testLab)
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
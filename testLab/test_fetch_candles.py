@@ -0,0 +1,110 @@
+# ทดสอบ updateStockPrice.fetch_candles กับ fake MarketData (ไม่ต้องต่อ settrade / postgres)
+import time
+import random
+import threading
+
+import pytest
+
+import updateStockPrice as usp
+
+RPS, BURST, RETRIES = 20, 5, 2
+
+
+class FakeMarketData:
+    """เลียนแบบ investor.MarketData().get_candlestick: หน่วงเวลาเหมือน network, error ตาม seed, บาง symbol ไม่มีข้อมูล
+    - EMPTY* คืนว่าง, DEAD* error ทุกครั้ง, FLAKY<n>* error n ครั้งแรกแล้วสำเร็จ
+    - symbol อื่น error แบบสุ่มด้วย random.Random(seed) ต่อ symbol (ผลเดิมทุกครั้งที่รัน)"""
+
+    def __init__(self, fail_rate=0.2, latency=0.05, seed=7):
+        self.fail_rate = fail_rate
+        self.latency = latency
+        self.seed = seed
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def planned_failures(self, symbol):
+        if symbol.startswith("DEAD"):
+            return RETRIES + 1
+        if symbol.startswith("FLAKY"):
+            return int(symbol[5])
+        rng = random.Random(f"{self.seed}:{symbol}")
+        n = 0
+        while n < RETRIES and rng.random() < self.fail_rate:
+            n += 1
+        return n
+
+    def get_candlestick(self, symbol, interval, limit, normalized, start, end):
+        time.sleep(self.latency)
+        with self.lock:
+            self.calls[symbol] = self.calls.get(symbol, 0) + 1
+            call = self.calls[symbol]
+        if symbol.startswith("EMPTY"):
+            return []
+        if call <= self.planned_failures(symbol):
+            raise ConnectionError(f"fake timeout for {symbol}")
+        return {
+            "time": [1759276800],  # 2025-10-01 00:00 UTC
+            "open": [10.0], "high": [10.5], "low": [9.9], "close": [10.2], "volume": [123400],
+        }
+
+
+SYMBOLS = [f"S{i:03d}" for i in range(40)] + ["EMPTY1", "DEAD1", "FLAKY1A", "FLAKY2A"]
+
+
+def test_fetch_candles():
+    market = FakeMarketData()
+    start = time.monotonic()
+    price, report = usp.fetch_candles(market, SYMBOLS, "2025-10-01", "2025-10-01",
+                                      workers=8, rps=RPS, burst=BURST, retries=RETRIES, backoff=0.01)
+    elapsed = time.monotonic() - start
+    report = report.set_index("symbol")
+
+    # รายงานครบทุก symbol และสถานะตรงกับที่ fake กำหนด
+    assert sorted(report.index) == sorted(SYMBOLS)
+    assert report.loc["EMPTY1", "status"] == "empty" and report.loc["EMPTY1", "attempts"] == 1
+    assert report.loc["DEAD1", "status"] == "failed" and report.loc["DEAD1", "attempts"] == RETRIES + 1
+    assert report.loc["DEAD1", "error"] == "fake timeout for DEAD1"
+    for sym in SYMBOLS:
+        assert market.calls[sym] == report.loc[sym, "attempts"], sym
+        if sym.startswith(("EMPTY", "DEAD")):
+            continue
+        assert report.loc[sym, "status"] == "ok", sym
+        assert report.loc[sym, "attempts"] == market.planned_failures(sym) + 1, sym
+    assert report.loc["FLAKY2A", "attempts"] == 3
+
+    # frame ราคา: 1 แถวต่อ symbol ที่สำเร็จ, คอลัมน์ตาม PRICE_COLS, วันที่เป็นเวลาไทย
+    ok = sorted(report.index[report["status"] == "ok"])
+    assert list(price.columns) == usp.PRICE_COLS
+    assert sorted(price["symbol"]) == ok
+    assert set(price["date"].astype(str)) == {"2025-10-01"}
+    assert (price["close"] == 10.2).all() and (price["volume"] == 123400).all()
+
+    # token bucket: request ที่เกิน burst ต้องถูกจำกัดที่ RPS (ตรวจแค่ขอบล่าง เวลาจริงบนเครื่องช้าอาจนานกว่านี้ได้)
+    total_requests = int(report["attempts"].sum())
+    assert total_requests == sum(market.calls.values())
+    assert elapsed >= (total_requests - BURST) / RPS * 0.95
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = 0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps += 1
+        self.now += seconds
+
+
+def test_token_bucket_rate():
+    clock = FakeClock()
+    bucket = usp.TokenBucket(rate=4, capacity=2, clock=clock.monotonic, sleep=clock.sleep)
+    for _ in range(2):
+        bucket.acquire()
+    assert clock.now == 0 and clock.sleeps == 0   # burst ใช้ได้ทันที
+    for _ in range(8):
+        bucket.acquire()
+    assert clock.now == pytest.approx(8 / 4)       # ที่เหลือได้ 1 token ทุก 1/rate วินาที
+    assert clock.sleeps == 8
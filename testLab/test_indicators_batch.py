@@ -0,0 +1,32 @@
+# batched kernel (compute_batch) ต้องได้ผลตรงทุกบิตกับ compute_for_symbol ทีละ symbol
+import numpy as np
+import pandas as pd
+
+import compute_indicators_v4 as v4
+
+
+def price_series(symbol, n, start, seed, drop=()):
+    rng = np.random.default_rng(seed)
+    close = np.round(20 * np.exp(np.cumsum(rng.normal(0, 0.02, n))), 2)
+    volume = rng.integers(0, 1_000_000, n).astype(float)
+    df = pd.DataFrame({"symbol": symbol, "trade_date": pd.bdate_range(start, periods=n).date,
+                       "open": close, "high": close * 1.01, "low": close * 0.99, "close": close, "volume": volume})
+    return df.drop(index=list(drop)).reset_index(drop=True)
+
+
+def test_batch_matches_per_symbol():
+    # ยาวไม่เท่ากัน, เริ่มคนละวัน (IPO ทีหลัง), หยุดพักกลางทาง, และสั้นกว่า EMA200
+    price = pd.concat([
+        price_series("AAA", 400, "2022-01-03", 1),
+        price_series("BBB", 260, "2022-06-01", 2, drop=range(100, 110)),
+        price_series("CCC", 35, "2023-03-01", 3),
+    ], ignore_index=True)
+
+    batch = v4.compute_batch(price).sort_values(["symbol", "trade_date"]).reset_index(drop=True)
+    single = pd.concat([v4.compute_for_symbol(g) for _, g in price.groupby("symbol")])
+    single = single.sort_values(["symbol", "trade_date"]).reset_index(drop=True)
+
+    assert batch[["symbol", "trade_date"]].equals(single[["symbol", "trade_date"]])
+    for c in v4.FLOAT_COLS:
+        assert np.array_equal(batch[c].to_numpy(float), single[c].to_numpy(float), equal_nan=True), c
+    assert batch["trend_status"].fillna("").tolist() == single["trend_status"].fillna("").tolist()
@@ -0,0 +1,44 @@
+# incremental (เดิน state ต่อ) ต้องได้ค่าเท่ากับคำนวณเต็มช่วงด้วย compute_for_symbol
+import json
+
+import numpy as np
+import pandas as pd
+
+import compute_indicators_v4 as v4
+import compute_indicators_incremental as inc
+
+
+def price_series(n, seed=1):
+    rng = np.random.default_rng(seed)
+    close = np.round(20 * np.exp(np.cumsum(rng.normal(0, 0.02, n))), 2)
+    volume = rng.integers(0, 1_000_000, n).astype(float)
+    volume[[50, 51, 320]] = np.nan   # volume หายบางวัน (window / EMA ต้องเดินเหมือนกัน)
+    return pd.DataFrame({"symbol": "AAA", "trade_date": pd.bdate_range("2022-01-03", periods=n).date,
+                         "open": close, "high": close * 1.01, "low": close * 0.99, "close": close, "volume": volume})
+
+
+def assert_matches_full(calc, full):
+    assert calc["trade_date"].tolist() == full["trade_date"].tolist()
+    for c in v4.FLOAT_COLS:
+        atol = 0.005 if c in v4.NUM2_COLS else v4.EPS
+        assert np.allclose(calc[c].to_numpy(float), full[c].to_numpy(float), rtol=0, atol=atol, equal_nan=True), c
+    assert calc["trend_status"].fillna("").tolist() == full["trend_status"].fillna("").tolist()
+
+
+def test_incremental_matches_full_recompute():
+    price = price_series(400)
+    full = v4.compute_for_symbol(price)
+
+    # seed จากช่วงแรก แล้วเก็บ/โหลด state แบบ JSONB (ผ่าน json) ก่อนเดินต่อทีละก้อน
+    seed, state = inc.advance(inc.new_state(), price.iloc[:300])
+    state = json.loads(json.dumps(state))
+    step1, state = inc.advance(state, price.iloc[300:301])
+    state = json.loads(json.dumps(state))
+    step2, state = inc.advance(state, price.iloc[301:])
+
+    calc = pd.concat([seed, step1, step2], ignore_index=True)
+    assert_matches_full(calc, full.reset_index(drop=True))
+    assert state["n_bars"] == len(price)
+    assert state["first_trade_date"] == str(price["trade_date"].iloc[0])
+    assert state["last_trade_date"] == str(price["trade_date"].iloc[-1])
+
@@ -0,0 +1,108 @@
+# ทดสอบ compute_position_exit.evaluate / main แบบไม่ต่อ postgres (แทนการอ่าน/เขียน DB ด้วยฟังก์ชันในไฟล์นี้)
+from contextlib import contextmanager
+from datetime import date
+
+import pandas as pd
+
+import compute_position_exit as cpe
+
+TODAY = date(2025, 10, 1)
+
+
+def holdings(rows):
+    return pd.DataFrame(rows, columns=cpe.HOLD_COLS)
+
+
+def old_states():
+    return pd.DataFrame([
+        ("A1", "PTT", 1000, 30.0, 33.0, None, None),
+        ("A1", "KBANK", 500, 150.0, 150.0, None, None),
+    ], columns=cpe.STATE_COLS)
+
+
+def test_evaluate_tiers():
+    d = TODAY
+    hold = holdings([
+        ("A1", "LOSS",  1000, 10.0, 8.9,  8.9,  d, None,   None),            # -11% → ขายหมด
+        ("A1", "SIG",   1000, 10.0, 10.1, 10.1, d, "SELL", d),               # สัญญาณ SELL วันนี้ → ขาย 1/2
+        ("A1", "OLDSIG", 1000, 10.0, 10.1, 10.1, d, "SELL", date(2025, 9, 1)),  # สัญญาณเก่า → ไม่นับ
+        ("A1", "TP",    1000, 10.0, 11.2, 11.2, d, "BUY",  d),               # +12% → ขาย 1/4
+    ])
+    plan, state = cpe.evaluate(hold, pd.DataFrame(columns=cpe.STATE_COLS), TODAY)
+    got = plan.set_index("symbol")[["action", "level", "sell_qty"]]
+    assert tuple(got.loc["LOSS"]) == ("SELL_ALL", 4, 1000)
+    assert tuple(got.loc["SIG"]) == ("SELL", 6, 500)
+    assert tuple(got.loc["OLDSIG"]) == ("HOLD", 0, 0)
+    assert tuple(got.loc["TP"]) == ("SELL", 1, 200)
+    assert len(state) == 4
+
+
+def test_added_shares_reset_peak():
+    d = TODAY
+    # PTT: ซื้อเพิ่มจนต้นทุนเฉลี่ยเปลี่ยน 30 → 32 (peak 40 / trail 36.8 เดิมอิงต้นทุนเก่า)
+    # KBANK: ต้นทุนเท่าเดิม → peak/trail เดิมยังใช้ต่อ
+    state = pd.DataFrame([
+        ("A1", "PTT", 1000, 30.0, 40.0, 36.8, None),
+        ("A1", "KBANK", 500, 150.0, 170.0, 156.4, None),
+    ], columns=cpe.STATE_COLS)
+    hold = holdings([
+        ("A1", "PTT",   2000, 32.0,  33.0,  33.0,  d, None, None),
+        ("A1", "KBANK", 500,  150.0, 160.0, 160.0, d, None, None),
+    ])
+    plan, new_state = cpe.evaluate(hold, state, TODAY)
+    st = new_state.set_index("symbol")
+    assert st.loc["PTT", "peak_price"] == 33.0 and pd.isna(st.loc["PTT", "trail_stop"])
+    assert st.loc["KBANK", "peak_price"] == 170.0 and st.loc["KBANK", "trail_stop"] == 156.4
+    # ถ้าไม่ reset PTT จะหลุด trailing stop เดิม (33 <= 36.8) แล้วขายหมด
+    assert plan.set_index("symbol").loc["PTT", "action"] == "HOLD"
+
+
+def test_empty_portfolio_removes_state():
+    plan, state = cpe.evaluate(holdings([]), old_states(), TODAY)
+    assert plan.empty and state.empty
+    assert list(state.columns) == cpe.STATE_COLS
+
+    # main() ทั้งเส้นทาง: ไม่มีหุ้นเหลือ → ไม่ crash และลบ state เดิมทิ้ง
+    calls = []
+
+    class FakeCursor:
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+    class FakeConn:
+        def cursor(self):
+            return FakeCursor()
+
+        def commit(self):
+            pass
+
+    @contextmanager
+    def fake_connect():
+        yield FakeConn()
+
+    patches = {
+        "ensure_table": lambda: None,
+        "fetch_holdings": lambda: holdings([]).iloc[:, :5],
+        "fetch_states": old_states,
+        "execute_values": lambda cur, sql, rows, **kw: calls.append((sql, list(rows))),
+    }
+    saved = {k: getattr(cpe, k) for k in patches}
+    saved_connect = cpe.db.connect
+    try:
+        for k, v in patches.items():
+            setattr(cpe, k, v)
+        cpe.db.connect = fake_connect
+        cpe.main()
+    finally:
+        for k, v in saved.items():
+            setattr(cpe, k, v)
+        cpe.db.connect = saved_connect
+
+    assert len(calls) == 1
+    sql, rows = calls[0]
+    assert sql.startswith("DELETE FROM position_exit_state")
+    assert sorted(rows) == [("A1", "KBANK"), ("A1", "PTT")]
+
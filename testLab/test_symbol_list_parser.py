@@ -0,0 +1,82 @@
+# ทดสอบ symbol_list_fetcher.parse_symbol_list กับไฟล์ fixture ที่ save ไว้ และ cached_get กับ session ปลอม (offline ไม่ต่อ network)
+import os
+
+import pytest
+import requests
+
+import symbol_list_fetcher as slf
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+def read_fixture(name):
+    with open(os.path.join(FIXTURES, name), "rb") as f:
+        return f.read()
+
+
+def test_parse_json_default_types():
+    df = slf.parse_symbol_list(read_fixture("symbol_list.json"), "application/json")
+    # ค่า default SYMBOL_LIST_TYPES = S: ตัด warrant / ETF / DR / หุ้นบุริมสิทธิ และ symbol ซ้ำ
+    assert list(df.columns) == list(slf.JSON_FIELDS.values())
+    assert df["symbol"].tolist() == ["ADVANC", "PTT", "2S"]
+    assert set(df["security_type"]) == {"S"}
+    ptt = df.set_index("symbol").loc["PTT"]
+    assert ptt["name_en"] == "PTT PUBLIC COMPANY LIMITED"
+    assert (ptt["market"], ptt["industry"], ptt["sector"]) == ("SET", "RESOURC", "ENERG")
+    assert df.set_index("symbol").loc["2S", "market"] == "mai"
+
+
+def test_parse_json_types():
+    body = read_fixture("symbol_list.json")
+    df = slf.parse_symbol_list(body, "application/json", types=["S", "P"])
+    assert df["symbol"].tolist() == ["ADVANC", "PTT", "BBL-P", "2S"]
+    df = slf.parse_symbol_list(body, "", types=[])   # [] = ทุกประเภท (ตรวจ JSON จากเนื้อหาเมื่อไม่มี content type)
+    assert len(df) == 7
+
+
+def test_parse_html():
+    df = slf.parse_symbol_list(read_fixture("symbol_list.html"), "text/html")
+    assert list(df.columns) == ["symbol", "name_th", "name_en", "market"]
+    assert df["symbol"].tolist() == ["ADVANC", "PTT", "2S"]
+    assert df["name_th"].iloc[1] == "บริษัท ปตท. จำกัด (มหาชน)"
+    assert df["market"].tolist() == ["SET", "SET", "mai"]
+
+
+
+class FakeResponse:
+    def __init__(self, status_code, content=b"", headers=None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} Error")
+
+
+class FakeSession:
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.sent = []
+
+    def get(self, url, headers=None, timeout=None):
+        self.sent.append(headers)
+        return self.responses.pop(0)
+
+
+def test_cached_get_http_error_uses_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(slf, "HTTP_CACHE_DIR", str(tmp_path))
+    url = "https://example.invalid/list"
+    ok = FakeResponse(200, b'{"securitySymbols": []}', {"ETag": "v1", "Content-Type": "application/json"})
+    session = FakeSession(ok, FakeResponse(304), FakeResponse(503))
+
+    assert slf.cached_get(url, session) == (ok.content, "application/json", False)
+    assert slf.cached_get(url, session) == (ok.content, "application/json", True)    # 304
+    assert session.sent[1]["If-None-Match"] == "v1"
+    assert slf.cached_get(url, session) == (ok.content, "application/json", True)    # 503 → cache
+
+
+def test_cached_get_http_error_without_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(slf, "HTTP_CACHE_DIR", str(tmp_path))
+    with pytest.raises(requests.HTTPError):   # ไม่มี cache → ส่ง error ต่อ
+        slf.cached_get("https://example.invalid/list", FakeSession(FakeResponse(503)))
@@ -0,0 +1,25 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+จัดกลุ่มแนวโน้ม (trend_status) จากราคาปิด, EMA20/50/200 และ RSI14 ใช้ร่วมกันระหว่าง compute_indicators_v3 / v4
+- uptrend   : close > EMA200 และ EMA20 > EMA50
+- downtrend : close < EMA200 และ EMA20 < EMA50
+- sideway   : ราคาอยู่ในกรอบ ±2% ของ EMA50 และ RSI14 อยู่ระหว่าง 40-60
+- None      : ค่าใดค่าหนึ่งของ close / EMA20 / EMA50 / EMA200 ว่าง หรือไม่เข้าเงื่อนไข
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def classify_trend_vec(c, e20, e50, e200, r):
+    """แบบ vectorized (รับ array/Series ยาวเท่ากัน) คืน object array ของ uptrend/downtrend/sideway/None
+    ใช้ซ้ำได้จากที่อื่น (เช่น compute_signals) โดยไม่ต้องอ่าน trend_status จาก DB"""
+    c, e20, e50, e200, r = (np.asarray(pd.to_numeric(x, errors="coerce"), dtype=float) for x in (c, e20, e50, e200, r))
+    valid = ~(np.isnan(c) | np.isnan(e20) | np.isnan(e50) | np.isnan(e200))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        near_e50 = np.abs(c - e50) / np.abs(e50) <= 0.02   # อยู่ในกรอบ ±2% ของ EMA50
+    up   = valid & (c > e200) & (e20 > e50)
+    down = valid & (c < e200) & (e20 < e50)
+    side = valid & ~np.isnan(r) & (e50 != 0) & near_e50 & (r >= 40) & (r <= 60)
+    return np.select([up, down, side], ["uptrend", "downtrend", "sideway"], default=None)
@@ -4,7 +4,7 @@ import pandas as pd
 from datetime import datetime
 import sys
 import os
-import pyodbc
+import db
 
 from PyN_Library import fncPostgres as fpg
 
@@ -46,16 +46,6 @@ def UpdatePortfolio():
   #print columns
   # print(dfPortfolioList.columns)
 
-  #create table if not exists
-  conn_str = (
-      f"DRIVER={{PostgreSQL Unicode}};"
-      f"SERVER={os.getenv('posql_host')};"
-      f"PORT={os.getenv('posql_port')};"
-      f"DATABASE={os.getenv('posql_db')};"
-      f"UID={os.getenv('posql_user')};"
-      f"PWD={os.getenv('posql_password')};"
-  )
-  conn = pyodbc.connect(conn_str)
   # columns:
   # 'symbol', 'flag', 'nvdrFlag', 'marketPrice', 'amount',
   #  'marketdescription', 'marketValue', 'profit', 'percentProfit',
@@ -97,12 +87,11 @@ def UpdatePortfolio():
   sqlCreateTable = fpg.generate_create_table_script(df=dfPortfolioList,table_name="portfolio_stock",use_index=False)
   # print(sqlCreateTable)
 
-  cursor = conn.cursor()
-  cursor.execute(sqlCreateTable)
-  conn.commit()
-
-  #bulk insert dataframe to table
-  fpg.bulk_copy_dataframe_to_table(df=dfPortfolioList, table_name="portfolio_stock", conn_params=cfg.postgresqldb_args)
+  #create table if not exists + bulk insert (COPY เข้า temp staging แล้ว append) ใน connection/transaction เดียวจาก pool กลาง
+  with db.connect() as conn:
+    with conn.cursor() as cursor:
+      cursor.execute(sqlCreateTable)
+    db.copy_upsert(conn, dfPortfolioList, "portfolio_stock", list(dfPortfolioList.columns), key=None, touch=None)
 
 
 if __name__ == "__main__":
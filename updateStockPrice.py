@@ -1,115 +1,304 @@
 # อัพเดต ราคาหุ้น จาก settrade_v2 โดยใช้ symbol list จาก postgresql table stocksettrade_stocklist
 # แล้วอัพเดตลง postgresql table stock_price_history โดย insert เมื่อเป็นข้อมูลใหม่ ,merge เมื่อมีข้อมูล symbol+date ซ้ำ
-# สร้างตาราง stock_price_history ด้วยตนเองก่อนรันสคริปต์นี้ ถ้ายยังไม่มี
- 
+# - รวม candle ของทุก symbol เป็น DataFrame เดียว แล้วเขียนครั้งเดียวด้วย COPY เข้า staging + INSERT ... ON CONFLICT
+# - คุมอัตราเรียก API ด้วย token bucket (PRICE_API_RPS) แทน time.sleep(1) ต่อ symbol
+# - ดึงหลาย symbol พร้อมกันด้วย thread pool (PRICE_FETCH_WORKERS) + retry แบบ exponential backoff
+# - วางแผนดึงเฉพาะช่วงวันที่ขาด (gap) ของแต่ละ symbol ภายใน PRICE_GAP_LOOKBACK_DAYS วันล่าสุด symbol ที่ครบแล้วจะไม่ถูกเรียกเลย
+# - วันที่ API ตอบกลับว่าไม่มีแท่ง (หุ้นพักการซื้อขาย / ยังไม่เข้าตลาด) จดไว้ใน stock_price_no_data ไม่ขอซ้ำทุกคืน
 
 
-import pyodbc
+
+import io
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import db
+from psycopg2.extras import execute_values
 import initialApp as cfg
 from dotenv import load_dotenv
 load_dotenv()
 import os
 from settrade_v2 import Investor
+import numpy as np
 import pandas as pd
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 import time
-import sys
 
-from PyN_Library import fncDateTime as fDtTm
+API_RPS   = float(os.getenv("PRICE_API_RPS", "5"))    # จำนวน request ต่อวินาทีที่ยอมให้เรียก settrade
+API_BURST = int(os.getenv("PRICE_API_BURST", "5"))    # จำนวน request ที่ยิงติดกันได้ก่อนโดนจำกัด
+FETCH_WORKERS = int(os.getenv("PRICE_FETCH_WORKERS", "4"))   # จำนวน request ที่ค้างพร้อมกันได้
+FETCH_RETRIES = int(os.getenv("PRICE_FETCH_RETRIES", "3"))   # retry ต่อ symbol เมื่อ error
+BACKOFF_BASE  = float(os.getenv("PRICE_BACKOFF_BASE", "1"))  # วินาที, รอ base * 2^attempt (+ jitter)
+GAP_LOOKBACK_DAYS = int(os.getenv("PRICE_GAP_LOOKBACK_DAYS", "60"))  # ตรวจหาวันที่ขาดย้อนหลังกี่วัน
+CALENDAR_PROBE    = os.getenv("PRICE_CALENDAR_PROBE", "PTT")         # symbol อ้างอิงสำหรับหาวันทำการใหม่ (เรียก API 1 ครั้ง)
+CANDLE_LIMIT      = 1000                                             # limit ของ get_candlestick ต่อ request
 
-def main():
+PRICE_COLS = ["symbol", "date", "open", "high", "low", "close", "volume"]
 
-    investor = Investor( **cfg.args_Investor )
-    equity = investor.Equity(account_no=os.getenv("account_no"))
-    market = investor.MarketData()
-    # print(market)
-
-    # date = datetime.now().strftime("%Y-%m-%d")
-    startDate = datetime.now().strftime("%Y-%m-%d")
-    endDate = datetime.now().strftime("%Y-%m-%d")
-    # print(date)
-
-    conn_str = (
-        f"DRIVER={{PostgreSQL Unicode}};"
-        f"SERVER={os.getenv('posql_host')};"
-        f"PORT={os.getenv('posql_port')};"
-        f"DATABASE={os.getenv('posql_db')};"
-        f"UID={os.getenv('posql_user')};"
-        f"PWD={os.getenv('posql_password')};"
-    )
-    # print(conn_str)
-    # sys.exit()
-    conn = pyodbc.connect(conn_str)
-
-
-    sqlCreateTable = """
-    CREATE TABLE IF NOT EXISTS stock_price_history (
-        symbol VARCHAR(20) NOT NULL,
-        date DATE NOT NULL, 
-        open NUMERIC(18,6),
-        high NUMERIC(18,6),
-        low NUMERIC(18,6),
-        close NUMERIC(18,6),
-        volume BIGINT,
-        PRIMARY KEY (symbol, date)
-    );
-    """
-    cursor = conn.cursor()
-    cursor.execute(sqlCreateTable)
-    conn.commit()
+DDL = """
+CREATE TABLE IF NOT EXISTS stock_price_history (
+    symbol VARCHAR(20) NOT NULL,
+    date DATE NOT NULL,
+    open NUMERIC(18,6),
+    high NUMERIC(18,6),
+    low NUMERIC(18,6),
+    close NUMERIC(18,6),
+    volume BIGINT,
+    PRIMARY KEY (symbol, date)
+);
+"""
+
+NO_DATA_DDL = """
+CREATE TABLE IF NOT EXISTS stock_price_no_data (
+    symbol VARCHAR(20) NOT NULL,
+    date DATE NOT NULL,
+    checked_at TIMESTAMP DEFAULT now(),
+    PRIMARY KEY (symbol, date)
+);
+"""
+
+STAGING_DDL = """
+CREATE TEMP TABLE stg_price_history (LIKE stock_price_history INCLUDING DEFAULTS) ON COMMIT DROP;
+"""
+
+MERGE_SQL = """
+INSERT INTO stock_price_history (symbol, date, open, high, low, close, volume)
+SELECT symbol, date, open, high, low, close, volume FROM stg_price_history
+ON CONFLICT (symbol, date) DO UPDATE SET
+    open = EXCLUDED.open,
+    high = EXCLUDED.high,
+    low = EXCLUDED.low,
+    close = EXCLUDED.close,
+    volume = EXCLUDED.volume;
+"""
+
+
+class TokenBucket:
+    """จำกัดอัตราเรียก API: เติม token rate ต่อวินาที สะสมได้สูงสุด capacity, acquire() รอจนได้ 1 token (thread-safe)"""
+
+    def __init__(self, rate, capacity=None, clock=time.monotonic, sleep=time.sleep):
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(1.0, rate))
+        self.clock = clock
+        self.sleep = sleep
+        self.tokens = self.capacity
+        self.ts = clock()
+        self.lock = threading.Lock()
 
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = self.clock()
+                self.tokens = min(self.capacity, self.tokens + (now - self.ts) * self.rate)
+                self.ts = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            self.sleep(wait)
 
 
-    # cursor = conn.cursor()
-    cursor.execute("SELECT symbol FROM settrade_stocklist  ORDER BY symbol ;")
-    symbols = [row[0] for row in cursor.fetchall()]
+def candles_to_frame(symbol, candles):
+    """แปลงผล get_candlestick(normalized=True) เป็น DataFrame ตาม PRICE_COLS"""
+    df = pd.DataFrame(candles)
+    df['symbol'] = symbol
+    df['date'] = (pd.to_datetime(df['time'], unit='s')+ timedelta(hours=7)).dt.date # แปลง timestamp เป็น date
+    # แปลงคอลัมน์ที่เป็นตัวเลขให้เป็นชนิดตัวเลข
+    for c in ['open', 'high', 'low', 'close', 'volume']:
+        df[c] = pd.to_numeric(df[c])
+    df['volume'] = df['volume'].round().astype('Int64')
+    return df[PRICE_COLS]
 
-    for symbol in symbols:
-        print(f"Processing symbol: {symbol}")
-        start_time = time.time()
+
+def fetch_one(market, bucket, symbol, startDate, endDate, retries=FETCH_RETRIES, backoff=BACKOFF_BASE):
+    """ดึง candle ของ symbol เดียว พร้อม retry แบบ exponential backoff คืน (frame หรือ None, dict รายงาน)"""
+    t0 = time.time()
+    report = {"symbol": symbol, "start": str(startDate), "end": str(endDate), "status": "failed", "rows": 0, "attempts": 0, "seconds": 0.0, "error": None}
+    for attempt in range(retries + 1):
+        bucket.acquire()
+        report["attempts"] = attempt + 1
         try:
             candles = market.get_candlestick(
                 symbol=symbol,
                 interval="1d",
-                limit=1000,
+                limit=CANDLE_LIMIT,
                 normalized=True,
                 start=f"{startDate}T00:00",
                 end=f"{endDate}T23:59",
             )
-            if not candles:
-                print(f"No data returned for symbol: {symbol}")
-                continue
-
-            df = pd.DataFrame(candles)
-            # df.to_csv("debug_candles.csv", index=False)  # Debug: Save to CSV to inspect
-
-            df['date'] = (pd.to_datetime(df['time'], unit='s')+ timedelta(hours=7)).dt.date # แปลง timestamp เป็น date
-            # แปลงคอลัมน์ที่เป็นตัวเลขให้เป็นชนิดตัวเลข
-            df['open'] = pd.to_numeric(df['open'])
-            df['high'] = pd.to_numeric(df['high'])
-            df['low'] = pd.to_numeric(df['low'])
-            df['close'] = pd.to_numeric(df['close'])
-            df['volume'] = pd.to_numeric(df['volume'])
-
-            for index, row in df.iterrows():
-                cursor.execute("""
-                    INSERT INTO stock_price_history (symbol, date, open, high, low, close, volume)
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
-                    ON CONFLICT (symbol, date) DO UPDATE SET
-                        open = EXCLUDED.open,
-                        high = EXCLUDED.high,
-                        low = EXCLUDED.low,
-                        close = EXCLUDED.close,
-                        volume = EXCLUDED.volume;
-                """, symbol, row['date'], row['open'], row['high'], row['low'], row['close'], row['volume'])
-            conn.commit()
-            print(f"process in {time.time() - start_time} second , Updated data for symbol: {symbol}")
+            frame = candles_to_frame(symbol, candles) if candles else None
+            report.update(status="ok" if frame is not None else "empty", rows=0 if frame is None else len(frame), error=None)
+            break
         except Exception as e:
-            print(f"Error processing symbol {symbol}: {e}")
-        time.sleep(1)  # เพื่อหลีกเลี่ยงการเรียก API เร็วเกินไป
-    cursor.close()
-    conn.close()
+            frame = None
+            report["error"] = str(e)
+            if attempt < retries:
+                time.sleep(backoff * (2 ** attempt) + random.uniform(0, backoff))
+    report["seconds"] = round(time.time() - t0, 3)
+    return frame, report
+
+
+def fetch_plan(market, plan, workers=FETCH_WORKERS, rps=API_RPS, burst=API_BURST,
+               retries=FETCH_RETRIES, backoff=BACKOFF_BASE):
+    """ดึง candle ตามแผน [(symbol, start, end), ...] พร้อมกันด้วย thread pool ภายใต้งบ rps เดียวกัน
+    market คืออะไรก็ได้ที่มี get_candlestick(...) แบบ settrade_v2 MarketData (ใช้ fake stub ทดสอบได้)
+    คืน (DataFrame ราคาทั้งหมด, DataFrame รายงานต่อ request)"""
+    bucket = TokenBucket(rps, burst)
+    frames, reports = [], []
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = [pool.submit(fetch_one, market, bucket, sym, start, end, retries, backoff) for sym, start, end in plan]
+        for fut in as_completed(futures):
+            frame, report = fut.result()
+            if frame is not None:
+                frames.append(frame)
+            reports.append(report)
+    price = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=PRICE_COLS)
+    report = pd.DataFrame(reports, columns=["symbol", "start", "end", "status", "rows", "attempts", "seconds", "error"])
+    return price, report.sort_values(["symbol", "start"], ignore_index=True)
+
+
+def fetch_candles(market, symbols, startDate, endDate, **kwargs):
+    """ดึงช่วงวันที่เดียวกันให้ทุก symbol (เหมือนพฤติกรรมเดิม)"""
+    return fetch_plan(market, [(sym, startDate, endDate) for sym in symbols], **kwargs)
+
+
+# -------- gap planner --------
+def fetch_recent_dates(conn, since):
+    """วันที่ที่มีราคาแล้วของทุก symbol ตั้งแต่ since"""
+    return pd.read_sql("SELECT symbol, date FROM stock_price_history WHERE date >= %s;", conn, params=(since,))
+
+
+def fetch_no_data_dates(conn, since):
+    """วันที่ที่เคยขอแล้ว API ไม่มีแท่งให้ (นับเป็น "มีแล้ว" ตอนวางแผน)"""
+    return pd.read_sql("SELECT symbol, date FROM stock_price_no_data WHERE date >= %s;", conn, params=(since,))
+
+
+def no_data_dates(report, price, calendar, today):
+    """วันทำการในช่วงที่ขอสำเร็จ (ok/empty) แต่ไม่ได้แท่งกลับมา คืน DataFrame[symbol, date]
+    ไม่นับวันนี้ (แท่งของวันอาจยังไม่ออก) และไม่นับ request ที่ failed (จะขอใหม่รอบหน้า)"""
+    cal = pd.Series(sorted(d for d in calendar if d < today), dtype=object)
+    got = set(zip(price["symbol"], price["date"]))
+    rows = []
+    for r in report[report["status"].isin(["ok", "empty"])].itertuples(index=False):
+        start, end = date.fromisoformat(r.start), date.fromisoformat(r.end)
+        rows += [(r.symbol, d) for d in cal[(cal >= start) & (cal <= end)] if (r.symbol, d) not in got]
+    return pd.DataFrame(rows, columns=["symbol", "date"])
+
+
+def record_no_data(conn, df, since):
+    """จดวันที่ไม่มีแท่ง แล้วลบรายการที่เก่ากว่าหน้าต่าง gap ทิ้ง"""
+    with conn.cursor() as cur:
+        if not df.empty:
+            execute_values(cur, "INSERT INTO stock_price_no_data (symbol, date) VALUES %s ON CONFLICT DO NOTHING;",
+                           list(df.itertuples(index=False, name=None)))
+        cur.execute("DELETE FROM stock_price_no_data WHERE date < %s;", (since,))
+    conn.commit()
+
+
+def trading_calendar(known_dates, since, today, probe_dates=None):
+    """ปฏิทินวันทำการ = วันที่ที่มีราคาอยู่แล้วใน DB + วันทำการใหม่หลังวันล่าสุด
+    วันใหม่เอาจาก probe_dates (วันที่ที่ symbol อ้างอิงได้จาก API) ถ้าไม่มีใช้วันจันทร์-ศุกร์แทน"""
+    known = set(known_dates)
+    last = max(known) if known else since - timedelta(days=1)
+    if probe_dates is None:
+        probe_dates = [d.date() for d in pd.bdate_range(last + timedelta(days=1), today)]
+    return sorted(known | {d for d in probe_dates if last < d <= today})
+
+
+def plan_gaps(existing, symbols, calendar, since, chunk=CANDLE_LIMIT):
+    """หาช่วงวันที่ขาดของแต่ละ symbol เทียบกับปฏิทิน คืน [(symbol, start, end), ...]
+    - นับเฉพาะวันตั้งแต่วันแรกที่ symbol มีราคาในช่วง (ไม่ขอย้อนไปก่อน IPO); ไม่มีเลย = ขอทั้งช่วง
+    - วันที่ขาดติดกันรวมเป็นช่วงเดียว แล้วแบ่งไม่เกิน chunk วันทำการต่อ request
+    - symbol ที่ครบแล้วไม่อยู่ในแผนเลย"""
+    cal = pd.Index(calendar)
+    if cal.empty:
+        return []
+    have = existing.assign(pos=cal.get_indexer(existing["date"])).query("pos >= 0").groupby("symbol")["pos"].agg(list)
+    plan = []
+    for sym in symbols:
+        mask = np.ones(len(cal), dtype=bool)
+        if sym in have.index:
+            got = np.asarray(have[sym])
+            mask[:got.min()] = False
+            mask[got] = False
+        missing = np.flatnonzero(mask)
+        if missing.size == 0:
+            continue
+        for run in np.split(missing, np.flatnonzero(np.diff(missing) != 1) + 1):
+            for i in range(0, len(run), chunk):
+                part = run[i:i + chunk]
+                start = cal[part[0]] if sym in have.index else min(since, cal[part[0]])
+                plan.append((sym, start, cal[part[-1]]))
+    return plan
+
+
+def copy_upsert_prices(conn, df):
+    """เขียนราคาทั้งหมดด้วย COPY เข้า temp staging แล้ว merge ครั้งเดียว คืนจำนวนแถว"""
+    if df.empty:
+        return 0
+    # ON CONFLICT แก้แถวเดียวกันซ้ำในคำสั่งเดียวไม่ได้ → ตัดแถวซ้ำก่อน
+    df = df.drop_duplicates(["symbol", "date"], keep="last")
+    buf = io.StringIO()
+    df[PRICE_COLS].to_csv(buf, index=False, header=False, na_rep="")
+    buf.seek(0)
+    with conn.cursor() as cur:
+        cur.execute(STAGING_DDL)
+        cur.copy_expert(f"COPY stg_price_history ({', '.join(PRICE_COLS)}) FROM STDIN WITH (FORMAT csv)", buf)
+        cur.execute(MERGE_SQL)
+    conn.commit()
+    return len(df)
+
+
+def main():
+
+    investor = Investor( **cfg.args_Investor )
+    market = investor.MarketData()
+
+    today = date.today()
+    since = today - timedelta(days=GAP_LOOKBACK_DAYS)
+
+    # ยืม connection เฉพาะช่วงอ่าน/เขียน ไม่ถือค้างระหว่างเรียก API หลายนาที
+    with db.connect() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(DDL)
+            cursor.execute(NO_DATA_DDL)
+            cursor.execute("SELECT symbol FROM settrade_stocklist  ORDER BY symbol ;")
+            symbols = [row[0] for row in cursor.fetchall()]
+        conn.commit()
+        existing = fetch_recent_dates(conn, since)
+        no_data = fetch_no_data_dates(conn, since)
+
+    # 1) ปฏิทินวันทำการ: วันที่ที่มีใน DB + วันใหม่ที่ symbol อ้างอิงได้จริงจาก API
+    #    probe ใช้แค่ดูวันที่ ไม่เขียนแท่งของ probe (symbol อ้างอิงถูกดึงตามแผนปกติเหมือนตัวอื่น)
+    start_all = time.time()
+    last_known = existing["date"].max() if not existing.empty else since - timedelta(days=1)
+    probe_dates = []
+    if last_known < today:
+        probe, probe_report = fetch_one(market, TokenBucket(API_RPS, API_BURST), CALENDAR_PROBE, last_known + timedelta(days=1), today)
+        if probe is not None:
+            probe_dates = probe["date"].tolist()
+        elif probe_report["status"] == "failed":
+            probe_dates = None  # probe ใช้ไม่ได้ → ถือว่าวันจันทร์-ศุกร์เป็นวันทำการ
+    calendar = trading_calendar(existing["date"], since, today, probe_dates)
+
+    # 2) วางแผนดึงเฉพาะช่วงที่ขาด (วันที่เคยได้คำตอบว่าไม่มีแท่งถือว่าครบแล้ว)
+    plan = plan_gaps(pd.concat([existing, no_data], ignore_index=True), symbols, calendar, since)
+    n_plan_syms = len({p[0] for p in plan})
+    print(f"gap plan: {len(plan)} requests for {n_plan_syms} symbols, skip {len(symbols) - n_plan_syms} up-to-date symbols")
+
+    price, report = fetch_plan(market, plan)
+    counts = report["status"].value_counts().to_dict()
+    print(f"fetched {len(plan)} requests in {time.time() - start_all:.1f} second => {counts}")
+    for r in report[report["status"] == "failed"].itertuples(index=False):
+        print(f"Error processing symbol {r.symbol} after {r.attempts} attempts: {r.error}")
+
+    missing = no_data_dates(report, price, calendar, today)
+    start_time = time.time()
+    with db.connect() as conn:
+        n = copy_upsert_prices(conn, price)
+        record_no_data(conn, missing, since)
+    print(f"process in {time.time() - start_time:.2f} second , Upserted {n:,} rows, {len(missing):,} symbol-days without data")
     print("Stock price update completed.")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()